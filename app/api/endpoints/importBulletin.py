@@ -1,7 +1,7 @@
 import base64
-import requests
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form
 from app.core.config import settings
+from app.services.api_service import send_request
 
 router = APIRouter()
 
@@ -27,8 +27,8 @@ async def import_document(file: UploadFile = File(...), nomDocument: str = Form(
             "extension": extension,
         }
 
-        # Faire la requête POST avec la librairie requests
-        response = requests.post(url, headers=headers, json=payload)
+        # Faire la requête POST via le client HTTP partagé
+        response = await send_request("POST", url, headers=headers, json=payload)
         
         if response.status_code == 200:
             return {"message": "Document imported successfully."}
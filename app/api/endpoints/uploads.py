@@ -1,29 +1,33 @@
 import base64
-import json
 import shutil
-import time
 import zipfile  # Assurez-vous d'importer le module zipfile standard
 
 # Importation des modules nécessaires
 import asyncio
+import httpx
 import fitz  # PyMuPDF
-from fastapi import FastAPI, HTTPException, APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, APIRouter, WebSocket
 from fastapi.responses import JSONResponse, FileResponse
-from openpyxl import load_workbook
 from app.core.config import settings
-import openpyxl
 from docx import Document
 import os
 import logging
 from pydantic import BaseModel
-import requests
 import subprocess
 
-from app.services.api_service import fetch_api_data
-from app.services.excel_service import process_excel_file, update_excel_with_appreciations
-from app.utils.date_utils import sum_durations
-from starlette.websockets import WebSocketDisconnect
-from datetime import datetime
+from app.services.api_service import send_request
+from app.services.resilience import send_with_retry, CircuitOpenError
+from app.services.cache_service import fetch_cached
+from app.services.snapshot_service import get_or_load
+from app.services import absence_store, progress_service
+from app.services.excel_service import ClassTable, process_excel_file, update_excel_with_appreciations
+from app.utils.frequentation_utils import select_frequentations
+from app.utils.period_index import period_index_for
+from app.services.template_cache import get_template, template_cache_stats
+from app.services.template_registry import get_registry, registry_stats
+from app.services.column_plans import get_plan, plan_stats
+from app.utils.name_matching import NameIndex
+from app.utils.sheet_utils import OutputSheet, SheetBuffer, normalize_title, read_sheet
 
 
 
@@ -37,10 +41,9 @@ app = FastAPI()
 # Création d'un routeur pour organiser les routes
 router = APIRouter()
 
-# Variable globale pour stocker la progression
-# Liste des connexions WebSocket actives
-active_connections = []
-progress_data = {}
+# Écritures en cours des classeurs fusionnés (artefacts), gardées référencées jusqu'à leur fin
+_artifact_tasks = set()
+
 
 # Définition du modèle de réponse pour les uploads
 class UploadResponse(BaseModel):
@@ -53,162 +56,71 @@ class DocumentUrls(BaseModel):
     wordUrl: str
 
 
-# Fonction pour normaliser les titres en supprimant les caractères non alphanumériques et en les mettant en minuscules
-def normalize_title(title):
-    import re
-    if not isinstance(title, str):
-        title = str(title)
-    return re.sub(r'\W+', '', title).lower()
-
-
-class_ids = {
-    "MAPI": "ID_MAPI_001",
-    "MAGI": "ID_MAGI_001",
-    "MEFIM": "ID_MEFIM_001",
-    "MAPI_S2": "ID_MAPI_S2_001",
-    "MAGI_S2": "ID_MAGI_S2_001",
-    "MEFIM_S2": "ID_MEFIM_S2_001",
-    "MAPI_S3": "ID_MAPI_S3_001",
-    "MAGI_S3": "ID_MAGI_S3_001",
-    "MEFIM_S3": "ID_MEFIM_S3_001",
-    "MAPI_S4": "ID_MAPI_S4_001",
-    "MAGI_S4": "ID_MAGI_S4_001",
-    "MEFIM_S4": "ID_MEFIM_S4_001",
-    "BG_ALT_S1": "ID_BG_ALT_S1_001",
-    "BG_ALT_S2": "ID_BG_ALT_S2_001",
-    "BG_ALT_S3": "ID_BG_ALT_S3_001",
-    "BG_ALT_S4": "ID_BG_ALT_S4_001",
-    "BG_ALT_S5": "ID_BG_ALT_S5_001",
-    "BG_ALT_S6": "ID_BG_ALT_S6_001",
-    "BG_TP_1": "ID_BG_TP_1_001",
-    "BG_TP_2": "ID_BG_TP_2_001",
-    "BG_TP_3": "ID_BG_TP_3_001",
-    "BG_TP_4": "ID_BG_TP_4_001",
-    "BG_TP_5": "ID_BG_TP_5_001",
-    "BG_TP_6": "ID_BG_TP_6_001"
-}
+# Passe à True si Yparéo refuse les filtres par groupe : on ne retente plus la récupération ciblée
+scoped_fetch_unavailable = False
+
+def _copy_apprenant(apprenant):
+    """Copie un apprenant issu du cache pour que les mises à jour d'un job ne le modifient pas."""
+    if not isinstance(apprenant, dict):
+        return apprenant
+    copy = dict(apprenant)
+    copy['informationsCourantes'] = dict(apprenant.get('informationsCourantes') or {})
+    return copy
 
 # Fonction pour récupérer les données d'API en parallèle
-async def fetch_api_data_for_template(headers, class_name=None):
-    api_url_mapping = {
-        "MAGI": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MAGI_S2": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MAGI_S3": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MAGI_S4": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MEFIM": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MEFIM_S2": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MEFIM_S3": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MEFIM_S4": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MAPI": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MAPI_S2": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MAPI_S3": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "MAPI_S4": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_ALT_S1": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_ALT_S2": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_ALT_S3": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_ALT_S4": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_ALT_S5": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_ALT_S6": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_TP_1": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_TP_2": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_TP_3": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_TP_4": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_TP_5": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        },
-        "BG_TP_6": {
-            "apprenants_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            "groupes_url": f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2"
-        }
-    }
+def _scoped_group_names(class_name):
+    # Groupes de la classe si ses apprenants sont récupérés groupe par groupe, sinon None
+    class_template = get_registry().get_class(class_name) if class_name else None
+    if class_template is None or not settings.YPAREO_SCOPED_FETCH_ENABLED or scoped_fetch_unavailable:
+        return None
+    return class_template.group_names or None
+
+
+async def fetch_api_data_for_template(headers, class_name=None, scoped=True):
+    """
+    Données de référence et absences de la classe. Avec scoped, les apprenants et fréquentations
+    ne sont demandés que pour les groupes de la classe (si elle en déclare) ; scoped=False force
+    la récupération complète, pour les noms introuvables dans les groupes de la classe.
+    """
+    # URLs des données de référence et groupes de la classe : déclarés dans le registre des templates
+    api_urls = get_registry().reference_urls(class_name)
+
+    # Une fois la classe connue, seuls les apprenants et fréquentations de ses groupes sont demandés
+    group_names = _scoped_group_names(class_name) if scoped else None
+    if group_names:
+        snapshot_key = "|".join([class_name] + api_urls)
+        loader = lambda: _fetch_class_reference_data(headers, api_urls, group_names)
+    else:
+        snapshot_key = "|".join(api_urls)
+        loader = lambda: _fetch_reference_data(headers, api_urls)
 
+    # Les données de référence viennent de l'instantané sur disque s'il existe ; les absences sont toujours à jour
+    reference_data, absences_data = await asyncio.gather(
+        get_or_load(snapshot_key, loader),
+        _fetch_absence_totals(headers),
+    )
+    api_data, groupes_dict, frequentes_dict, periodes_dict = reference_data
+
+    # L'instantané est partagé entre les jobs : chacun travaille sur des copies des apprenants
+    api_data = {key: _copy_apprenant(apprenant) for key, apprenant in api_data.items()}
+    return api_data, groupes_dict, absences_data, frequentes_dict, periodes_dict
+
+
+# Totaux d'absences par apprenant : stockage local (synchronisé de façon incrémentale) ou, à défaut, année complète
+async def _fetch_absence_totals(headers):
+    try:
+        if settings.ABSENCE_STORE_ENABLED:
+            return await absence_store.get_absence_totals(headers)
+        absences_url = settings.YPAERO_BASE_URL + absence_store.ABSENCES_PATH.format(debut=settings.ABSENCES_PERIOD_START, fin=settings.ABSENCES_PERIOD_END)
+        return absence_store.summarize_absences(await fetch_cached(absences_url, headers))
+    except Exception as e:
+        logger.error(f"API request failed for absences: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch API data")
 
-    if class_name and class_name in api_url_mapping:
-        urls = api_url_mapping[class_name]
-        api_urls = [
-            urls["apprenants_url"],
-            urls["groupes_url"],
-            f"https://groupe-espi.ymag.cloud/index.php/r/v1/absences/01-09-2023/15-09-2024",
-            f"https://groupe-espi.ymag.cloud/index.php/r/v1/apprenants/frequentes?codesPeriode=2",
-            f"https://groupe-espi.ymag.cloud/index.php/r/v1/periodes"
-        ]
-    else:
-        api_urls = [
-            f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/apprenants?codesPeriode=2",
-            f"https://groupe-espi.ymag.cloud/index.php/r/v1/formation-longue/groupes?codesPeriode=2",
-            f"https://groupe-espi.ymag.cloud/index.php/r/v1/absences/01-09-2023/15-09-2024",
-            f"https://groupe-espi.ymag.cloud/index.php/r/v1/apprenants/frequentes?codesPeriode=2",
-            f"https://groupe-espi.ymag.cloud/index.php/r/v1/periodes"
-        ]
 
-    api_data_futures = [fetch_api_data(url, headers) for url in api_urls]
+# Récupère et normalise les données de référence (apprenants, groupes, fréquentations, périodes)
+async def _fetch_reference_data(headers, api_urls):
+    api_data_futures = [fetch_cached(url, headers) for url in api_urls]
     results = await asyncio.gather(*api_data_futures, return_exceptions=True)
 
     for i, result in enumerate(results):
@@ -222,8 +134,80 @@ async def fetch_api_data_for_template(headers, class_name=None):
     if any(isinstance(result, Exception) for result in results):
         raise HTTPException(status_code=500, detail="Failed to fetch API data")
 
-    api_data, raw_groupes_data, absences_data, frequentes_data, periodes_dict = results
-    
+    return _normalize_reference_data(*results)
+
+
+def _group_filter_applied(apprenants_results, group_codes):
+    """
+    Vérifie que Yparéo a bien filtré les apprenants par groupe : une réponse 200 qui ignore
+    codesGroupe renverrait toute l'école pour chaque groupe. Le filtre est jugé ignoré si
+    plusieurs groupes reçoivent exactement les mêmes apprenants, ou si la plupart des apprenants
+    dont le groupe courant est connu n'appartiennent à aucun des groupes demandés.
+    """
+    payloads = [set(result) for result in apprenants_results if isinstance(result, dict) and result]
+    if len(payloads) > 1 and all(payload == payloads[0] for payload in payloads[1:]):
+        return False
+    wanted = set(group_codes)
+    known = outside = 0
+    for result in apprenants_results:
+        for apprenant in (result.values() if isinstance(result, dict) else ()):
+            code_groupe = (apprenant.get('informationsCourantes') or {}).get('codeGroupe') if isinstance(apprenant, dict) else None
+            if code_groupe is not None:
+                known += 1
+                outside += str(code_groupe) not in wanted
+    return not known or outside * 2 <= known
+
+
+# Variante ciblée : apprenants et fréquentations demandés groupe par groupe, en parallèle
+async def _fetch_class_reference_data(headers, api_urls, group_names):
+    global scoped_fetch_unavailable
+    if scoped_fetch_unavailable:
+        return await _fetch_reference_data(headers, api_urls)
+
+    try:
+        raw_groupes_data, periodes_dict = await asyncio.gather(
+            fetch_cached(api_urls[1], headers),
+            fetch_cached(api_urls[3], headers),
+        )
+        group_codes = sorted({
+            str(groupe['codeGroupe'])
+            for groupe in raw_groupes_data.values()
+            if isinstance(groupe, dict) and 'codeGroupe' in groupe and groupe.get('nomGroupe') in group_names
+        })
+        if not group_codes:
+            logger.warning(f"No Yparéo group matches {group_names}, falling back to full fetch")
+            return await _fetch_reference_data(headers, api_urls)
+
+        apprenants_urls = [f"{settings.YPAERO_BASE_URL}{settings.YPAREO_GROUP_APPRENANTS_PATH.format(code_groupe=code, code_periode=settings.YPAREO_CODE_PERIODE)}" for code in group_codes]
+        frequentes_urls = [f"{settings.YPAERO_BASE_URL}{settings.YPAREO_GROUP_FREQUENTES_PATH.format(code_groupe=code, code_periode=settings.YPAREO_CODE_PERIODE)}" for code in group_codes]
+        results = await asyncio.gather(*[fetch_cached(url, headers) for url in apprenants_urls + frequentes_urls])
+    except HTTPException as e:
+        if e.status_code in (400, 404, 501):
+            scoped_fetch_unavailable = True
+        logger.warning(f"Group-scoped Yparéo fetch failed ({e.detail}), falling back to full fetch")
+        return await _fetch_reference_data(headers, api_urls)
+
+    apprenants_results = results[:len(group_codes)]
+    if not _group_filter_applied(apprenants_results, group_codes):
+        scoped_fetch_unavailable = True
+        logger.warning("Yparéo ignored the codesGroupe filter, falling back to full fetch")
+        return await _fetch_reference_data(headers, api_urls)
+
+    # Fusion des réponses par groupe (un apprenant peut apparaître dans plusieurs groupes)
+    api_data, frequentes_data = {}, {}
+    for result in apprenants_results:
+        api_data.update(result)
+    for result in results[len(group_codes):]:
+        frequentes_data.update(result)
+    logger.info(f"Group-scoped fetch: {len(api_data)} apprenants in {len(group_codes)} groups")
+
+    return _normalize_reference_data(api_data, raw_groupes_data, frequentes_data, periodes_dict)
+
+
+def _normalize_reference_data(api_data, raw_groupes_data, frequentes_data, periodes_dict):
+    # Les réponses proviennent du cache partagé : on travaille sur des copies des apprenants
+    api_data = {key: _copy_apprenant(apprenant) for key, apprenant in api_data.items()}
+
     # Construction du dictionnaire des groupes
     groupes_dict = {}
     for groupe in raw_groupes_data.values():
@@ -237,65 +221,12 @@ async def fetch_api_data_for_template(headers, class_name=None):
     
     logger.debug(f"Groupes data structure: {groupes_dict}")
 
-    # Traitement des périodes
-    periode_2023_2024 = next(
-        (periode for periode in periodes_dict.values() 
-        if periode.get('codePeriode') == 2), None
-    )
+    # Période de travail : celle demandée à Yparéo (codesPeriode), sinon la période en cours
+    period_index = period_index_for(periodes_dict)
+    periode = period_index.by_code(settings.YPAREO_CODE_PERIODE) or period_index.current()
 
-    # Traitement des fréquentations avec vérification des dates
-    # Traitement des fréquentations avec vérification des dates
-    frequentes_dict = {}
-    for frequentation in frequentes_data.values():
-        code_apprenant = str(frequentation.get('codeApprenant'))  # Convertir en string
-        date_debut_frequentation = frequentation.get('dateDeb')
-        date_fin_frequentation = frequentation.get('dateFin')
-        
-        # Vérifier que toutes les données nécessaires sont présentes
-        if not all([code_apprenant, date_debut_frequentation, date_fin_frequentation]):
-            logger.warning(f"Missing required data for frequentation: code_apprenant={code_apprenant}, "f"date_debut={date_debut_frequentation}, date_fin={date_fin_frequentation}")
-            continue
-
-        if periode_2023_2024:
-            try:
-                # Vérifier que les dates sont bien au format attendu
-                if not isinstance(date_debut_frequentation, str) or not isinstance(date_fin_frequentation, str):
-                    logger.warning(f"Invalid date format for frequentation: date_debut={date_debut_frequentation}, "f"date_fin={date_fin_frequentation}")
-                    continue
-
-                # S'assurer que periode_2023_2024 contient les bonnes données
-                periode_debut_str = periode_2023_2024.get('dateDeb')
-                periode_fin_str = periode_2023_2024.get('dateFin')
-                
-                if not periode_debut_str or not periode_fin_str:
-                    logger.warning("Missing period dates in periode_2023_2024")
-                    continue
-
-                # Parser les dates
-                date_debut = datetime.strptime(date_debut_frequentation, '%d/%m/%Y')
-                date_fin = datetime.strptime(date_fin_frequentation, '%d/%m/%Y')
-                periode_debut = datetime.strptime(periode_debut_str, '%d/%m/%Y')
-                periode_fin = datetime.strptime(periode_fin_str, '%d/%m/%Y')
-
-                if date_debut <= periode_fin and date_fin >= periode_debut:
-                    # Si l'apprenant a déjà une fréquentation, comparer les dates
-                    if code_apprenant in frequentes_dict:
-                        existing_date_debut_str = frequentes_dict[code_apprenant].get('dateDeb')
-                        if existing_date_debut_str:
-                            existing_date_debut = datetime.strptime(existing_date_debut_str, '%d/%m/%Y')
-                            if date_debut > existing_date_debut:
-                                frequentes_dict[code_apprenant] = frequentation
-                    else:
-                        frequentes_dict[code_apprenant] = frequentation
-
-                    logger.debug(f"Added/Updated frequentation for apprenant {code_apprenant} "f"with groupe {frequentation.get('codeGroupe')}")
-
-            except ValueError as e:
-                logger.error(f"Error processing dates for apprenant {code_apprenant}: {str(e)}")
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error processing frequentation for apprenant {code_apprenant}: {str(e)}")
-                continue
+    # Fréquentation la plus récente de chaque apprenant sur la période (sélection vectorisée)
+    frequentes_dict = select_frequentations(frequentes_data, periode)
 
     # Mise à jour des informations de groupe dans api_data
     for apprenant in api_data.values():
@@ -313,7 +244,7 @@ async def fetch_api_data_for_template(headers, class_name=None):
                     'etenduGroupe': groupes_dict[code_groupe].get('etenduGroupe')
                 })
 
-    return api_data, groupes_dict, absences_data, frequentes_dict, periodes_dict
+    return api_data, groupes_dict, frequentes_dict, periodes_dict
 
 # Function to extract appreciations from Word document
 def extract_appreciations_from_word(word_path):
@@ -385,239 +316,234 @@ def extract_code_apprenant(pdf_path: str) -> str:
         logger.error(f"Failed to extract code_apprenant from {pdf_path}", exc_info=True)
         return None
 
-def import_document_to_yparéo(file_path, code_apprenant, retries=3, delay=5):
-    for attempt in range(retries):
-        try:
-            with open(file_path, 'rb') as pdf_file:
-                file_content = pdf_file.read()
-                encoded_content = base64.b64encode(file_content).decode('utf-8')
-
-            # Log the file being uploaded
-            logger.info(f"Attempting to upload {file_path} for apprenant {code_apprenant}")
-
-            # Création du JSON payload pour l'API
-            payload = {
-                "contenu": encoded_content,
-                "nomDocument": os.path.basename(file_path),
-                "typeMime": "application/pdf",
-                "extension": "pdf",
-            }
+async def import_document_to_yparéo(file_path, code_apprenant, retries=None):
+    with open(file_path, 'rb') as pdf_file:
+        file_content = pdf_file.read()
+        encoded_content = base64.b64encode(file_content).decode('utf-8')
 
-            # Endpoint Yparéo
-            endpoint = f"/r/v1/document/apprenant/{code_apprenant}/document?codeRepertoire=1000011"
-            url = f"{settings.YPAERO_BASE_URL}{endpoint}"
-            headers = {
-                "X-Auth-Token": settings.YPAERO_API_TOKEN,
-                "Content-Type": "application/json"
-            }
+    # Log the file being uploaded
+    logger.info(f"Attempting to upload {file_path} for apprenant {code_apprenant}")
 
-            # Envoi de la requête POST
-            response = requests.post(url, headers=headers, json=payload)
+    # Création du JSON payload pour l'API
+    payload = {
+        "contenu": encoded_content,
+        "nomDocument": os.path.basename(file_path),
+        "typeMime": "application/pdf",
+        "extension": "pdf",
+    }
 
-            # Log the API response
-            if response.status_code == 200:
-                logger.info(f"Successfully uploaded {file_path} for apprenant {code_apprenant}")
-                return True
-            else:
-                logging.error(f"Attempt {attempt + 1} failed with status code {response.status_code}: {response.text}")
-                if response.status_code == 500:
-                    raise ValueError(f"Server error while importing document {file_path}")
-        
-        except Exception as e:
-            logging.error(f"Attempt {attempt + 1} failed due to exception: {str(e)}", exc_info=True)
+    # Endpoint Yparéo
+    endpoint = f"/r/v1/document/apprenant/{code_apprenant}/document?codeRepertoire=1000011"
+    url = f"{settings.YPAERO_BASE_URL}{endpoint}"
+    headers = {
+        "X-Auth-Token": settings.YPAERO_API_TOKEN,
+        "Content-Type": "application/json"
+    }
+
+    # Nouvelles tentatives avec backoff non bloquant et disjoncteur (voir app/services/resilience.py)
+    try:
+        response = await send_with_retry("POST", url, retries=retries, headers=headers, json=payload)
+    except CircuitOpenError as e:
+        logger.error(f"Skipping upload of {file_path}: {e}")
+        raise ValueError(f"Yparéo unavailable, document {file_path} not imported: {e}")
+    except httpx.HTTPError as e:
+        logger.error(f"Failed to import document {file_path}: {e}", exc_info=True)
+        raise ValueError(f"Network error while importing document {file_path}: {e}")
+
+    if response.status_code == 200:
+        logger.info(f"Successfully uploaded {file_path} for apprenant {code_apprenant}")
+        return True
+
+    logger.error(f"Failed to import document {file_path}: status code {response.status_code}: {response.text}")
+    raise ValueError(f"Server error while importing document {file_path} (status {response.status_code})")
+
+def _match_learner_names(api_data, learner_names):
+    # Index des apprenants : nom exact, puis rapprochement approché (fautes de frappe, ordre des mots)
+    name_index = NameIndex(api_data.values(), threshold=settings.NAME_MATCH_THRESHOLD,
+                           margin=settings.NAME_MATCH_AMBIGUITY_MARGIN, max_candidates=settings.NAME_MATCH_MAX_CANDIDATES,
+                           auto_threshold=settings.NAME_MATCH_AUTO_FILL_THRESHOLD, max_typo_edits=settings.NAME_MATCH_MAX_TYPO_EDITS)
+    return dict(zip(learner_names, name_index.match_all(learner_names.values())))
 
-        time.sleep(delay)
-    
-    logger.error(f"Failed to import document {file_path} after {retries} retries")
-    raise ValueError(f"Server error while importing document {file_path} after {retries} retries")
 
 # Process the uploaded file and integrate data into the Excel template
-async def process_file(uploaded_wb, template_path, columns_config, class_name, current_periode, previous_periode, api_data, frequentes_dict, websocket=None):
+async def process_file(uploaded_sheet, template_path, columns_config, class_name, current_periode, previous_periode, api_data, frequentes_dict, session_id=None, groupes_dict=None, absences_data=None):
     try:
-        template_wb = openpyxl.load_workbook(template_path, data_only=True)
-        uploaded_ws = uploaded_wb.active
-        template_ws = template_wb.active
+        # Template analysé une fois par processus : chaque job n'en copie que les valeurs
+        template = get_template(template_path)
+        output_sheet = OutputSheet(template)
+
+        # Le fichier importé est lu une seule fois : les lignes sont ensuite indexées en mémoire
+        if not isinstance(uploaded_sheet, SheetBuffer):
+            uploaded_sheet = SheetBuffer(uploaded_sheet.active)
 
         header_row_uploaded = 4
         header_row_template = 1
 
-        # Configuration des en-têtes et correspondances
-        uploaded_titles = {
-            normalize_title(uploaded_ws.cell(row=header_row_uploaded, column=col).value): col
-            for col in range(1, uploaded_ws.max_column + 1)
-            if uploaded_ws.cell(row=header_row_uploaded, column=col).value is not None
-        }
-
-        template_titles = {
-            normalize_title(template_ws.cell(row=header_row_template, column=col).value): col
-            for col in range(1, template_ws.max_column + 1)
-            if template_ws.cell(row=header_row_template, column=col).value is not None
-        }
-
-        matching_columns = {
-            uploaded_title: (uploaded_titles[uploaded_title], template_titles[template_title])
-            for uploaded_title in uploaded_titles
-            for template_title in template_titles
-            if uploaded_title == template_title
-        }
+        # Correspondance des colonnes : plan compilé une fois par mise en page d'export et template
+        column_plan = get_plan(uploaded_sheet.row(header_row_uploaded), template.title_columns(header_row_template),
+                               columns_config['name_column_index_uploaded'])
 
-        if not matching_columns:
+        if not column_plan.copies:
             return JSONResponse(content={"message": "No matching columns found."})
 
-        # Obtention des données API
-        headers = {
-            'X-Auth-Token': settings.YPAERO_API_TOKEN,
-            'Content-Type': 'application/json'
-        }
+        # Obtention des données API (sauf si l'appelant les a déjà récupérées pour cette classe)
+        if api_data is None or groupes_dict is None or absences_data is None:
+            headers = {
+                'X-Auth-Token': settings.YPAERO_API_TOKEN,
+                'Content-Type': 'application/json'
+            }
 
-        api_data, groupes_dict, absences_data, frequentes_dict, periodes_dict = await fetch_api_data_for_template(headers, class_name)
+            api_data, groupes_dict, absences_data, frequentes_dict, periodes_dict = await fetch_api_data_for_template(headers, class_name)
 
         if not isinstance(api_data, dict) or not isinstance(groupes_dict, dict) or not isinstance(absences_data, dict):
             raise HTTPException(status_code=500, detail="Unexpected API response format")
 
-        # Création du dictionnaire des apprenants
-        api_dict = {
-            normalize_title(apprenant['nomApprenant'] + apprenant['prenomApprenant']): apprenant 
-            for apprenant in api_data.values()
-        }
-
-        # Préparation du résumé des absences
-        absences_summary = {}
-        for absence in absences_data.values():
-            apprenant_id = str(absence.get('codeApprenant'))
-            if not apprenant_id:
-                continue
-
-            duration = int(absence.get('duree', 0))
-            if apprenant_id not in absences_summary:
-                absences_summary[apprenant_id] = {'justified': [], 'unjustified': [], 'delays': []}
-
-            if absence.get('isJustifie'):
-                absences_summary[apprenant_id]['justified'].append(duration)
-            elif absence.get('isRetard'):
-                absences_summary[apprenant_id]['delays'].append(duration)
-            else:
-                absences_summary[apprenant_id]['unjustified'].append(duration)
+        # Lignes non rapprochées à l'identique : variantes d'écriture reportées, suggestions à confirmer
+        # (rien n'est reporté), ambiguïtés, conflits et noms introuvables
+        name_matches = []
 
         # Traitement des lignes
         exclude_phrase = 'moyennedugroupe'
-        total_rows = uploaded_ws.max_row - header_row_uploaded
-        processed_rows = 0
-
-        for row in range(header_row_uploaded + 1, uploaded_ws.max_row + 1):
-            processed_rows += 1
-            progress = (processed_rows / total_rows) * 100
-
-            if websocket:
-                try:
-                    await websocket.send(json.dumps({
-                        "progress": progress,
-                        "message": f"Processing row {processed_rows} of {total_rows}"
-                    }))
-                except WebSocketDisconnect:
-                    pass
-
-            if any(exclude_phrase in normalize_title(uploaded_ws.cell(row=row, column=col).value or '')
-                for col in range(1, uploaded_ws.max_column + 1)):
+        name_column = column_plan.name_column
+
+        # Noms des lignes apprenants, rapprochés ensemble pour détecter deux lignes visant le même apprenant
+        learner_names = {}
+        for row in range(header_row_uploaded + 1, uploaded_sheet.max_row + 1):
+            row_values = uploaded_sheet.row(row)
+            # Seul un texte peut contenir la mention « Moyenne du groupe »
+            if any(isinstance(value, str) and exclude_phrase in normalize_title(value) for value in row_values):
                 continue
-
-            uploaded_name = uploaded_ws.cell(row=row, column=columns_config['name_column_index_uploaded']).value
+            uploaded_name = row_values[name_column - 1] if name_column <= len(row_values) else None
+            if uploaded_name:
+                learner_names[row] = uploaded_name
+        row_matches = _match_learner_names(api_data, learner_names)
+
+        # Apprenants récupérés pour les seuls groupes de la classe : un nom sans correspondance exacte
+        # peut être celui d'un apprenant d'un autre groupe (liste RELEVANT_GROUPS incomplète) ;
+        # on reprend alors le rapprochement sur tous les apprenants plutôt que d'en approcher un autre
+        if _scoped_group_names(class_name) and any(match.status != 'exact' for match in row_matches.values()):
+            logger.info(f"{sum(match.status != 'exact' for match in row_matches.values())} names not found exactly "
+                        f"in the groups of {class_name}, matching against all learners")
+            headers = {'X-Auth-Token': settings.YPAERO_API_TOKEN, 'Content-Type': 'application/json'}
+            api_data, groupes_dict, absences_data, frequentes_dict, _ = await fetch_api_data_for_template(headers, class_name, scoped=False)
+            row_matches = _match_learner_names(api_data, learner_names)
+
+        # Totaux d'absences par apprenant, déjà agrégés et formatés par fetch_api_data_for_template
+        absences_summary = absences_data
+
+        if session_id:
+            progress_service.start_stage(session_id, "merge", 30, 35, total=len(learner_names))
+        merged_rows = 0
+
+        for row in range(header_row_uploaded + 1, uploaded_sheet.max_row + 1):
+            row_values = uploaded_sheet.row(row)
+            uploaded_name = learner_names.get(row)
             if not uploaded_name:
                 continue
+            merged_rows += 1
+            if session_id:
+                progress_service.advance(session_id, merged_rows)
 
             template_row = row - header_row_uploaded + header_row_template + 1
-            template_ws.cell(row=template_row, column=columns_config['name_column_index_template']).value = uploaded_name
+            output_sheet.set(template_row, columns_config['name_column_index_template'], uploaded_name)
+
+            name_match = row_matches[row]
+            if name_match.status != 'exact':
+                name_matches.append({
+                    'row': row,
+                    'name': uploaded_name,
+                    'status': name_match.status,
+                    'score': round(name_match.score, 3),
+                    'codeApprenant': name_match.record.get('codeApprenant') if name_match.record else None,
+                    'candidates': [
+                        {'codeApprenant': candidate.get('codeApprenant'), 'name': f"{candidate.get('nomApprenant')} {candidate.get('prenomApprenant')}", 'score': score}
+                        for score, candidate in name_match.candidates
+                    ],
+                })
 
-            normalized_name = normalize_title(uploaded_name)
-            if apprenant_info := api_dict.get(normalized_name):
+            if apprenant_info := name_match.record:
                 # Remplissage des informations de base
-                template_ws.cell(row=template_row, column=columns_config['code_apprenant_column_index_template']).value = apprenant_info.get('codeApprenant', 'N/A')
-                template_ws.cell(row=template_row, column=columns_config['date_naissance_column_index_template']).value = apprenant_info.get('dateNaissance', 'N/A')
+                output_sheet.set(template_row, columns_config['code_apprenant_column_index_template'], apprenant_info.get('codeApprenant', 'N/A'))
+                output_sheet.set(template_row, columns_config['date_naissance_column_index_template'], apprenant_info.get('dateNaissance', 'N/A'))
 
                 # Informations du site
                 if 'inscriptions' in apprenant_info and apprenant_info['inscriptions']:
-                    template_ws.cell(row=template_row, column=columns_config['nom_site_column_index_template']).value = apprenant_info['inscriptions'][0]['site'].get('nomSite', 'N/A')
+                    output_sheet.set(template_row, columns_config['nom_site_column_index_template'], apprenant_info['inscriptions'][0]['site'].get('nomSite', 'N/A'))
 
                 # Informations du groupe
                 code_groupe = str(apprenant_info.get('informationsCourantes', {}).get('codeGroupe'))
                 if code_groupe in groupes_dict:
                     groupe_info = groupes_dict[code_groupe]
-                    template_ws.cell(row=template_row, column=columns_config['code_groupe_column_index_template']).value = groupe_info.get('codeGroupe', 'N/A')
-                    template_ws.cell(row=template_row, column=columns_config['nom_groupe_column_index_template']).value = groupe_info.get('nomGroupe', 'N/A')
-                    template_ws.cell(row=template_row, column=columns_config['etendu_groupe_column_index_template']).value = groupe_info.get('etenduGroupe', 'N/A')
+                    output_sheet.set(template_row, columns_config['code_groupe_column_index_template'], groupe_info.get('codeGroupe', 'N/A'))
+                    output_sheet.set(template_row, columns_config['nom_groupe_column_index_template'], groupe_info.get('nomGroupe', 'N/A'))
+                    output_sheet.set(template_row, columns_config['etendu_groupe_column_index_template'], groupe_info.get('etenduGroupe', 'N/A'))
 
                 # Informations des absences
                 apprenant_id = str(apprenant_info.get('codeApprenant'))
                 if apprenant_id in absences_summary:
                     abs_info = absences_summary[apprenant_id]
-                    template_ws.cell(row=template_row, column=columns_config['duree_justifie_column_index_template']).value = sum_durations(abs_info['justified']) or "00h00"
-                    template_ws.cell(row=template_row, column=columns_config['duree_non_justifie_column_index_template']).value = sum_durations(abs_info['unjustified']) or "00h00"
-                    template_ws.cell(row=template_row, column=columns_config['duree_retard_column_index_template']).value = sum_durations(abs_info['delays']) or "00h00"
+                    output_sheet.set(template_row, columns_config['duree_justifie_column_index_template'], abs_info['justified'])
+                    output_sheet.set(template_row, columns_config['duree_non_justifie_column_index_template'], abs_info['unjustified'])
+                    output_sheet.set(template_row, columns_config['duree_retard_column_index_template'], abs_info['delays'])
 
             # Copie des autres colonnes correspondantes
-            for uploaded_title, (src_col, dest_col) in matching_columns.items():
-                template_ws.cell(row=template_row, column=dest_col).value = uploaded_ws.cell(row=row, column=src_col).value
+            for src_col, dest_col in column_plan.copies:
+                output_sheet.set(template_row, dest_col, row_values[src_col - 1])
 
         # Nettoyage final du template
-        for col in range(1, template_ws.max_column + 1):
-            if template_ws.cell(row=header_row_template + 1, column=col).value == template_ws.cell(row=header_row_template, column=col).value:
-                template_ws.cell(row=header_row_template + 1, column=col).value = None
-            if template_ws.cell(row=header_row_template + 2, column=col).value == "Note":
-                template_ws.cell(row=header_row_template + 2, column=col).value = None
+        for col in range(1, output_sheet.max_column + 1):
+            if output_sheet.value(header_row_template + 1, col) == output_sheet.value(header_row_template, col):
+                output_sheet.set(header_row_template + 1, col, None)
+            if output_sheet.value(header_row_template + 2, col) == "Note":
+                output_sheet.set(header_row_template + 2, col, None)
 
-        return template_wb
+        if name_matches:
+            counts = {status: sum(1 for entry in name_matches if entry['status'] == status) for status in ('fuzzy', 'suggested', 'ambiguous', 'conflict', 'not_found')}
+            logger.warning(f"Learner names not matched exactly: {counts}")
 
+        return output_sheet, name_matches
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("Failed to process the file", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
     
 def process_periodes_data(periodes_dict):
-    current_periode = None
-    previous_periode = None
-    
-    for periode in periodes_dict.values():
-        date_debut = periode.get('dateDeb')
-        if date_debut is None:
-            logger.warning(f"Missing 'dateDeb' in periode: {periode}")
-            continue
-
-        if current_periode is None or date_debut > current_periode.get('dateDeb', ''):
-            current_periode = periode
-    
-    for periode in periodes_dict.values():
-        date_debut = periode.get('dateDeb')
-        if date_debut is None:
-            continue
-
-        if date_debut < current_periode.get('dateDeb', ''):
-            if previous_periode is None or date_debut > previous_periode.get('dateDeb', ''):
-                previous_periode = periode
-    
+    period_index = period_index_for(periodes_dict)
+    current_periode = period_index.current()
+    previous_periode = period_index.previous(current_periode)
+
     if current_periode is None:
         logger.error("No valid periode found with 'dateDeb'")
     
     return current_periode, previous_periode
 
-def convert_docx_to_pdf(docx_dir):
+def convert_docx_to_pdf(docx_dir, on_progress=None):
     libreoffice_path = 'soffice' # Remplacez par le chemin correct de LibreOffice
 
-    for filename in os.listdir(docx_dir):
-        if filename.endswith('.docx'):
-            docx_path = os.path.join(docx_dir, filename)
-            pdf_path = os.path.join(docx_dir, filename.replace('.docx', '.pdf'))
+    docx_files = [filename for filename in os.listdir(docx_dir) if filename.endswith('.docx')]
+    for done, filename in enumerate(docx_files):
+        if on_progress is not None:
+            on_progress(done, len(docx_files))
+        docx_path = os.path.join(docx_dir, filename)
+        pdf_path = os.path.join(docx_dir, filename.replace('.docx', '.pdf'))
 
-            command = [libreoffice_path, '--headless', '--convert-to', 'pdf', '--outdir', docx_dir, docx_path]
+        command = [libreoffice_path, '--headless', '--convert-to', 'pdf', '--outdir', docx_dir, docx_path]
 
-            try:
-                subprocess.run(command, check=True)
-                if os.path.exists(pdf_path):
-                    logger.info(f"Converted {docx_path} to {pdf_path}")
-                else:
-                    logger.error(f"PDF not created for: {docx_path}")
-            except subprocess.CalledProcessError as e:
-                logger.error(f"Failed to convert {docx_path} to PDF: {e}")
-            except FileNotFoundError as e:
-                logger.error(f"LibreOffice executable not found: {e}")
+        try:
+            subprocess.run(command, check=True)
+            if os.path.exists(pdf_path):
+                logger.info(f"Converted {docx_path} to {pdf_path}")
+            else:
+                logger.error(f"PDF not created for: {docx_path}")
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Failed to convert {docx_path} to PDF: {e}")
+        except FileNotFoundError as e:
+            logger.error(f"LibreOffice executable not found: {e}")
+
+    if on_progress is not None:
+        on_progress(len(docx_files), len(docx_files))
 
 def clean_output_directory(output_dir):
     try:
@@ -628,132 +554,49 @@ def clean_output_directory(output_dir):
     except Exception as e:
         logger.error(f"Failed to clean output directory: {output_dir}", exc_info=True)
 
-# Fonction pour déduire le nom de la classe à partir du fichier Excel
-# Fonction pour déduire le nom de la classe à partir du fichier Excel
-def determine_class_name(uploaded_values, current_periode):
-    logger.debug(f"Uploaded values for class name detection: {uploaded_values}")
-
-    class_name = None
-    class_id = None
-    periode_code = current_periode.get('codePeriode') if current_periode else None
-
-    # Check for specific course names and map to class names accordingly for MAGI and MEFIM
-    if any("Baux Commerciaux et Gestion Locative" in value for value in uploaded_values):
-        class_name = "MAGI"
-    elif any("Rénovation Energétique des Actifs Tertiaires" in value for value in uploaded_values):
-        class_name = "MAGI_S3"
-    elif any("Business Game Property Management" in value for value in uploaded_values):
-        class_name = "MAGI_S4" 
-    elif any("Budget d'Exploitation et de Travaux" in value for value in uploaded_values):
-        class_name = "MAGI_S2"
-    
-    # Logic for MEFIM
-    elif any("Les Fondamentaux de l'Evaluation" in value for value in uploaded_values):
-        class_name = "MEFIM"
-    elif any("Marché d'Actifs Immobiliers" in value for value in uploaded_values):
-        class_name = "MEFIM_S2"
-    elif any("Droit des Suretés et de la Transmission" in value for value in uploaded_values):
-        class_name = "MEFIM_S3"
-    elif any("Business Game Arbitrage et Stratégies d'Investissement" in value for value in uploaded_values):
-        class_name = "MEFIM_S4"
-    
-    # Logic for MAPI
-    elif any("Étude Foncière" in value for value in uploaded_values):
-        class_name = "MAPI"
-    elif any("Droit de la Promotion Immobilière" in value for value in uploaded_values):
-        class_name = "MAPI_S2"
-    elif any("Acquisition et Dissociation du Foncier" in value for value in uploaded_values):
-        class_name = "MAPI_S3"
-    elif any("Business Game Aménagement et Promotion Immobilière" in value for value in uploaded_values):
-        class_name = "MAPI_S4"
-
-    # Logic for BG_ALT_S1 to BG_ALT_S6
-    elif any("Économie Générale" in value for value in uploaded_values):
-        class_name = "BG_ALT_S1"
-    elif any("Microéconomie I" in value for value in uploaded_values):
-        class_name = "BG_ALT_S2"
-    elif any("Microéconomie II" in value for value in uploaded_values):
-        class_name = "BG_ALT_S3"
-    elif any("Marketing Digital & Environnemental" in value for value in uploaded_values):
-        class_name = "BG_ALT_S4"
-    elif any("Économie Urbaine" in value for value in uploaded_values):
-        class_name = "BG_ALT_S5"
-    elif any("Finance Immobilière" in value for value in uploaded_values):
-        class_name = "BG_ALT_S6"
-
-    # Logic for BG_TP_1 to BG_TP_6
-    elif any("Organisations, Stratégies et Innovations I" in value for value in uploaded_values):
-        class_name = "BG_TP_1"
-    elif any("Real Estate English & TOEFL" in value for value in uploaded_values):
-        class_name = "BG_TP_2"
-    elif any("Pratique de Gestion Locative I" in value for value in uploaded_values):
-        class_name = "BG_TP_3"
-    elif any("Mobilité Internationale Études" in value for value in uploaded_values):
-        class_name = "BG_TP_4"
-    elif any("Management de Projet Immobilier" in value for value in uploaded_values):
-        class_name = "BG_TP_5"
-    elif any("Mémoire de Recherche" in value for value in uploaded_values):
-        class_name = "BG_TP_6"
-
-    if class_name:
-        class_id = class_ids.get(class_name)
-        logger.debug(f"Detected class name: {class_name} with ID: {class_id} for period: {periode_code}")
-        return class_name, class_id, periode_code
-    else:
-        logger.error("Failed to detect class name")
-        return None, None, periode_code
-
-async def update_progress(session_id: str, progress: int):
-    # Mise à jour de la variable globale
-    progress_data[session_id] = progress
-
-    # Préparation du message à envoyer
-    message = {
-        "session_id": session_id,
-        "progress": progress,
-        "message": f"Processing progress: {progress}%"
-    }
+async def _save_merged_workbook(output_sheet, output_path):
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        # Fichier temporaire propre à l'écriture : deux jobs du même template ne se mélangent pas
+        tmp_path = f"{output_path}.{id(output_sheet)}.tmp"
+        await asyncio.to_thread(output_sheet.save, tmp_path)
+        os.replace(tmp_path, output_path)
+        logger.debug(f"Saved processed workbook to {output_path}")
+    except Exception as e:
+        logger.warning(f"Could not save processed workbook {output_path}: {e}")
+
+
+def _schedule_merged_workbook_save(output_sheet, output_path):
+    task = asyncio.create_task(_save_merged_workbook(output_sheet, output_path))
+    _artifact_tasks.add(task)
+    task.add_done_callback(_artifact_tasks.discard)
 
-    # Envoi de la mise à jour à tous les clients WebSocket connectés
-    for connection in active_connections:
-        try:
-            await connection.send_json(message)
-        except WebSocketDisconnect:
-            # Si la connexion est fermée, nous la retirons de la liste des connexions actives
-            active_connections.remove(connection)
-        except Exception as e:
-            # Log any other errors that might occur during sending
-            print(f"Error sending WebSocket update: {str(e)}")
 
 # Fonction pour gérer les nouvelles connexions WebSocket
 @router.websocket("/ws/progress/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     await websocket.accept()
-    active_connections.append(websocket)
-    try:
-        while True:
-            data = await websocket.receive_text()
-            # Vous pouvez traiter les messages reçus ici si nécessaire
-    except WebSocketDisconnect:
-        logger.info(f"WebSocket connection closed for session {session_id}")
-    finally:
-        if websocket in active_connections:
-            active_connections.remove(websocket)
+    # Reçoit le dernier état de la session, au plus PROGRESS_MAX_UPDATES_PER_SECOND fois par seconde
+    await progress_service.subscribe(websocket, session_id)
 
+# Dernier état connu d'une session (pour les clients qui interrogent au lieu d'ouvrir un WebSocket)
+@router.get("/progress/{session_id}")
+async def get_progress(session_id: str):
+    state = progress_service.get_state(session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return state
 
 
 @router.post("/upload-and-integrate-excel-and-word")
 async def upload_and_integrate(doc_urls: DocumentUrls):
-    global progress_data
     session_id = doc_urls.sessionId
-    progress_data[session_id] = 0
     
     # Initialisation de la progression
     try:
-        progress_data[session_id] = 5  # Progression à 5%
-        await update_progress(session_id, 5)
+        progress_service.report(session_id, 5, stage="download", message="Downloading documents")
         
-        excel_response = requests.get(doc_urls.excelUrl)
+        excel_response = await send_request("GET", doc_urls.excelUrl)
         if excel_response.status_code != 200:
             logger.error(f"Failed to download Excel document: {excel_response.status_code}")
             raise HTTPException(status_code=400, detail="Failed to download Excel document")
@@ -764,11 +607,10 @@ async def upload_and_integrate(doc_urls: DocumentUrls):
         with open(temp_excel_path, 'wb') as temp_excel_file:
             temp_excel_file.write(excel_response.content)
             
-        progress_data[session_id] = 15  # Progression à 10%
-        await update_progress(session_id, 15)
+        progress_service.report(session_id, 15)
 
         # Télécharger le fichier Word
-        word_response = requests.get(doc_urls.wordUrl)
+        word_response = await send_request("GET", doc_urls.wordUrl)
         if word_response.status_code != 200:
             raise HTTPException(status_code=400, detail="Failed to download Word document")
 
@@ -781,22 +623,44 @@ async def upload_and_integrate(doc_urls: DocumentUrls):
             raise HTTPException(status_code=400, detail="Word document not found")
 
         # Traitement du fichier Excel
-        progress_data[session_id] = 20  # Progression à 50%
-        await update_progress(session_id, 20)  # Utiliser une fonction séparée pour mettre à jour la progression
+        progress_service.report(session_id, 20, stage="reading", message="Reading the grades export")
         
-        uploaded_wb = load_workbook(temp_excel_path, data_only=True)
-        uploaded_ws = uploaded_wb.active
+        # Lecture seule : le fichier est lu en flux, sans charger son modèle objet
+        uploaded_sheet = read_sheet(temp_excel_path)
         
-        # Ajout de progressions intermédiaires
-        progress_data[session_id] = 25
-        await update_progress(session_id, 25)
+        progress_service.report(session_id, 25, stage="ypareo", message="Fetching learners from Ypareo")
         
         headers = {
             'X-Auth-Token': settings.YPAERO_API_TOKEN,
             'Content-Type': 'application/json'
         }
 
-        api_data, groupes_data, absences_data, frequentes_dict, periodes_dict = await fetch_api_data_for_template(headers, None)
+        # Les périodes suffisent à détecter la classe ; le reste est récupéré ensuite, ciblé sur ses groupes
+        periodes_dict = await fetch_cached(f"{settings.YPAERO_BASE_URL}/r/v1/periodes", headers)
+
+        # Traiter les données de période avant de les utiliser
+        current_periode, previous_periode = process_periodes_data(periodes_dict)
+        logger.debug(f"Current periode: {current_periode}")
+        logger.debug(f"Previous periode: {previous_periode}")
+
+
+        # Détection de la classe et du template en un seul parcours des titres de la ligne 4
+        uploaded_values = [value for value in (uploaded_sheet.cell_value(cell) for cell in ['C4', 'F4', 'I4', 'L4', 'O4', 'R4', 'U4', 'X4', 'AA4', 'AD4', 'AG4', 'AJ4', 'AM4', 'AP4', 'AS4', 'AV4', 'AY4', 'BB4', 'BE4', 'BH4', 'BK4', 'BN4', 'BQ4', 'BT4', 'BW4', 'BZ4']) if value is not None]
+        logger.debug(f"Uploaded values for class detection: {uploaded_values}")
+
+        detection = get_registry().detect_class(uploaded_values, min_score=settings.CLASS_DETECTION_MIN_SCORE,
+                                                margin=settings.CLASS_DETECTION_MARGIN)
+        if detection.class_template is None:
+            logger.error(f"Failed to detect the class ({detection.status}), best candidates: {detection.describe_candidates()}")
+            raise HTTPException(status_code=400, detail=f"Unable to identify the class of the grades export "
+                                                        f"({detection.status}); best candidates: {detection.describe_candidates()}")
+        class_template = detection.class_template
+        class_name, class_id = class_template.name, class_template.class_id
+        periode_code = current_periode.get('codePeriode') if current_periode else None
+        logger.info(f"Detected class {class_name} (ID: {class_id}, period: {periode_code}) with {detection.status} "
+                    f"header match, score {detection.score:.2f}; candidates: {detection.describe_candidates()}")
+
+        api_data, groupes_data, absences_data, frequentes_dict, periodes_dict = await fetch_api_data_for_template(headers, class_name)
 
         # Vérification plus souple des données
         if not all(isinstance(data, dict) for data in [api_data, groupes_data, absences_data, frequentes_dict, periodes_dict]):
@@ -809,436 +673,15 @@ async def upload_and_integrate(doc_urls: DocumentUrls):
         logger.debug(f"Absences data received: {absences_data}")
         logger.debug(f"Frequentes dict received: {frequentes_dict}")
         logger.debug(f"Periodes dict received: {periodes_dict}")
-
-        # Traiter les données de période avant de les utiliser
-        current_periode, previous_periode = process_periodes_data(periodes_dict)
-        logger.debug(f"Current periode: {current_periode}")
-        logger.debug(f"Previous periode: {previous_periode}")
-
-
-        # Détection du template approprié en fonction des valeurs du fichier Excel
-        uploaded_values = [uploaded_ws[cell].value for cell in ['C4', 'F4', 'I4', 'L4', 'O4', 'R4', 'U4', 'X4', 'AA4', 'AD4', 'AG4', 'AJ4', 'AM4', 'AP4', 'AS4', 'AV4', 'AY4', 'BB4', 'BE4', 'BH4', 'BK4', 'BN4', 'BQ4', 'BT4', 'BW4', 'BZ4'] if uploaded_ws[cell].value is not None]
-
-        class_name, class_id, periode_code = determine_class_name(uploaded_values, current_periode)
         
         if not isinstance(api_data, dict) or not isinstance(groupes_data, dict) or not isinstance(absences_data, dict) or not isinstance(periodes_dict, dict):
             raise HTTPException(status_code=500, detail="Unexpected API response format")
 
-        templates = {
-            "MAPI": settings.M1_S1_MAPI_TEMPLATE,
-            "MAGI": settings.M1_S1_MAGI_TEMPLATE,
-            "MEFIM": settings.M1_S1_MEFIM_TEMPLATE,
-            "MAPI_S2": settings.M1_S2_MAPI_TEMPLATE,
-            "MAGI_S2": settings.M1_S2_MAGI_TEMPLATE,
-            "MEFIM_S2": settings.M1_S2_MEFIM_TEMPLATE,
-            "MAPI_S3": settings.M2_S3_MAPI_TEMPLATE,
-            "MAGI_S3": settings.M2_S3_MAGI_TEMPLATE,
-            "MEFIM_S3": settings.M2_S3_MEFIM_TEMPLATE,
-            "MAPI_S4": settings.M2_S4_MAPI_TEMPLATE,
-            "MAGI_S4": settings.M2_S4_MAGI_TEMPLATE,
-            "MEFIM_S4": settings.M2_S4_MEFIM_TEMPLATE,
-            "BG_ALT_S1": settings.BG_ALT_1_TEMPLATE,
-            "BG_ALT_S2": settings.BG_ALT_2_TEMPLATE,
-            "BG_ALT_S3": settings.BG_ALT_3_TEMPLATE,
-            "BG_ALT_S4": settings.BG_ALT_4_TEMPLATE,
-            "BG_ALT_S5": settings.BG_ALT_5_TEMPLATE,
-            "BG_ALT_S6": settings.BG_ALT_6_TEMPLATE,
-            "BG_TP_S1": settings.BG_TP_1_TEMPLATE,
-            "BG_TP_S2": settings.BG_TP_2_TEMPLATE,
-            "BG_TP_S3": settings.BG_TP_3_TEMPLATE,
-            "BG_TP_S4": settings.BG_TP_4_TEMPLATE,
-            "BG_TP_S5": settings.BG_TP_5_TEMPLATE,
-            "BG_TP_S6": settings.BG_TP_6_TEMPLATE,
-        }
-
-        matching_values = {
-            "MAPI": ['UE 1 – Economie & Gestion', 'Stratégie et Solutions Immobilières', 'Finance Immobilière', 'Économie Immobilière I', 'UE 2 – Droit', 'Droit des Affaires et des Contrats', 'UE 3 – Aménagement & Urbanisme', 'Ville et Développements Urbains', "Politique de l'Habitat", 'UE 4 – Compétences Professionnalisantes', 'Real Estate English', "Rencontres de l'Immobilier", 'ESPI Career Services', 'ESPI Inside', 'Immersion Professionnelle', 'Projet Voltaire', 'UE SPE – MAPI', 'Étude Foncière', "Montage d'une Opération de Promotion Immobilière", 'Acquisition et Dissociation du Foncier'],
-            "MAGI": ['UE 1 – Economie & Gestion', 'Stratégie et Solutions Immobilières', 'Finance Immobilière', 'Économie Immobilière I', 'UE 2 – Droit', 'Droit des Affaires et des Contrats', 'UE 3 – Aménagement & Urbanisme', 'Ville et Développements Urbains', "Politique de l'Habitat", 'UE 4 – Compétences Professionnalisantes', 'Real Estate English', "Rencontres de l'Immobilier", 'ESPI Career Services', 'ESPI Inside', 'Immersion Professionnelle', 'Projet Voltaire', 'UE SPE – MAGI', 'Baux Commerciaux et Gestion Locative', 'Actifs Tertiaires en Copropriété', 'Techniques du Bâtiment'],
-            "MEFIM": ['UE 1 – Economie & Gestion', 'Stratégie et Solutions Immobilières', 'Finance Immobilière', 'Économie Immobilière I', 'UE 2 – Droit', 'Droit des Affaires et des Contrats', 'UE 3 – Aménagement & Urbanisme', 'Ville et Développements Urbains', "Politique de l'Habitat", 'UE 4 – Compétences Professionnalisantes', 'Real Estate English', "Rencontres de l'Immobilier", 'ESPI Career Services', 'ESPI Inside', 'Immersion Professionnelle', 'Projet Voltaire', 'UE SPE – MEFIM', "Les Fondamentaux de l'Evaluation", 'Analyse et Financement Immobilier', 'Modélisation Financière'],
-            
-            "MAPI_S2": ['UE 1 – Economie & Gestion', "Marketing de l'Immobilier", 'Investissement et Financiarisation', 'Fiscalité', 'UE 2 – Droit', "Droit de l'Urbanisme et de la Construction", "Déontologie en France et à l'International", 'UE 4 – Compétences Professionnalisantes', 'Immersion Professionnelle', 'Real Estate English', 'Atelier Méthodologie de la Recherche', 'Techniques de Négociation', "Rencontres de l'Immobilier", 'ESPI Inside', 'Projet Voltaire', 'UE SPE – MAPI', "Droit de la Promotion Immobilière", "Montage d'une Opération de Logement", 'Financement des Opérations de Promotion Immobilière', "Logement Social et Accession Sociale"],
-            "MAGI_S2": ['UE 1 – Economie & Gestion', "Marketing de l'Immobilier", 'Investissement et Financiarisation', 'Fiscalité', 'UE 2 – Droit', "Droit de l'Urbanisme et de la Construction", "Déontologie en France et à l'International", 'UE 4 – Compétences Professionnalisantes', 'Immersion Professionnelle', 'Real Estate English', 'Atelier Méthodologie de la Recherche', 'Techniques de Négociation', "Rencontres de l'Immobilier", 'ESPI Inside', 'Projet Voltaire', 'UE SPE – MAGI', "Budget d'Exploitation et de Travaux", 'Développement et Stratégie Commerciale', 'Technique et Conformité des Immeubles', "Gestion de l'Immobilier - Logistique et Data Center"],
-            "MEFIM_S2": ['UE 1 – Economie & Gestion', "Marketing de l'Immobilier", 'Investissement et Financiarisation', 'Fiscalité', 'UE 2 – Droit', "Droit de l'Urbanisme et de la Construction", "Déontologie en France et à l'International", 'UE 4 – Compétences Professionnalisantes', 'Immersion Professionnelle', 'Real Estate English', 'Atelier Méthodologie de la Recherche', 'Techniques de Négociation', "Rencontres de l'Immobilier", 'ESPI Inside', 'Projet Voltaire', 'UE SPE – MEFIM', "Marché d'Actifs Immobiliers", "Baux Commerciaux", 'Évaluation des Actifs Résidentiels', "Audit et Gestion des Immeubles"],
-            
-            "MAPI_S3": ['UE 1 – Economie & Gestion', "PropTech et Innovation", 'Économie Immobilière II', 'UE 3 – Aménagement & Urbanisme', "Stratégies et Aménagement des Territoires I", "UE 4 – Compétences Professionnalisantes", 'Communication Digitale, Ecrite et Orale', 'Immersion Professionnelle', 'Real Estate English', 'Méthodologie de la Recherche', "Rencontres de l'Immobilier", 'ESPI Inside', 'UE SPE – MAPI', "Acquisition et Dissociation du Foncier", "Montage des Opérations Tertiaires", "Aménagement et Commande Publique", "Techniques du Bâtiment", "Réhabilitation et Pathologies du Bâtiment"],
-            "MAGI_S3": ['UE 1 – Economie & Gestion', "PropTech et Innovation", 'Économie Immobilière II', 'UE 3 – Aménagement & Urbanisme', "Stratégies et Aménagement des Territoires I", "UE 4 – Compétences Professionnalisantes", 'Communication Digitale, Ecrite et Orale', 'Immersion Professionnelle', 'Real Estate English', 'Méthodologie de la Recherche', "Rencontres de l'Immobilier", 'ESPI Inside', 'UE SPE – MAGI', "Rénovation Energétique des Actifs Tertiaires", "Arbitrage, Optimisation et Valorisation des Actifs Tertiaires", 'Maintenance et Facility Management', "Réhabilitation et Pathologies du Bâtiment"],
-            "MEFIM_S3": ['UE 1 – Economie & Gestion', "PropTech et Innovation", 'Économie Immobilière II', 'UE 3 – Aménagement & Urbanisme', "Stratégies et Aménagement des Territoires I", "UE 4 – Compétences Professionnalisantes", 'Communication Digitale, Ecrite et Orale', 'Immersion Professionnelle', 'Real Estate English', 'Méthodologie de la Recherche', "Rencontres de l'Immobilier", 'ESPI Inside', 'UE SPE – MEFIM', "Droit des Suretés et de la Transmission", 'Due Diligence', "Évaluation d'Actifs Tertiaires et Industriels", "Gestion de Patrimoine"],
-            
-            "MAPI_S4": ['UE 1 – Economie & Gestion', "Économie de l'Environnement", 'UE 3 – Aménagement & Urbanisme', "Normalisation, Labellisation", "Stratégies et Aménagement des Territoires II", 'UE 4 – Compétences Professionnalisantes', 'Real Estate English', 'Mémoire de Recherche', "Rencontres de l'Immobilier", 'ESPI Career Services', 'Immersion Professionnelle', 'UE SPE – MAPI', "Business Game Aménagement et Promotion Immobilière", "Fiscalité et Promotion Immobilière", "Contentieux de l'Urbanisme"],
-            "MAGI_S4": ['UE 1 – Economie & Gestion', "Économie de l'Environnement", 'UE 3 – Aménagement & Urbanisme', "Normalisation, Labellisation", "Stratégies et Aménagement des Territoires II", 'UE 4 – Compétences Professionnalisantes', 'Real Estate English', 'Mémoire de Recherche', "Rencontres de l'Immobilier", 'ESPI Career Services', 'Immersion Professionnelle', 'UE SPE – MAGI', "Business Game Property Management", "Gestion des Centres Commerciaux", "Gestion de Contentieux et Recouvrement"],
-            "MEFIM_S4": ['UE 1 – Economie & Gestion', "Économie de l'Environnement", 'UE 3 – Aménagement & Urbanisme', "Normalisation, Labellisation", "Stratégies et Aménagement des Territoires II", 'UE 4 – Compétences Professionnalisantes', 'Real Estate English', 'Mémoire de Recherche', "Rencontres de l'Immobilier", 'ESPI Career Services', 'Immersion Professionnelle', 'UE SPE – MEFIM', "Business Game Arbitrage et Stratégies d'Investissement", "Fiscalité du Patrimoine", "Fintech et Blockchain"],
-            
-            "BG_ALT_S1": ['UE 1 – Economie & Gestion', "Économie Générale", "Outils d'Analyse Economique", "Organisations, Stratégies et Innovations I", "UE 2 – Droit", "Introduction au Droit", "Droit des Contrats", "UE 3 – Aménagement & Urbanisme", "Introduction aux Méthodes d'Analyse et de Représentation Spatiale", "UE 4 – Compétences Professionnalisantes", "Immersion Professionnelle", "Real Estate English", "Panorama de l'Immobilier", "Expression Ecrite et Orale", "Gestion du Travail", "Déontologie et Ethique Professionnelle", "ESPI Career Services", "ESPI Inside"],
-            "BG_ALT_S2": ['UE 1 – Economie & Gestion', "Microéconomie I", "Introduction à la Finance", "Marketing & Prospection", "Mathématiques Financières", "UE 2 – Droit", "Droit des Biens", "Droit de la Copropriété I", "Droit des Baux d'Habitation", "UE 3 – Aménagement & Urbanisme", "Histoire Urbaine et Architecture", "UE 4 – Compétences Professionnalisantes", "Immersion Professionnelle", "Real Estate English", "Panorama de l'Immobilier", "Expression Ecrite et Orale", "Gestion de Projet", "ESPI Career Services", "ESPI Inside"],
-            "BG_ALT_S3": ['UE 1 – Economie & Gestion', "Microéconomie II", "Organisations, Stratégies et Innovations II", "Pratique de Gestion Locative I", "Enjeux de l'Immobilier et Solutions Digitales I", "Transactions Résidentielles", "UE 2 – Droit", "Droit de la Vente Immobilière", "Droit de la Copropriété II", "UE 3 – Aménagement & Urbanisme", "Technologie du Bâtiment", "UE 4 – Compétences Professionnalisantes", "Immersion Professionnelle", "Real Estate English", "Panorama de l'Immobilier", "Expression Ecrite et Orale", "ESPI Inside"],
-            
-            "BG_ALT_S4": ['UE 1 – Economie & Gestion', "Marketing Digital & Environnemental", "Enjeux de l'Immobilier et Solutions Digitales II", "Macroéconomie et Politiques Economiques", "UE 2 – Droit", "Droit du Numérique", "Droit de l'Urbanisme", "Fiscalité Générale", "UE 3 – Aménagement & Urbanisme", "Immobilier et Dynamiques Urbaines", "UE 4 – Compétences Professionnalisantes", "Immersion Professionnelle", "Real Estate English", "Panorama de l'Immobilier", "Expression Ecrite et Orale", "ESPI Inside"],
-            "BG_ALT_S5": ['UE 1 – Economie & Gestion', "Économie Urbaine", "Pratique de Gestion Locative II", "Management de Projet Immobilier", "UE 2 – Droit", "Droit de la Transaction Immobilière", "Droit de l'Environnement", "Fiscalité Immobilière", "UE 3 – Aménagement & Urbanisme", "Habitat et Développement Durable", "UE 4 – Compétences Professionnalisantes", "Immersion Professionnelle", "Real Estate English", "Panorama de l'Immobilier", "Expression Ecrite et Orale", "Atelier Urbain I", "Méthodologie de la Recherche", "ESPI Inside"],
-            "BG_ALT_S6": ['UE 1 – Economie & Gestion', "Finance Immobilière", "Économie Immobilière", "UE 2 – Droit", "Gestion de la Copropriété", "Droit des Sols et de la Construction", "UE 3 – Aménagement & Urbanisme", "Pathologie du Bâtiment et Suivi de Travaux", "Expertise et Evaluation Immobilière", "UE 4 – Compétences Professionnalisantes", "Immersion Professionnelle", "Atelier Urbain II", "Panorama de l'Immobilier", "Mémoire de Recherche", "Real Estate English", "ESPI Inside"],
-            
-            "BG_TP_1": ['UE 1 – Economie & Gestion', "Économie Générale", "Outils d'Analyse Economique", "Organisations, Stratégies et Innovations I", "Microéconomie I", "Introduction à la Finance", "Marketing & Prospection", "Mathématiques Financières", "UE 2 – Droit", "Introduction au Droit", "Droit des Contrats", "Droit des Biens", "Droit de la Copropriété I", "Droit des Baux d'Habitation", "UE 3 – Aménagement & Urbanisme", "Introduction aux Méthodes d'Analyse et de Représentation Spatiale", "Histoire Urbaine et Architecture", "UE 4 – Compétences Professionnalisantes", "Immersion Professionnelle", "Real Estate English", "Panorama de l'Immobilier", "Expression Ecrite et Orale", "Gestion du Travail", "Déontologie et Ethique Professionnelle", "ESPI Career Services", "Gestion de Projet" "ESPI Inside"],
-            "BG_TP_2": ['UE 4 – Compétences Professionnalisantes', "Immersion Professionnelle", "Real Estate English & TOEFL"],
-            "BG_TP_3": ['UE 1 – Economie & Gestion', "Microéconomie II", "Organisations, Stratégies et Innovations II", "Pratique de Gestion Locative I", "Transactions Résidentielles", "UE 2 – Droit", "Droit de la Vente Immobilière", "Droit de la Copropriété II", "Droit de l'Urbanisme", "Droit des Baux Commerciaux", "Droit des Baux d'Habitation", "Fiscalité Générale", "UE 3 – Aménagement & Urbanisme", "Technologie du Bâtiment", "Histoire Urbaine et Architecture", "Immobilier et Dynamiques Urbaines", "UE 4 – Compétences Professionnalisantes", "Real Estate English", "Panorama de l'Immobilier", "Expression Ecrite et Orale", "ESPI Inside"],
-            
-            "BG_TP_4": ["UE 4 – Compétences Professionnalisantes", "Mobilité Internationale Études"], 
-            "BG_TP_5": ['UE 1 – Economie & Gestion', "Économie Urbaine", "Pratique de Gestion Locative II", "Management de Projet Immobilier", "Finance Immobilière", "UE 2 – Droit", "Droit de la Transaction Immobilière", "Droit de l'Environnement", "Fiscalité Immobilière", "Gestion de la Copropriété", "Droit des Sols et de la Construction", "UE 3 – Aménagement & Urbanisme", "Habitat et Développement Durable", "Pathologie du Bâtiment et Suivi de Travaux", "Expertise et Evaluation Immobiliere", "UE 4 – Compétences Professionnalisantes", "Real Estate English", "Panorama de l'Immobilier", "Expression Ecrite et Orale", "Méthodologie de la Recherche", "ESPI Inside", "Atelier Urbain"],
-            "BG_TP_6": ["UE 4 – Compétences Professionnalisantes", "Immersion Professionnelle", "Mémoire de Recherche", "Real Estate English"],
-        }
-        
-        progress_data[session_id] = 30  # Progression à 30%
-        await update_progress(session_id, 30)
+        progress_service.report(session_id, 30, stage="merge", message="Merging grades into the template")
         
-        column_configs = {
-            "MAPI": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 23,
-                'nom_site_column_index_template': 24,
-                'code_groupe_column_index_template': 25,
-                'nom_groupe_column_index_template': 26,
-                'etendu_groupe_column_index_template': 27,
-                'duree_justifie_column_index_template': 28,
-                'duree_non_justifie_column_index_template': 29,
-                'duree_retard_column_index_template': 30,
-                'appreciation_column_index_template': 31
-            },
-            "MAGI": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 23,
-                'nom_site_column_index_template': 24,
-                'code_groupe_column_index_template': 25,
-                'nom_groupe_column_index_template': 26,
-                'etendu_groupe_column_index_template': 27,
-                'duree_justifie_column_index_template': 28,
-                'duree_non_justifie_column_index_template': 29,
-                'duree_retard_column_index_template': 30,
-                'appreciation_column_index_template': 31
-            },
-            "MEFIM": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 23,
-                'nom_site_column_index_template': 24,
-                'code_groupe_column_index_template': 25,
-                'nom_groupe_column_index_template': 26,
-                'etendu_groupe_column_index_template': 27,
-                'duree_justifie_column_index_template': 28,
-                'duree_non_justifie_column_index_template': 29,
-                'duree_retard_column_index_template': 30,
-                'appreciation_column_index_template': 31
-            },
-            "MAPI_S2": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 23,
-                'nom_site_column_index_template': 24,
-                'code_groupe_column_index_template': 25,
-                'nom_groupe_column_index_template': 26,
-                'etendu_groupe_column_index_template': 27,
-                'duree_justifie_column_index_template': 28,
-                'duree_non_justifie_column_index_template': 29,
-                'duree_retard_column_index_template': 30,
-                'appreciation_column_index_template': 31
-            },
-            "MAGI_S2": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 23,
-                'nom_site_column_index_template': 24,
-                'code_groupe_column_index_template': 25,
-                'nom_groupe_column_index_template': 26,
-                'etendu_groupe_column_index_template': 27,
-                'duree_justifie_column_index_template': 28,
-                'duree_non_justifie_column_index_template': 29,
-                'duree_retard_column_index_template': 30,
-                'appreciation_column_index_template': 31
-            },
-            "MEFIM_S2": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 23,
-                'nom_site_column_index_template': 24,
-                'code_groupe_column_index_template': 25,
-                'nom_groupe_column_index_template': 26,
-                'etendu_groupe_column_index_template': 27,
-                'duree_justifie_column_index_template': 28,
-                'duree_non_justifie_column_index_template': 29,
-                'duree_retard_column_index_template': 30,
-                'appreciation_column_index_template': 31
-            },
-            "MAPI_S3": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 21,
-                'nom_site_column_index_template': 22,
-                'code_groupe_column_index_template': 23,
-                'nom_groupe_column_index_template': 24,
-                'etendu_groupe_column_index_template': 25,
-                'duree_justifie_column_index_template': 26,
-                'duree_non_justifie_column_index_template': 27,
-                'duree_retard_column_index_template': 28,
-                'appreciation_column_index_template': 29
-            },
-            "MAGI_S3": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 20,
-                'nom_site_column_index_template': 21,
-                'code_groupe_column_index_template': 22,
-                'nom_groupe_column_index_template': 23,
-                'etendu_groupe_column_index_template': 24,
-                'duree_justifie_column_index_template': 25,
-                'duree_non_justifie_column_index_template': 26,
-                'duree_retard_column_index_template': 27,
-                'appreciation_column_index_template': 28
-            },
-            "MEFIM_S3": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 20,
-                'nom_site_column_index_template': 21,
-                'code_groupe_column_index_template': 22,
-                'nom_groupe_column_index_template': 23,
-                'etendu_groupe_column_index_template': 24,
-                'duree_justifie_column_index_template': 25,
-                'duree_non_justifie_column_index_template': 26,
-                'duree_retard_column_index_template': 27,
-                'appreciation_column_index_template': 28
-            },
-            "MAPI_S4": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 18,
-                'nom_site_column_index_template': 19,
-                'code_groupe_column_index_template': 20,
-                'nom_groupe_column_index_template': 21,
-                'etendu_groupe_column_index_template': 22,
-                'duree_justifie_column_index_template': 23,
-                'duree_non_justifie_column_index_template': 24,
-                'duree_retard_column_index_template': 25,
-                'appreciation_column_index_template': 26
-            },
-            "MAGI_S4": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 18,
-                'nom_site_column_index_template': 19,
-                'code_groupe_column_index_template': 20,
-                'nom_groupe_column_index_template': 21,
-                'etendu_groupe_column_index_template': 22,
-                'duree_justifie_column_index_template': 23,
-                'duree_non_justifie_column_index_template': 24,
-                'duree_retard_column_index_template': 25,
-                'appreciation_column_index_template': 26
-            },
-            "MEFIM_S4": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 18,
-                'nom_site_column_index_template': 19,
-                'code_groupe_column_index_template': 20,
-                'nom_groupe_column_index_template': 21,
-                'etendu_groupe_column_index_template': 22,
-                'duree_justifie_column_index_template': 23,
-                'duree_non_justifie_column_index_template': 24,
-                'duree_retard_column_index_template': 25,
-                'appreciation_column_index_template': 26
-            },
-            "BG_ALT_S1": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 21,
-                'nom_site_column_index_template': 22,
-                'code_groupe_column_index_template': 23,
-                'nom_groupe_column_index_template': 24,
-                'etendu_groupe_column_index_template': 25,
-                'duree_justifie_column_index_template': 26,
-                'duree_non_justifie_column_index_template': 27,
-                'duree_retard_column_index_template': 28,
-                'appreciation_column_index_template': 29
-            },
-            "BG_ALT_S2": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 22,
-                'nom_site_column_index_template': 23,
-                'code_groupe_column_index_template': 24,
-                'nom_groupe_column_index_template': 25,
-                'etendu_groupe_column_index_template': 26,
-                'duree_justifie_column_index_template': 27,
-                'duree_non_justifie_column_index_template': 28,
-                'duree_retard_column_index_template': 29,
-                'appreciation_column_index_template': 30
-            }, 
-            "BG_ALT_S3": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 20,
-                'nom_site_column_index_template': 21,
-                'code_groupe_column_index_template': 22,
-                'nom_groupe_column_index_template': 23,
-                'etendu_groupe_column_index_template': 24,
-                'duree_justifie_column_index_template': 25,
-                'duree_non_justifie_column_index_template': 26,
-                'duree_retard_column_index_template': 27,
-                'appreciation_column_index_template': 28
-            },
-            "BG_ALT_S4": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 19,
-                'nom_site_column_index_template': 20,
-                'code_groupe_column_index_template': 21,
-                'nom_groupe_column_index_template': 22,
-                'etendu_groupe_column_index_template': 23,
-                'duree_justifie_column_index_template': 24,
-                'duree_non_justifie_column_index_template': 25,
-                'duree_retard_column_index_template': 26,
-                'appreciation_column_index_template': 27
-            },
-            "BG_ALT_S5": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 21,
-                'nom_site_column_index_template': 22,
-                'code_groupe_column_index_template': 23,
-                'nom_groupe_column_index_template': 24,
-                'etendu_groupe_column_index_template': 25,
-                'duree_justifie_column_index_template': 26,
-                'duree_non_justifie_column_index_template': 27,
-                'duree_retard_column_index_template': 28,
-                'appreciation_column_index_template': 29
-            },
-            "BG_ALT_S6": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 19,
-                'nom_site_column_index_template': 20,
-                'code_groupe_column_index_template': 21,
-                'nom_groupe_column_index_template': 22,
-                'etendu_groupe_column_index_template': 23,
-                'duree_justifie_column_index_template': 24,
-                'duree_non_justifie_column_index_template': 25,
-                'duree_retard_column_index_template': 26,
-                'appreciation_column_index_template': 27
-            },
-            "BG_TP_S1": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 29,
-                'nom_site_column_index_template': 30,
-                'code_groupe_column_index_template': 31,
-                'nom_groupe_column_index_template': 32,
-                'etendu_groupe_column_index_template': 33,
-                'duree_justifie_column_index_template': 34,
-                'duree_non_justifie_column_index_template': 35,
-                'duree_retard_column_index_template': 36,
-                'appreciation_column_index_template': 37
-            },
-            "BG_TP_S2": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 6,
-                'nom_site_column_index_template': 7,
-                'code_groupe_column_index_template': 8,
-                'nom_groupe_column_index_template': 9,
-                'etendu_groupe_column_index_template': 10,
-                'duree_justifie_column_index_template': 11,
-                'duree_non_justifie_column_index_template': 12,
-                'duree_retard_column_index_template': 13,
-                'appreciation_column_index_template': 14
-            },
-            "BG_TP_S3": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 22,
-                'nom_site_column_index_template': 23,
-                'code_groupe_column_index_template': 24,
-                'nom_groupe_column_index_template': 25,
-                'etendu_groupe_column_index_template': 26,
-                'duree_justifie_column_index_template': 27,
-                'duree_non_justifie_column_index_template': 28,
-                'duree_retard_column_index_template': 29,
-                'appreciation_column_index_template': 30
-            },
-            "BG_TP_S4": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 5,
-                'nom_site_column_index_template': 6,
-                'code_groupe_column_index_template': 7,
-                'nom_groupe_column_index_template': 8,
-                'etendu_groupe_column_index_template': 9,
-                'duree_justifie_column_index_template': 10,
-                'duree_non_justifie_column_index_template': 11,
-                'duree_retard_column_index_template': 12,
-                'appreciation_column_index_template': 13
-            },
-            "BG_TP_S5": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 1,
-                'date_naissance_column_index_template': 26,
-                'nom_site_column_index_template': 27,
-                'code_groupe_column_index_template': 28,
-                'nom_groupe_column_index_template': 29,
-                'etendu_groupe_column_index_template': 30,
-                'duree_justifie_column_index_template': 31,
-                'duree_non_justifie_column_index_template': 32,
-                'duree_retard_column_index_template': 33,
-                'appreciation_column_index_template': 34
-            },
-            "BG_TP_S6": {
-                'name_column_index_uploaded': 2,
-                'name_column_index_template': 2,
-                'code_apprenant_column_index_template': 7,
-                'date_naissance_column_index_template': 8,
-                'nom_site_column_index_template': 9,
-                'code_groupe_column_index_template': 10,
-                'nom_groupe_column_index_template': 11,
-                'etendu_groupe_column_index_template': 12,
-                'duree_justifie_column_index_template': 13,
-                'duree_non_justifie_column_index_template': 14,
-                'duree_retard_column_index_template': 15,
-                'appreciation_column_index_template': 16
-            },
-        }
-
-        template_to_use = None
-        columns_config = None
-        for template, values in matching_values.items():
-            if uploaded_values[:len(values)] == values:
-                logger.debug(f"Matching template found: {template}")
-                template_to_use = templates[template]
-                columns_config = column_configs[template]
-                break
-
-        if not template_to_use or not columns_config:
-            logger.error("No matching template found for the uploaded Excel data.")
-            raise HTTPException(status_code=400, detail="No matching template found")
+        # Template de fusion de la classe détectée
+        template_to_use = class_template.template_path
+        columns_config = class_template.columns_config
 
         # Log the columns to be processed
         logger.debug(f"Using template: {template_to_use}")
@@ -1255,38 +698,48 @@ async def upload_and_integrate(doc_urls: DocumentUrls):
 
         # Processer le fichier et créer le fichier Excel final
         # Processer le fichier et créer le fichier Excel final
-        template_wb = await process_file(uploaded_wb, template_to_use, columns_config, class_name, current_periode, previous_periode, api_data, frequentes_dict)
+        processed = await process_file(uploaded_sheet, template_to_use, columns_config, class_name, current_periode, previous_periode, api_data, frequentes_dict, session_id=session_id, groupes_dict=groupes_data, absences_data=absences_data)
+        if isinstance(processed, JSONResponse):
+            progress_service.finish(session_id, message="No matching columns found", failed=True)
+            return processed
+        output_sheet, name_matches = processed
 
-        progress_data[session_id] = 35  # Progression à 40%
-        await update_progress(session_id, 35)
+        progress_service.report(session_id, 35, stage="appreciations", message="Adding appreciations")
 
         appreciations = extract_appreciations_from_word(temp_word_path)
         logger.debug(f"Extracted appreciations: {appreciations}")
 
-        template_wb = update_excel_with_appreciations(template_wb, appreciations, columns_config)
+        output_sheet, unmatched_appreciations = update_excel_with_appreciations(
+            output_sheet, appreciations, columns_config, fallback=settings.APPRECIATIONS_FALLBACK_MATCHING)
 
-        template_name = os.path.basename(template_to_use).replace('.xlsx', '')
-        output_path = os.path.join(settings.DOCUMENTS_DIR, f'{template_name}.xlsx')
-        logger.debug(f"Saving processed workbook to {output_path}")
-        template_wb.save(output_path)
+        # Le tableau de la classe est passé en mémoire à la génération des bulletins ;
+        # le classeur fusionné n'est plus qu'un artefact facultatif, écrit en arrière-plan
+        class_table = ClassTable.from_output_sheet(output_sheet, os.path.basename(template_to_use))
+        if settings.SAVE_MERGED_WORKBOOK:
+            template_name = os.path.basename(template_to_use).replace('.xlsx', '')
+            output_path = os.path.join(settings.DOCUMENTS_DIR, f'{template_name}.xlsx')
+            _schedule_merged_workbook_save(output_sheet, output_path)
 
         # Génération et création des bulletins PDF
-        progress_data[session_id] = 50  # Progression à 50%
-        await update_progress(session_id, 50)
+        progress_service.start_stage(session_id, "bulletins", 50, 60, message="Generating bulletins")
 
         # Déterminer le répertoire de sortie et nettoyer les fichiers existants
         output_dir = os.path.join(settings.OUTPUT_DIR, f'bulletins-{class_name}')
         clean_output_directory(output_dir)
         os.makedirs(output_dir, exist_ok=True)
         
-        bulletin_paths = process_excel_file(output_path, output_dir)
+        # Étapes bloquantes exécutées hors de la boucle d'événements : la progression continue d'être envoyée
+        bulletin_paths = await asyncio.to_thread(
+            process_excel_file, class_table, output_dir,
+            lambda done, total: progress_service.advance(session_id, done, total))
 
         logger.debug(f"Generated bulletins: {bulletin_paths}")
         
-        convert_docx_to_pdf(output_dir)
+        progress_service.start_stage(session_id, "pdf", 60, 85, message="Converting bulletins to PDF")
+        await asyncio.to_thread(convert_docx_to_pdf, output_dir,
+                                lambda done, total: progress_service.advance(session_id, done, total))
         
-        progress_data[session_id] = 70  # Progression à 55%
-        await update_progress(session_id, 70)
+        progress_service.report(session_id, 85, stage="zip", message="Zipping bulletins")
 
         pdf_bulletin_paths = [
             os.path.join(output_dir, filename.replace('.docx', '.pdf'))
@@ -1294,8 +747,7 @@ async def upload_and_integrate(doc_urls: DocumentUrls):
             if filename.endswith('.pdf')
         ]
         
-        progress_data[session_id] = 90  # Progression à 90%
-        await update_progress(session_id, 90)
+        progress_service.report(session_id, 90)
 
         # Création d'un fichier ZIP avec les PDF générés
         zip_filename = os.path.join(settings.DOWNLOAD_DIR, f'bulletins-{class_id}.zip')
@@ -1308,10 +760,19 @@ async def upload_and_integrate(doc_urls: DocumentUrls):
             os.remove(bulletin_path)
 
         logger.debug(f"All bulletins processed and zipped successfully for class {class_name} (ID: {class_id}).")
-        return JSONResponse(content={"message": f"Bulletins for {class_name} (ID: {class_id}) generated and zipped successfully", "zip_path": zip_filename})
-
+        progress_service.finish(session_id, message=f"Bulletins for {class_name} generated")
+        return JSONResponse(content={"message": f"Bulletins for {class_name} (ID: {class_id}) generated and zipped successfully", "zip_path": zip_filename,
+                                     "unmatched_appreciations": unmatched_appreciations, "name_matches": name_matches,
+                                     "class_detection": detection.to_dict()})
+
+    except HTTPException as e:
+        # Erreurs déjà qualifiées (classe non identifiée, appel Yparéo refusé...) : statut conservé
+        logger.error(f"Failed to generate bulletins: {e.status_code} {e.detail}")
+        progress_service.finish(session_id, message=str(e.detail), failed=True)
+        raise
     except Exception as e:
         logger.error("Failed to process the file and generate bulletins", exc_info=True)
+        progress_service.finish(session_id, message=str(e), failed=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/import-bulletins-from-directory")
@@ -1344,7 +805,7 @@ async def import_bulletins_from_directory():
             logger.info(f"Extracted code_apprenant: {code_apprenant} from {pdf_path}")
 
             try:
-                if not import_document_to_yparéo(pdf_path, code_apprenant):
+                if not await import_document_to_yparéo(pdf_path, code_apprenant):
                     logger.error(f"Failed to import PDF: {pdf_path}")
                     import_errors.append({
                         "file": os.path.basename(pdf_path),
@@ -1370,4 +831,18 @@ async def download_zip(filename: str):
     zip_path = os.path.join(settings.DOWNLOAD_DIR, filename)
     if not os.path.exists(zip_path):
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(path=zip_path, filename=filename, media_type='application/zip')
\ No newline at end of file
+    return FileResponse(path=zip_path, filename=filename, media_type='application/zip')
+
+@router.get("/templates/cache")
+async def get_template_cache():
+    return template_cache_stats()
+
+
+@router.get("/templates/column-plans")
+async def get_column_plans():
+    return plan_stats()
+
+
+@router.get("/templates/registry")
+async def get_template_registry():
+    return registry_stats()
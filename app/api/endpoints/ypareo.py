@@ -0,0 +1,51 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from app.core.config import settings
+from app.services import absence_store, snapshot_service
+from app.services.api_service import YPAREO_DATASETS, fetch_stats
+from app.services.cache_service import invalidate, cache_stats
+from app.services.snapshot_service import snapshot_stats
+from app.services.resilience import resilience_stats
+
+router = APIRouter()
+
+
+@router.get("/cache")
+async def get_cache():
+    return {"entries": cache_stats()}
+
+
+@router.get("/snapshot")
+async def get_snapshot():
+    return {"entries": snapshot_stats()}
+
+
+@router.get("/fetch-stats")
+async def get_fetch_stats():
+    return {"datasets": fetch_stats}
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return {"hosts": resilience_stats()}
+
+
+@router.post("/cache/invalidate")
+async def invalidate_cache(dataset: Optional[str] = None):
+    """
+    Invalide les données Yparéo, entièrement ou pour un jeu de données : le cache des réponses,
+    mais aussi les entrées de l'instantané de référence construites à partir de ce jeu (les jobs
+    lisent l'instantané avant le cache) et, pour les absences, le stockage local, dont la
+    prochaine synchronisation redevient complète.
+    """
+    if dataset is not None and dataset not in YPAREO_DATASETS.values():
+        raise HTTPException(status_code=400, detail=f"Unknown dataset: {dataset}")
+    invalidated = invalidate(dataset)
+    snapshot_invalidated = await snapshot_service.invalidate(dataset)
+    absence_store_reset = settings.ABSENCE_STORE_ENABLED and dataset in (None, "absences")
+    if absence_store_reset:
+        await absence_store.reset_sync()
+    return {"message": "Cache invalidated", "invalidated": invalidated,
+            "snapshot_invalidated": snapshot_invalidated, "absence_store_reset": absence_store_reset}
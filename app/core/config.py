@@ -144,10 +144,101 @@ class Settings(BaseSettings):
         "P-BG3 ALT 2", "P-BG3 ALT 3", "P-BG3 ALT 4", "P-BG3 ALT 5", "P-BG3 ALT 6", "P-BG3 ALT 7", "P-BG3 ALT 8"]
     
     # Paramètres d'API externe
-    YPAERO_BASE_URL: str
+    YPAERO_BASE_URL: str  # Ex. https://groupe-espi.ymag.cloud/index.php, ou http://127.0.0.1:8001 pour app/devtools/ypareo_stub.py
     YPAERO_API_TOKEN: str
     BASE_DIR: str
 
+    # Période Yparéo de travail (codesPeriode des requêtes, période des fréquentations)
+    YPAREO_CODE_PERIODE: int = 2
+
+    # Client HTTP partagé (pool de connexions keep-alive)
+    HTTP_MAX_CONNECTIONS: int = 20
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = 8
+    HTTP2_ENABLED: bool = False  # Nécessite le paquet 'h2' (httpx[http2])
+
+    # Cache des jeux de données Yparéo (durées en secondes)
+    YPAREO_CACHE_ENABLED: bool = True
+    YPAREO_CACHE_TTLS: dict = {
+        "periodes": 24 * 3600,
+        "groupes": 6 * 3600,
+        "apprenants": 3600,
+        "frequentes": 3600,
+        "absences": 15 * 60,
+    }
+    YPAREO_CACHE_DEFAULT_TTL: int = 300
+    YPAREO_CACHE_MAX_STALE: int = 24 * 3600  # Au-delà, l'entrée n'est plus servie
+
+    # Décodage JSON en flux des gros jeux de données (apprenants, absences), via ijson si installé
+    YPAREO_STREAMING_DECODE: bool = True
+    # Pic mémoire de chaque décodage dans les statistiques (tracemalloc démarré au lancement) : diagnostic
+    # uniquement, tracemalloc ralentit les allocations et les décodages mesurés sont faits un par un
+    YPAREO_TRACE_DECODE_MEMORY: bool = False
+
+    # Stockage local des absences (SQLite) : synchro complète une fois, puis incrémentale
+    ABSENCE_STORE_ENABLED: bool = True
+    ABSENCE_STORE_PATH: str = os.path.join(DOCUMENTS_DIR, "absences.sqlite3")
+    ABSENCES_PERIOD_START: str = "01-09-2023"  # Bornes de l'année scolaire (jj-mm-aaaa)
+    ABSENCES_PERIOD_END: str = "15-09-2024"
+    ABSENCES_SYNC_LOOKBACK_DAYS: int = 14  # Fenêtre re-téléchargée pour intégrer les corrections
+    ABSENCES_SYNC_INTERVAL: int = 15 * 60  # Délai minimal entre deux synchronisations (secondes)
+
+    # Instantané sur disque des données de référence Yparéo, pour des redémarrages à chaud.
+    # Les jobs le lisent avant le cache : POST /ypareo/cache/invalidate en retire aussi les entrées
+    YPAREO_SNAPSHOT_ENABLED: bool = True
+    YPAREO_SNAPSHOT_PATH: str = os.path.join(DOCUMENTS_DIR, "ypareo_snapshot.bin")
+    YPAREO_SNAPSHOT_MAX_AGE: int = 3600  # Au-delà, l'instantané est servi puis rafraîchi en arrière-plan
+
+    # Plans de correspondance des colonnes (import -> template), partagés entre workers via le disque
+    COLUMN_PLANS_DIR: str = os.path.join(DOCUMENTS_DIR, "column_plans")
+    COLUMN_PLANS_MAX_FILES: int = 1024  # Au-delà, les plans les moins récemment utilisés sont supprimés
+
+    # Rapprochement des appréciations : repli insensible aux accents, espaces et ordre des mots
+    APPRECIATIONS_FALLBACK_MATCHING: bool = True
+
+    # Rapprochement approché des noms de l'export avec les apprenants Yparéo
+    NAME_MATCH_THRESHOLD: float = 0.85  # Score minimal (0-1) pour retenir un apprenant
+    NAME_MATCH_AMBIGUITY_MARGIN: float = 0.05  # Écart minimal avec le second candidat, sinon ambigu
+    NAME_MATCH_MAX_CANDIDATES: int = 20  # Candidats comparés après blocage par trigrammes
+    NAME_MATCH_AUTO_FILL_THRESHOLD: float = 0.9  # Score minimal pour reporter les données d'un rapprochement approché
+    NAME_MATCH_MAX_TYPO_EDITS: int = 1  # Fautes de frappe tolérées dans le prénom (même nom de famille exigé)
+
+    # Détection de la classe d'un export sans en-tête identique à celui d'une classe déclarée
+    CLASS_DETECTION_MIN_SCORE: float = 0.9  # Score minimal (0-1) des titres reconnus pour retenir une classe
+    CLASS_DETECTION_MARGIN: float = 0.05  # Écart minimal avec la classe suivante, sinon ambigu
+
+    # Suivi de progression : messages envoyés au plus N fois par seconde et par connexion (les états intermédiaires sont fusionnés)
+    PROGRESS_MAX_UPDATES_PER_SECOND: float = 4.0
+    # Durée de conservation (secondes) de l'état d'une session sans connexion ouverte
+    PROGRESS_STATE_TTL: int = 3600
+
+    # Classeur fusionné enregistré dans DOCUMENTS_DIR (en arrière-plan) ; les bulletins le reçoivent en mémoire
+    SAVE_MERGED_WORKBOOK: bool = True
+    # Lecteur des classeurs lus par la génération des bulletins : "openpyxl" ou "calamine" (python-calamine, facultatif)
+    EXCEL_READER_BACKEND: str = "openpyxl"
+
+    # Pagination des collections Yparéo : jeux de données concernés et paramètres de requête
+    YPAREO_PAGINATED_DATASETS: list = []  # Ex. ["apprenants"], si le tenant accepte les paramètres ci-dessous
+    YPAREO_PAGE_PARAM: str = "page"
+    YPAREO_PAGE_SIZE_PARAM: str = "limit"
+    YPAREO_FIRST_PAGE: int = 1
+    YPAREO_PAGE_SIZE: int = 500
+    YPAREO_PAGE_CONCURRENCY: int = 4  # Pages (ou plages de dates) demandées simultanément
+    YPAREO_ABSENCES_RANGE_DAYS: int = 31  # Taille des sous-plages de dates des absences (0 = une seule requête)
+
+    # Récupération ciblée sur les groupes de la classe détectée (repli sur la récupération complète si refusée)
+    YPAREO_SCOPED_FETCH_ENABLED: bool = True
+    YPAREO_GROUP_APPRENANTS_PATH: str = "/r/v1/formation-longue/apprenants?codesPeriode={code_periode}&codesGroupe={code_groupe}"
+    YPAREO_GROUP_FREQUENTES_PATH: str = "/r/v1/apprenants/frequentes?codesPeriode={code_periode}&codesGroupe={code_groupe}"
+
+    # Nouvelles tentatives et disjoncteur pour les envois vers Yparéo
+    YPAREO_RETRY_ATTEMPTS: int = 3  # Envois au total, nouvelles tentatives comprises (au moins 1)
+    YPAREO_RETRY_BASE_DELAY: float = 1.0  # Secondes, doublé à chaque tentative (avec gigue)
+    YPAREO_RETRY_MAX_DELAY: float = 30.0  # Plafond du backoff et du Retry-After
+    YPAREO_CIRCUIT_FAILURE_THRESHOLD: int = 5  # Erreurs serveur consécutives avant ouverture
+    YPAREO_CIRCUIT_RESET_TIMEOUT: float = 60.0  # Durée d'ouverture avant un essai
+
     class Config:
         # Chargez les variables d'environnement à partir d'un fichier .env situé à la racine du projet.
         env_file = ".env"
@@ -0,0 +1,217 @@
+"""
+Serveur Yparéo de substitution, pour exécuter et mesurer le pipeline sans le tenant réel.
+
+Sert des données synthétiques (ou enregistrées) pour les cinq endpoints GET utilisés
+par fetch_api_data_for_template et accepte les envois de documents :
+
+    uvicorn app.devtools.ypareo_stub:app --port 8001
+    YPAERO_BASE_URL=http://127.0.0.1:8001 uvicorn app.main:app
+
+Le comportement se règle par variables d'environnement préfixées YPAREO_STUB_
+(latence, volume, taux d'erreur...). Si YPAREO_STUB_FIXTURES_DIR contient
+<jeu de données>.json (apprenants, groupes, absences, frequentes, periodes),
+ce fichier enregistré est servi à la place des données synthétiques.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+from datetime import date, timedelta
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class StubSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="YPAREO_STUB_")
+
+    LATENCY_MS: float = 50.0  # Latence ajoutée à chaque réponse
+    JITTER_MS: float = 20.0  # Variation aléatoire de la latence (+/-)
+    BYTES_PER_MS: float = 0.0  # Débit simulé (0 = illimité) : ajoute taille / débit à la latence
+    LEARNERS: int = 2000  # Nombre d'apprenants synthétiques
+    ABSENCES_PER_LEARNER: int = 10
+    PADDING_BYTES: int = 0  # Champ inutile ajouté à chaque enregistrement pour grossir les payloads
+    ERROR_RATE: float = 0.0  # Proportion de réponses en erreur
+    ERROR_STATUS: int = 503
+    RETRY_AFTER: str = ""  # Valeur de l'en-tête Retry-After des réponses en erreur
+    FIXTURES_DIR: str = ""
+    SEED: int = 42
+
+
+stub_settings = StubSettings()
+app = FastAPI(title="Yparéo stub")
+
+# Documents reçus : code apprenant -> noms des documents
+received_documents = {}
+
+SITES = ["Paris", "Lyon", "Marseille", "Nantes", "Bordeaux", "Lille", "Montpellier"]
+YEAR_START = date(2023, 9, 1)
+YEAR_END = date(2024, 8, 31)
+
+
+def _group_names():
+    names = []
+    for attribute in ("RELEVANT_GROUPS", "RELEVANT_GROUPS_M2", "RELEVANT_GROUPS_TP", "RELEVANT_GROUPS_TP_2",
+                      "RELEVANT_GROUPS_TP_3", "RELEVANT_GROUPS_ALT", "RELEVANT_GROUPS_ALT_2", "RELEVANT_GROUPS_ALT_3"):
+        names.extend(name for name in getattr(settings, attribute) if name not in names)
+    return names
+
+
+def _padding():
+    return {"padding": "x" * stub_settings.PADDING_BYTES} if stub_settings.PADDING_BYTES else {}
+
+
+def _build_dataset():
+    """Génère un jeu de données cohérent (mêmes codes apprenants et groupes partout), reproductible via SEED."""
+    rng = random.Random(stub_settings.SEED)
+    groupes = {
+        str(code): {"codeGroupe": code, "nomGroupe": name, "etenduGroupe": f"{name} 2023-2024", **_padding()}
+        for code, name in enumerate(_group_names(), start=1000)
+    }
+    group_codes = [groupe["codeGroupe"] for groupe in groupes.values()]
+
+    apprenants, frequentes, absences = {}, {}, {}
+    for index in range(stub_settings.LEARNERS):
+        code = 50000 + index
+        code_groupe = rng.choice(group_codes)
+        apprenants[str(code)] = {
+            "codeApprenant": code,
+            "nomApprenant": f"NOM{index:05d}",
+            "prenomApprenant": f"Prenom{index:05d}",
+            "dateNaissance": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1995, 2005)}",
+            "informationsCourantes": {"codeGroupe": code_groupe},
+            "inscriptions": [{"site": {"nomSite": rng.choice(SITES), "codeSite": 1}, "codeInscription": code}],
+            **_padding(),
+        }
+        frequentes[str(code)] = {
+            "codeFrequente": code,
+            "codeApprenant": code,
+            "codeGroupe": code_groupe,
+            "dateDeb": YEAR_START.strftime("%d/%m/%Y"),
+            "dateFin": YEAR_END.strftime("%d/%m/%Y"),
+            **_padding(),
+        }
+        for number in range(stub_settings.ABSENCES_PER_LEARNER):
+            code_absence = code * 100 + number
+            day = YEAR_START + timedelta(days=rng.randrange((YEAR_END - YEAR_START).days))
+            absences[str(code_absence)] = {
+                "codeAbsence": code_absence,
+                "codeApprenant": code,
+                "dateDeb": day.strftime("%d/%m/%Y") + " 09:00",
+                "duree": rng.choice([15, 30, 60, 120, 210]),
+                "isJustifie": rng.random() < 0.4,
+                "isRetard": rng.random() < 0.2,
+                **_padding(),
+            }
+
+    periodes = {
+        "1": {"codePeriode": 1, "nomPeriode": "2022-2023", "dateDeb": "01/09/2022", "dateFin": "31/08/2023"},
+        "2": {"codePeriode": 2, "nomPeriode": "2023-2024", "dateDeb": "01/09/2023", "dateFin": "31/08/2024"},
+    }
+    return {"apprenants": apprenants, "groupes": groupes, "absences": absences, "frequentes": frequentes, "periodes": periodes}
+
+
+def _load_dataset():
+    dataset = _build_dataset()
+    if stub_settings.FIXTURES_DIR:
+        for name in dataset:
+            path = os.path.join(stub_settings.FIXTURES_DIR, f"{name}.json")
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    dataset[name] = json.load(f)
+                logger.info(f"Serving recorded fixture {path}")
+    return dataset
+
+
+DATASET = _load_dataset()
+
+
+def _filter_groups(records, request):
+    codes = request.query_params.get("codesGroupe")
+    if not codes:
+        return records
+    wanted = set(codes.split(","))
+    return {
+        key: record for key, record in records.items()
+        if str(record.get("codeGroupe", (record.get("informationsCourantes") or {}).get("codeGroupe"))) in wanted
+    }
+
+
+def _paginate(records, request):
+    page = request.query_params.get(settings.YPAREO_PAGE_PARAM)
+    if page is None:
+        return records
+    size = int(request.query_params.get(settings.YPAREO_PAGE_SIZE_PARAM, settings.YPAREO_PAGE_SIZE))
+    start = (int(page) - settings.YPAREO_FIRST_PAGE) * size
+    keys = list(records)[start:start + size]
+    return {key: records[key] for key in keys}
+
+
+async def _respond(payload):
+    body = json.dumps(payload).encode()
+    delay = stub_settings.LATENCY_MS + random.uniform(-stub_settings.JITTER_MS, stub_settings.JITTER_MS)
+    if stub_settings.BYTES_PER_MS:
+        delay += len(body) / stub_settings.BYTES_PER_MS
+    await asyncio.sleep(max(0.0, delay) / 1000)
+
+    if stub_settings.ERROR_RATE and random.random() < stub_settings.ERROR_RATE:
+        headers = {"Retry-After": stub_settings.RETRY_AFTER} if stub_settings.RETRY_AFTER else {}
+        return JSONResponse({"message": "Injected error"}, status_code=stub_settings.ERROR_STATUS, headers=headers)
+    return Response(content=body, media_type="application/json")
+
+
+@app.get("/r/v1/formation-longue/apprenants")
+async def get_apprenants(request: Request):
+    return await _respond(_paginate(_filter_groups(DATASET["apprenants"], request), request))
+
+
+@app.get("/r/v1/formation-longue/groupes")
+async def get_groupes(request: Request):
+    return await _respond(_paginate(DATASET["groupes"], request))
+
+
+@app.get("/r/v1/apprenants/frequentes")
+async def get_frequentes(request: Request):
+    return await _respond(_paginate(_filter_groups(DATASET["frequentes"], request), request))
+
+
+@app.get("/r/v1/periodes")
+async def get_periodes():
+    return await _respond(DATASET["periodes"])
+
+
+@app.get("/r/v1/absences/{debut}/{fin}")
+async def get_absences(debut: str, fin: str, request: Request):
+    start = date(int(debut[6:]), int(debut[3:5]), int(debut[:2]))
+    end = date(int(fin[6:]), int(fin[3:5]), int(fin[:2]))
+
+    def in_range(absence):
+        day = absence.get("dateDeb", "")[:10]
+        try:
+            return start <= date(int(day[6:10]), int(day[3:5]), int(day[:2])) <= end
+        except ValueError:
+            return False
+
+    records = {key: absence for key, absence in DATASET["absences"].items() if in_range(absence)}
+    return await _respond(_paginate(records, request))
+
+
+@app.post("/r/v1/document/apprenant/{code_apprenant}/document")
+async def post_document(code_apprenant: str, request: Request):
+    payload = await request.json()
+    missing = [key for key in ("contenu", "nomDocument", "typeMime", "extension") if key not in payload]
+    if missing:
+        return JSONResponse({"message": f"Missing fields: {missing}"}, status_code=400)
+    received_documents.setdefault(code_apprenant, []).append(payload["nomDocument"])
+    return await _respond({"codeApprenant": code_apprenant, "nomDocument": payload["nomDocument"]})
+
+
+@app.get("/stub/documents")
+async def get_received_documents():
+    return received_documents
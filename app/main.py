@@ -1,5 +1,9 @@
 import logging
-from app.api.endpoints import uploads, importBulletin
+from contextlib import asynccontextmanager
+from app.api.endpoints import uploads, importBulletin, ypareo
+from app.services.api_service import init_http_client, close_http_client, start_memory_tracing, stop_memory_tracing
+from app.services.snapshot_service import start_loading as load_ypareo_snapshot
+from app.services.template_registry import load_registry as load_template_registry
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -7,7 +11,25 @@ from fastapi.middleware.cors import CORSMiddleware
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Registre des templates validé une fois : une déclaration incohérente empêche le démarrage
+    load_template_registry()
+    # Mesure mémoire des décodages Yparéo, si demandée (YPAREO_TRACE_DECODE_MEMORY)
+    memory_tracing = start_memory_tracing()
+    # Un seul client HTTP (keep-alive) pour toute la durée de vie de l'application
+    await init_http_client()
+    # Instantané Yparéo relu depuis le disque en arrière-plan : le premier job n'attend pas l'API
+    load_ypareo_snapshot()
+    try:
+        yield
+    finally:
+        await close_http_client()
+        stop_memory_tracing(memory_tracing)
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Ajouter la middleware CORS
 app.add_middleware(
@@ -21,6 +43,7 @@ app.add_middleware(
 # Inclusion des routes des différents modules
 app.include_router(uploads.router, prefix="", tags=["uploads"])  # Uploads sans préfixe
 app.include_router(importBulletin.router, prefix="/importBulletins", tags=["importBulletins"])
+app.include_router(ypareo.router, prefix="/ypareo", tags=["ypareo"])
 
 
 @app.get("/")
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, date, timedelta
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.api_service import fetch_api_data_shared
+from app.utils import absence_utils
+
+# Configure the logger
+logger = logging.getLogger(__name__)
+
+ABSENCES_PATH = "/r/v1/absences/{debut}/{fin}"
+YPAREO_DATE_FORMAT = '%d-%m-%Y'  # Format des dates dans l'URL des absences
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS absences (
+    id TEXT PRIMARY KEY,
+    code_apprenant TEXT NOT NULL,
+    date TEXT,
+    duree INTEGER NOT NULL,
+    is_justifie INTEGER NOT NULL,
+    is_retard INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_absences_date ON absences(date);
+CREATE TABLE IF NOT EXISTS absence_totals (
+    code_apprenant TEXT PRIMARY KEY,
+    justified INTEGER NOT NULL,
+    unjustified INTEGER NOT NULL,
+    delays INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Une seule synchronisation à la fois ; instant (monotone) de la dernière synchronisation réussie
+_sync_lock = asyncio.Lock()
+_last_sync_at = None
+_background_sync = None
+# Totaux formatés partagés entre les jobs : (version du stockage, totaux) et (payload, totaux)
+_store_totals = (None, None)
+_payload_totals = (None, None)
+
+
+def summarize_absences(absences_data):
+    """
+    Totaux formatés par apprenant pour un payload d'absences complet. Le payload
+    venant du cache partagé, l'agrégation n'est refaite que lorsqu'il change.
+    """
+    global _payload_totals
+    payload, totals = _payload_totals
+    if payload is not absences_data:
+        totals = absence_utils.summarize_absences(absences_data)
+        _payload_totals = (absences_data, totals)
+    return totals
+
+
+def _parse_absence_date(value):
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value[:10], '%d/%m/%Y').date().isoformat()
+    except ValueError:
+        return None
+
+
+def _connect():
+    os.makedirs(os.path.dirname(settings.ABSENCE_STORE_PATH), exist_ok=True)
+    connection = sqlite3.connect(settings.ABSENCE_STORE_PATH)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _read_state(connection):
+    return dict(connection.execute("SELECT key, value FROM sync_state").fetchall())
+
+
+def _sync_window(state, today):
+    """Détermine la fenêtre à récupérer : année complète au premier passage, sinon depuis la dernière synchro moins le recul."""
+    period_start = datetime.strptime(settings.ABSENCES_PERIOD_START, YPAREO_DATE_FORMAT).date()
+    period_end = datetime.strptime(settings.ABSENCES_PERIOD_END, YPAREO_DATE_FORMAT).date()
+    period_key = f"{settings.ABSENCES_PERIOD_START}/{settings.ABSENCES_PERIOD_END}"
+
+    last_sync = state.get('last_sync')
+    if last_sync is None or state.get('period') != period_key:
+        return period_start, period_end, True
+
+    window_start = date.fromisoformat(last_sync) - timedelta(days=settings.ABSENCES_SYNC_LOOKBACK_DAYS)
+    return max(window_start, period_start), min(today, period_end), False
+
+
+def _apply_sync(records, window_start, window_end, full, today):
+    rows = []
+    undated = 0
+    for key, absence in records.items():
+        # Sans date lisible, une absence ne serait jamais remplacée par la synchro incrémentale
+        # (suppression par fenêtre de dates) et resterait comptée même supprimée dans Yparéo : elle est ignorée
+        absence_date = _parse_absence_date(absence.get('dateDeb'))
+        if absence_date is None:
+            undated += 1
+            continue
+        rows.append((
+            str(absence.get('codeAbsence', key)),
+            str(absence.get('codeApprenant')),
+            absence_date,
+            int(absence.get('duree', 0)),
+            1 if absence.get('isJustifie') else 0,
+            1 if absence.get('isRetard') else 0,
+        ))
+    if undated:
+        logger.warning(f"Absence store: {undated} absences without a valid 'dateDeb' skipped")
+
+    with _connect() as connection:
+        if full:
+            connection.execute("DELETE FROM absences")
+        else:
+            # Les absences de la fenêtre sont remplacées : corrections et suppressions sont prises en compte
+            # (ainsi que les éventuelles absences sans date enregistrées par une version antérieure)
+            connection.execute(
+                "DELETE FROM absences WHERE date BETWEEN ? AND ? OR date IS NULL",
+                (window_start.isoformat(), window_end.isoformat()),
+            )
+        connection.executemany("INSERT OR REPLACE INTO absences VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+        connection.execute("DELETE FROM absence_totals")
+        connection.execute("""
+            INSERT INTO absence_totals
+            SELECT code_apprenant,
+                   SUM(CASE WHEN is_justifie THEN duree ELSE 0 END),
+                   SUM(CASE WHEN NOT is_justifie AND NOT is_retard THEN duree ELSE 0 END),
+                   SUM(CASE WHEN NOT is_justifie AND is_retard THEN duree ELSE 0 END)
+            FROM absences
+            GROUP BY code_apprenant
+        """)
+        connection.executemany("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", [
+            ('last_sync', today.isoformat()),
+            ('version', repr(time.time())),
+            ('period', f"{settings.ABSENCES_PERIOD_START}/{settings.ABSENCES_PERIOD_END}"),
+        ])
+    logger.info(f"Absence store synced ({'full' if full else 'incremental'}): {len(rows)} absences from {window_start} to {window_end}")
+
+
+def _load_state():
+    with _connect() as connection:
+        return _read_state(connection)
+
+
+def load_absence_totals():
+    """
+    Lit les totaux d'absences par apprenant depuis l'index local, déjà formatés.
+    Ils ne sont relus et reformatés qu'après une synchronisation.
+    """
+    global _store_totals
+    with _connect() as connection:
+        row = connection.execute("SELECT value FROM sync_state WHERE key = 'version'").fetchone()
+        version = row[0] if row else None
+        cached_version, totals = _store_totals
+        if totals is not None and cached_version == version:
+            return totals
+        rows = connection.execute("SELECT code_apprenant, justified, unjustified, delays FROM absence_totals").fetchall()
+
+    learner_codes = [code_apprenant for code_apprenant, *_ in rows]
+    minutes = np.array([row[1:] for row in rows], dtype=np.int64).reshape(-1, len(absence_utils.ABSENCE_KINDS))
+    totals = absence_utils.format_absence_totals(learner_codes, minutes)
+    _store_totals = (version, totals)
+    return totals
+
+
+async def sync_absences(headers, force=False):
+    """Met à jour le stockage local des absences depuis Yparéo (synchro complète la première fois, incrémentale ensuite)."""
+    global _last_sync_at
+    async with _sync_lock:
+        if not force and _last_sync_at is not None and time.monotonic() - _last_sync_at < settings.ABSENCES_SYNC_INTERVAL:
+            return
+
+        today = date.today()
+        state = await asyncio.to_thread(_load_state)
+        window_start, window_end, full = _sync_window(state, today)
+        if window_start <= window_end:
+            url = settings.YPAERO_BASE_URL + ABSENCES_PATH.format(
+                debut=window_start.strftime(YPAREO_DATE_FORMAT),
+                fin=window_end.strftime(YPAREO_DATE_FORMAT),
+            )
+            records = await fetch_api_data_shared(url, headers)
+            await asyncio.to_thread(_apply_sync, records, window_start, window_end, full, today)
+        _last_sync_at = time.monotonic()
+
+
+def _forget_last_sync():
+    with _connect() as connection:
+        connection.execute("DELETE FROM sync_state WHERE key = 'last_sync'")
+
+
+async def reset_sync():
+    """
+    Oublie la dernière synchronisation : le prochain job attend une synchronisation complète
+    (année entière) au lieu d'être servi par les totaux locaux (invalidation du cache des absences).
+    """
+    global _last_sync_at
+    async with _sync_lock:
+        await asyncio.to_thread(_forget_last_sync)
+        _last_sync_at = None
+    logger.info("Absence store: full resync requested")
+
+
+async def _sync_in_background(headers):
+    global _background_sync
+    try:
+        await sync_absences(headers)
+    except Exception as e:
+        logger.warning(f"Background absence sync failed: {e}")
+    finally:
+        _background_sync = None
+
+
+async def get_absence_totals(headers):
+    """
+    Retourne les totaux d'absences par apprenant. Tant que le stockage local est
+    vide, la synchronisation est attendue ; ensuite (y compris après un redémarrage)
+    les totaux locaux sont servis et la synchronisation tourne en arrière-plan.
+    """
+    global _background_sync
+    if _last_sync_at is None or time.monotonic() - _last_sync_at >= settings.ABSENCES_SYNC_INTERVAL:
+        state = await asyncio.to_thread(_load_state)
+        if 'last_sync' not in state:
+            await sync_absences(headers)
+        elif _background_sync is None:
+            _background_sync = asyncio.create_task(_sync_in_background(headers))
+    return await asyncio.to_thread(load_absence_totals)
@@ -1,8 +1,25 @@
+import asyncio
+import contextvars
+import importlib.util
+import json
+import re
+import time
+import tracemalloc
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
 import httpx
 from fastapi import HTTPException
 import logging
-import requests
-from requests.exceptions import RequestException
+from app.core.config import settings
+
+try:
+    import ijson
+    _JSON_ERRORS = (ValueError, ijson.JSONError)
+except ImportError:  # Décodage en flux indisponible : repli sur un décodage complet
+    ijson = None
+    _JSON_ERRORS = (ValueError,)
 
 # Configure the logger
 logger = logging.getLogger(__name__)
@@ -12,41 +29,419 @@ logger.setLevel(logging.INFO)  # Set to INFO or ERROR for production
 DOCUMENTS_API_URL = 'https://bulletin.groupe-espi.fr/api/documents'  # Replace with the correct base URL
 HTTP_TIMEOUT = 60.0
 
+# Jeux de données Yparéo, identifiés par le chemin de leur endpoint
+YPAREO_DATASETS = {
+    "/r/v1/formation-longue/apprenants": "apprenants",
+    "/r/v1/formation-longue/groupes": "groupes",
+    "/r/v1/absences": "absences",
+    "/r/v1/apprenants/frequentes": "frequentes",
+    "/r/v1/periodes": "periodes",
+}
+
+# Plage de dates dans l'URL des absences : /r/v1/absences/jj-mm-aaaa/jj-mm-aaaa
+ABSENCES_RANGE_RE = re.compile(r'/r/v1/absences/(\d{2}-\d{2}-\d{4})/(\d{2}-\d{2}-\d{4})')
+
+# Client HTTP partagé par toute l'application (créé au démarrage, fermé à l'arrêt)
+_http_client = None
+# Sémaphores limitant le nombre de requêtes simultanées par hôte
+_host_semaphores = {}
+# Requêtes GET en cours, partagées entre appelants concurrents : url -> tâche
+_inflight = {}
+# Statistiques du dernier décodage en flux, par jeu de données
+fetch_stats = {}
+# Décodages mesurés un par un quand tracemalloc est actif (son pic est commun à tout le processus)
+_decode_memory_lock = asyncio.Lock()
+# Statistiques des sous-requêtes (sous-plages de dates) d'une même récupération, agrégées à la fin
+_part_stats = contextvars.ContextVar("ypareo_part_stats", default=None)
+
+
+def _build_http_client():
+    http2 = settings.HTTP2_ENABLED
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP/2 requested but the 'h2' package is not installed, falling back to HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=HTTP_TIMEOUT, follow_redirects=True)
+
+
+async def init_http_client():
+    """Crée le client HTTP partagé (appelé au démarrage de l'application)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = _build_http_client()
+        logger.info("Shared HTTP client initialised")
+    return _http_client
+
+
+async def close_http_client():
+    """Ferme le client HTTP partagé et libère les connexions du pool."""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+        logger.info("Shared HTTP client closed")
+    _http_client = None
+    _host_semaphores.clear()
+
+
+def get_http_client():
+    """Retourne le client partagé, en le créant à la volée hors du cycle de vie de l'application."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = _build_http_client()
+    return _http_client
+
+
+def dataset_for_url(url):
+    """Retourne le nom du jeu de données Yparéo servi par l'URL (ou None)."""
+    path = urlsplit(str(url)).path
+    for endpoint, dataset in YPAREO_DATASETS.items():
+        if endpoint in path:
+            return dataset
+    return None
+
+
+@asynccontextmanager
+async def host_slot(url):
+    """Réserve une place parmi les requêtes autorisées simultanément vers l'hôte de l'URL."""
+    host = urlsplit(str(url)).netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = _host_semaphores[host] = asyncio.Semaphore(settings.HTTP_MAX_CONNECTIONS_PER_HOST)
+    async with semaphore:
+        yield
+
+
+async def send_request(method, url, **kwargs):
+    """Envoie une requête via le client partagé en respectant la limite par hôte."""
+    client = get_http_client()
+    async with host_slot(url):
+        return await client.request(method, url, **kwargs)
+
+
 # Function to save the Excel file URL to the database
-def save_generated_excel_url_to_db(user_id, excel_url):
+async def save_generated_excel_url_to_db(user_id, excel_url):
     try:
-        response = requests.post(
+        response = await send_request(
+            "POST",
             DOCUMENTS_API_URL,
             json={
                 'userId': user_id,
                 'generatedExcelUrl': excel_url
             },
-            timeout=HTTP_TIMEOUT
         )
         response.raise_for_status()
-    except RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Failed to save Excel URL: {str(e)}")
         raise Exception(f"Failed to save Excel URL: {str(e)}")
 
+# Projections appliquées lors du décodage en flux : seuls les champs utilisés sont conservés
+def _project_apprenant(apprenant):
+    projected = {
+        key: apprenant[key]
+        for key in ('codeApprenant', 'nomApprenant', 'prenomApprenant', 'dateNaissance', 'informationsCourantes')
+        if key in apprenant
+    }
+    inscriptions = apprenant.get('inscriptions')
+    if inscriptions:
+        site = (inscriptions[0] or {}).get('site') or {}
+        projected['inscriptions'] = [{'site': {'nomSite': site['nomSite']} if 'nomSite' in site else {}}]
+    return projected
+
+
+def _project_absence(absence):
+    return {
+        key: absence[key]
+        for key in ('codeAbsence', 'codeApprenant', 'dateDeb', 'duree', 'isJustifie', 'isRetard')
+        if key in absence
+    }
+
+
+STREAMING_PROJECTIONS = {
+    "apprenants": _project_apprenant,
+    "absences": _project_absence,
+}
+
+
+class _ResponseReader:
+    """Adapte le flux d'octets d'une réponse httpx à l'interface read() asynchrone attendue par ijson."""
+
+    def __init__(self, response):
+        self._chunks = response.aiter_bytes()
+        self.bytes_read = 0
+
+    async def read(self, size=-1):
+        if size == 0:  # ijson sonde le type du flux avec read(0)
+            return b""
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def start_memory_tracing():
+    """Active tracemalloc si YPAREO_TRACE_DECODE_MEMORY (au démarrage) ; retourne True s'il a été démarré ici."""
+    if not settings.YPAREO_TRACE_DECODE_MEMORY or tracemalloc.is_tracing():
+        return False
+    tracemalloc.start()
+    logger.info("Tracing memory of Yparéo decodes (decodes are serialized)")
+    return True
+
+
+def stop_memory_tracing(started):
+    if started:
+        tracemalloc.stop()
+
+
+async def _fetch_streaming(url, headers, dataset, project):
+    """
+    Décode la réponse au fil de l'eau et ne garde que les champs utiles de chaque enregistrement.
+    Avec tracemalloc actif, le pic mémoire du décodage est mesuré au-dessus de la mémoire allouée
+    à son début ; le pic de tracemalloc étant global, les décodages sont alors faits un par un.
+    """
+    started = time.perf_counter()
+    tracing = tracemalloc.is_tracing()
+    memory = {}
+
+    client = get_http_client()
+    async with host_slot(url), (_decode_memory_lock if tracing else nullcontext()):
+        if tracing:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+
+            reader = _ResponseReader(response)
+            if ijson is not None:
+                data = {key: project(record) async for key, record in ijson.kvitems_async(reader, '', use_float=True)}
+            else:
+                body = bytearray()
+                while chunk := await reader.read():
+                    body.extend(chunk)
+                payload = json.loads(body)
+                del body
+                if not isinstance(payload, dict):
+                    raise ValueError(f"Unexpected JSON payload type: {type(payload)}")
+                data = {key: project(record) for key, record in payload.items()}
+                del payload
+        if tracing and tracemalloc.is_tracing():
+            memory["peak_memory_kb"] = max(0, tracemalloc.get_traced_memory()[1] - baseline) // 1024
+
+    stats = {
+        "url": url,
+        "bytes_read": reader.bytes_read,
+        "records": len(data),
+        **memory,
+        "seconds": round(time.perf_counter() - started, 3),
+        "streaming": ijson is not None,
+    }
+    parts = _part_stats.get()
+    if parts is not None:
+        # Sous-requête : les statistiques du jeu de données sont agrégées par l'appelant
+        parts.append(stats)
+        logger.debug(f"Decoded {dataset} part: {stats}")
+    else:
+        fetch_stats[dataset] = stats
+        logger.info(f"Decoded {dataset}: {stats}")
+    return data
+
+
+def _record_part_stats(url, parts, records, started):
+    """Statistiques d'une récupération découpée en sous-requêtes (pages, sous-plages de dates) : volumes cumulés, pic du plus gros décodage, durée totale."""
+    if not parts:
+        return
+    dataset = dataset_for_url(url)
+    fetch_stats[dataset] = {
+        "url": url,
+        "bytes_read": sum(part["bytes_read"] for part in parts),
+        "records": records,
+        "records_fetched": sum(part["records"] for part in parts),
+        "parts": len(parts),
+        "seconds": round(time.perf_counter() - started, 3),
+        "streaming": all(part["streaming"] for part in parts),
+    }
+    peaks = [part["peak_memory_kb"] for part in parts if "peak_memory_kb" in part]
+    if peaks:
+        fetch_stats[dataset]["peak_memory_kb"] = max(peaks)
+    logger.info(f"Decoded {dataset}: {fetch_stats[dataset]}")
+
+
+def _with_query(url, params):
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True) + list(params.items())
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+async def _fetch_pages(url, headers):
+    """
+    Récupère une collection page par page. Les pages sont demandées par vagues de
+    YPAREO_PAGE_CONCURRENCY jusqu'à obtenir une page incomplète ; les résultats sont
+    fusionnés dans un seul dict, comme pour une réponse unique.
+    """
+    page_size = settings.YPAREO_PAGE_SIZE
+    semaphore = asyncio.Semaphore(settings.YPAREO_PAGE_CONCURRENCY)
+
+    async def fetch_page(number):
+        async with semaphore:
+            params = {settings.YPAREO_PAGE_PARAM: number, settings.YPAREO_PAGE_SIZE_PARAM: page_size}
+            return await _fetch_single(_with_query(url, params), headers)
+
+    started = time.perf_counter()
+    parts = []
+    token = _part_stats.set(parts)
+    try:
+        data = await fetch_page(settings.YPAREO_FIRST_PAGE)
+        next_page = settings.YPAREO_FIRST_PAGE + 1
+        pages = 1
+        done = len(data) < page_size
+        if len(data) > page_size:
+            # Plus d'enregistrements que demandé : le serveur ignore la pagination et a tout renvoyé
+            logger.warning(f"Pagination parameters seem ignored by {url} ({len(data)} records for a page of {page_size})")
+            done = True
+        while not done:
+            batch = await asyncio.gather(*(fetch_page(next_page + i) for i in range(settings.YPAREO_PAGE_CONCURRENCY)))
+            next_page += len(batch)
+            for page in batch:
+                pages += 1
+                if page and not page.keys() - data.keys():
+                    # Le serveur ignore les paramètres de pagination : la collection est déjà complète
+                    logger.warning(f"Pagination parameters seem ignored by {url}, stopping after {pages} pages")
+                    done = True
+                    break
+                data.update(page)
+                if len(page) < page_size:
+                    done = True
+                    break
+    finally:
+        _part_stats.reset(token)
+
+    _record_part_stats(url, parts, len(data), started)
+    logger.info(f"Fetched {len(data)} records from {url} in {pages} pages")
+    return data
+
+
+def _date_ranges(start, end, days):
+    while start <= end:
+        range_end = min(start + timedelta(days=days - 1), end)
+        yield start, range_end
+        start = range_end + timedelta(days=1)
+
+
+async def _fetch_date_ranges(url, match, headers):
+    """Découpe la plage de dates des absences en sous-plages récupérées en parallèle, puis fusionne les résultats."""
+    start = datetime.strptime(match.group(1), '%d-%m-%Y')
+    end = datetime.strptime(match.group(2), '%d-%m-%Y')
+    semaphore = asyncio.Semaphore(settings.YPAREO_PAGE_CONCURRENCY)
+
+    async def fetch_range(range_start, range_end):
+        range_url = f"{url[:match.start()]}/r/v1/absences/{range_start:%d-%m-%Y}/{range_end:%d-%m-%Y}{url[match.end():]}"
+        async with semaphore:
+            return await _fetch_single(range_url, headers)
+
+    ranges = list(_date_ranges(start, end, settings.YPAREO_ABSENCES_RANGE_DAYS))
+    started = time.perf_counter()
+    parts = []
+    token = _part_stats.set(parts)
+    try:
+        # Les tâches de gather copient le contexte : toutes les sous-plages alimentent la même liste
+        results = await asyncio.gather(*(fetch_range(range_start, range_end) for range_start, range_end in ranges))
+    finally:
+        _part_stats.reset(token)
+
+    # Une absence à cheval sur deux sous-plages n'est gardée qu'une fois : elle est identifiée par son
+    # codeAbsence (comme dans le stockage local), quelle que soit la clé sous laquelle l'API la renvoie
+    data, keys = {}, {}
+    duplicates = 0
+    for result in results:
+        for key, absence in result.items():
+            identity = str(absence.get('codeAbsence', key)) if isinstance(absence, dict) else str(key)
+            if identity in keys:
+                duplicates += 1
+                key = keys[identity]
+            else:
+                keys[identity] = key
+            data[key] = absence
+    _record_part_stats(url, parts, len(data), started)
+    logger.info(f"Fetched {len(data)} records from {url} in {len(ranges)} date ranges ({duplicates} duplicates merged)")
+    return data
+
+
 async def fetch_api_data(url: str, headers: dict):
+    """
+    Récupère un jeu de données Yparéo. Selon la configuration, les absences sont
+    demandées par sous-plages de dates et les collections listées dans
+    YPAREO_PAGINATED_DATASETS page par page, en parallèle.
+    """
+    match = ABSENCES_RANGE_RE.search(url)
+    if match and settings.YPAREO_ABSENCES_RANGE_DAYS > 0:
+        return await _fetch_date_ranges(url, match, headers)
+
+    query = dict(parse_qsl(urlsplit(url).query))
+    if dataset_for_url(url) in settings.YPAREO_PAGINATED_DATASETS and settings.YPAREO_PAGE_PARAM not in query:
+        return await _fetch_pages(url, headers)
+
+    return await _fetch_single(url, headers)
+
+
+async def _fetch_single(url: str, headers: dict):
     logger.debug(f"Fetching data from {url} with headers {headers}")
-    
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        try:
-            response = await client.get(url, headers=headers, timeout=HTTP_TIMEOUT)
-            response.raise_for_status()
-        except httpx.RequestError as exc:
-            logger.error(f"An error occurred while requesting {exc.request.url!r}: {str(exc)}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
-        except httpx.HTTPStatusError as exc:
-            logger.error(f"Error response {exc.response.status_code} while requesting {exc.request.url!r}: {exc.response.text}")
-            raise HTTPException(status_code=exc.response.status_code, detail=f"API call failed with status {exc.response.status_code}")
-    
-        try:
-            data = response.json()
-            logger.debug(f"Fetched data type: {type(data)}")
-            logger.debug(f"Fetched data: {data}")
-            return data
-        except ValueError as e:
-            logger.error(f"Error parsing JSON: {str(e)}")
-            raise HTTPException(status_code=500, detail="Error parsing JSON")
\ No newline at end of file
+
+    dataset = dataset_for_url(url)
+    project = STREAMING_PROJECTIONS.get(dataset) if settings.YPAREO_STREAMING_DECODE else None
+
+    try:
+        if project is not None:
+            return await _fetch_streaming(url, headers, dataset, project)
+        response = await send_request("GET", url, headers=headers)
+        response.raise_for_status()
+    except httpx.RequestError as exc:
+        logger.error(f"An error occurred while requesting {exc.request.url!r}: {str(exc)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    except httpx.HTTPStatusError as exc:
+        logger.error(f"Error response {exc.response.status_code} while requesting {exc.request.url!r}: {exc.response.text}")
+        raise HTTPException(status_code=exc.response.status_code, detail=f"API call failed with status {exc.response.status_code}")
+    except _JSON_ERRORS as e:
+        logger.error(f"Error parsing JSON stream from {url}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error parsing JSON")
+
+    try:
+        data = response.json()
+        logger.debug(f"Fetched data type: {type(data)}")
+        logger.debug(f"Fetched data: {data}")
+        return data
+    except ValueError as e:
+        logger.error(f"Error parsing JSON: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error parsing JSON")
+
+
+def _release_inflight(url, task):
+    if _inflight.get(url) is task:
+        del _inflight[url]
+    # Marque l'exception comme consommée si tous les appelants ont été annulés
+    if not task.cancelled():
+        task.exception()
+
+
+async def fetch_api_data_shared(url: str, headers: dict):
+    """
+    Variante de fetch_api_data qui regroupe les appels concurrents sur une même URL :
+    le premier appelant lance la requête, les suivants attendent le même résultat
+    (ou la même exception).
+    """
+    task = _inflight.get(url)
+    if task is None:
+        task = asyncio.create_task(fetch_api_data(url, headers))
+        _inflight[url] = task
+        task.add_done_callback(lambda t: _release_inflight(url, t))
+    else:
+        logger.debug(f"Joining in-flight request for {url}")
+    # shield : l'annulation d'un appelant ne doit pas annuler la requête des autres
+    return await asyncio.shield(task)
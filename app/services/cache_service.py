@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+
+from app.core.config import settings
+from app.services.api_service import fetch_api_data_shared, dataset_for_url
+
+# Configure the logger
+logger = logging.getLogger(__name__)
+
+# Cache en mémoire des réponses Yparéo : url -> (données, instant de récupération)
+_cache = {}
+# Rafraîchissements en arrière-plan en cours, par URL
+_refresh_tasks = {}
+# Incrémenté à chaque invalidation pour ignorer les rafraîchissements devenus obsolètes
+_generation = 0
+
+
+def _ttl_for(url):
+    dataset = dataset_for_url(url)
+    return settings.YPAREO_CACHE_TTLS.get(dataset, settings.YPAREO_CACHE_DEFAULT_TTL)
+
+
+def _store(url, data, generation):
+    if generation != _generation:
+        logger.debug(f"Discarding refreshed data for {url}: cache invalidated meanwhile")
+        return
+    _cache[url] = (data, time.monotonic())
+
+
+async def _refresh(url, headers, generation):
+    try:
+        data = await fetch_api_data_shared(url, headers)
+        _store(url, data, generation)
+        logger.debug(f"Background refresh completed for {url}")
+    except Exception as e:
+        # On garde l'entrée périmée : elle reste servie jusqu'au prochain essai
+        logger.warning(f"Background refresh failed for {url}: {e}")
+    finally:
+        _refresh_tasks.pop(url, None)
+
+
+def _schedule_refresh(url, headers):
+    if url in _refresh_tasks:
+        return
+    _refresh_tasks[url] = asyncio.create_task(_refresh(url, headers, _generation))
+
+
+async def fetch_cached(url: str, headers: dict):
+    """
+    Récupère un jeu de données Yparéo en passant par le cache.
+
+    Une entrée fraîche est servie telle quelle. Une entrée périmée (mais plus
+    récente que YPAREO_CACHE_MAX_STALE) est servie immédiatement pendant qu'un
+    rafraîchissement tourne en arrière-plan. Sinon la requête est faite directement.
+    """
+    if not settings.YPAREO_CACHE_ENABLED:
+        return await fetch_api_data_shared(url, headers)
+
+    entry = _cache.get(url)
+    if entry is not None:
+        data, fetched_at = entry
+        age = time.monotonic() - fetched_at
+        if age < _ttl_for(url):
+            logger.debug(f"Cache hit for {url} (age {age:.0f}s)")
+            return data
+        if age < settings.YPAREO_CACHE_MAX_STALE:
+            logger.debug(f"Serving stale cache entry for {url} (age {age:.0f}s), refreshing in background")
+            _schedule_refresh(url, headers)
+            return data
+
+    generation = _generation
+    data = await fetch_api_data_shared(url, headers)
+    _store(url, data, generation)
+    return data
+
+
+def invalidate(dataset=None):
+    """Vide le cache, entièrement ou pour un seul jeu de données. Retourne les URLs retirées."""
+    global _generation
+    _generation += 1
+    urls = [url for url in _cache if dataset is None or dataset_for_url(url) == dataset]
+    for url in urls:
+        _cache.pop(url, None)
+    logger.info(f"Invalidated {len(urls)} Yparéo cache entries (dataset={dataset or 'all'})")
+    return urls
+
+
+def cache_stats():
+    now = time.monotonic()
+    return {
+        url: {
+            "dataset": dataset_for_url(url),
+            "age_seconds": round(now - fetched_at, 1),
+            "ttl_seconds": _ttl_for(url),
+            "refreshing": url in _refresh_tasks,
+        }
+        for url, (_, fetched_at) in _cache.items()
+    }
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+
+from app.core.config import settings
+from app.utils.sheet_utils import normalize_title
+
+# Configure the logger
+logger = logging.getLogger(__name__)
+
+# À incrémenter dès que la forme d'un plan change : les fichiers existants sont alors ignorés
+PLAN_VERSION = 1
+MAX_PLANS = 256
+
+# Plans compilés, par signature d'en-têtes
+_plans = {}
+# Partie « template » des signatures, par table de titres (les tables viennent du cache de templates)
+_template_keys = {}
+plan_metrics = {"hits": 0, "disk_hits": 0, "compiled": 0, "pruned": 0}
+
+
+class ColumnPlan:
+    """
+    Plan de recopie d'un export Yparéo vers un template :
+    paires (colonne source, colonne destination) dans l'ordre d'application,
+    colonne du nom dans l'export et colonnes de l'export non reprises.
+    """
+
+    def __init__(self, signature, copies, name_column, skipped_columns):
+        self.signature = signature
+        self.copies = tuple(tuple(pair) for pair in copies)
+        self.name_column = name_column
+        self.skipped_columns = tuple(skipped_columns)
+
+    def to_dict(self):
+        return {
+            "version": PLAN_VERSION,
+            "signature": self.signature,
+            "copies": self.copies,
+            "name_column": self.name_column,
+            "skipped_columns": self.skipped_columns,
+        }
+
+    @classmethod
+    def from_dict(cls, payload):
+        return cls(payload["signature"], payload["copies"], payload["name_column"], payload["skipped_columns"])
+
+
+def _template_key(template_titles):
+    entry = _template_keys.get(id(template_titles))
+    # La table est gardée avec sa clé : son id ne peut pas être réattribué tant qu'elle est référencée ici
+    if entry is None or entry[0] is not template_titles:
+        if len(_template_keys) >= MAX_PLANS:
+            _template_keys.pop(next(iter(_template_keys)))
+        entry = (template_titles, json.dumps(sorted(template_titles.items()), ensure_ascii=False))
+        _template_keys[id(template_titles)] = entry
+    return entry[1]
+
+
+def header_signature(uploaded_header, template_titles, name_column):
+    """
+    Empreinte stable (entre workers) de l'en-tête brut de l'export, des titres du template
+    et de la colonne du nom. L'en-tête n'est normalisé qu'à la compilation du plan.
+    """
+    key = json.dumps([PLAN_VERSION, list(uploaded_header), _template_key(template_titles), name_column],
+                     ensure_ascii=False, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def compile_plan(signature, uploaded_header, template_titles, name_column):
+    # Même résultat que l'ancienne jointure : un titre répété dans l'export garde sa dernière colonne
+    uploaded_titles = {normalize_title(value): col for col, value in enumerate(uploaded_header, start=1) if value is not None}
+    copies = [
+        (uploaded_titles[title], template_titles[title])
+        for title in uploaded_titles
+        if title in template_titles
+    ]
+    copied = {src_col for src_col, _ in copies}
+    skipped_columns = [col for col in range(1, len(uploaded_header) + 1) if col not in copied]
+    return ColumnPlan(signature, copies, name_column, skipped_columns)
+
+
+def _plan_path(signature):
+    return os.path.join(settings.COLUMN_PLANS_DIR, f"{signature}.json")
+
+
+def _read_plan_file(signature):
+    path = _plan_path(signature)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            payload = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable column plan {path}: {e}")
+        return None
+    if payload.get("version") != PLAN_VERSION or payload.get("signature") != signature:
+        return None
+    try:
+        # Plan encore utilisé : sa date de modification le protège de l'élagage
+        os.utime(path)
+    except OSError:
+        pass
+    return ColumnPlan.from_dict(payload)
+
+
+def _prune_plan_files():
+    """Ne garde sur disque que les COLUMN_PLANS_MAX_FILES plans utilisés le plus récemment (date de modification)."""
+    try:
+        entries = [entry for entry in os.scandir(settings.COLUMN_PLANS_DIR)
+                   if entry.name.endswith('.json') and entry.is_file()]
+    except OSError as e:
+        logger.warning(f"Could not list column plans in {settings.COLUMN_PLANS_DIR}: {e}")
+        return
+    excess = len(entries) - settings.COLUMN_PLANS_MAX_FILES
+    if excess <= 0:
+        return
+    mtimes = {}
+    for entry in entries:
+        try:
+            mtimes[entry.path] = entry.stat().st_mtime_ns
+        except OSError:
+            pass  # Déjà supprimé par un autre worker
+    for path in sorted(mtimes, key=mtimes.get)[:excess]:
+        try:
+            os.remove(path)
+            plan_metrics["pruned"] += 1
+        except OSError:
+            pass
+
+
+def _write_plan_file(plan):
+    path = _plan_path(plan.signature)
+    try:
+        os.makedirs(settings.COLUMN_PLANS_DIR, exist_ok=True)
+        # Écriture atomique : un autre worker ne lit jamais un plan à moitié écrit
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(plan.to_dict(), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not persist column plan {path}: {e}")
+        return
+    _prune_plan_files()
+
+
+def get_plan(uploaded_header, template_titles, name_column):
+    """
+    Retourne le plan de recopie pour cet en-tête d'export et ce template.
+    Cherché en mémoire, puis sur disque (plans compilés par un autre worker), sinon compilé et sauvegardé.
+    """
+    signature = header_signature(uploaded_header, template_titles, name_column)
+    plan = _plans.get(signature)
+    if plan is not None:
+        plan_metrics["hits"] += 1
+        return plan
+
+    plan = _read_plan_file(signature)
+    if plan is not None:
+        plan_metrics["disk_hits"] += 1
+    else:
+        plan = compile_plan(signature, uploaded_header, template_titles, name_column)
+        plan_metrics["compiled"] += 1
+        logger.debug(f"Compiled column plan {signature[:12]}: {len(plan.copies)} columns copied, {len(plan.skipped_columns)} skipped")
+        _write_plan_file(plan)
+
+    if len(_plans) >= MAX_PLANS:
+        _plans.pop(next(iter(_plans)))
+    _plans[signature] = plan
+    return plan
+
+
+def plan_stats():
+    return {
+        "metrics": plan_metrics,
+        "plans": {
+            signature: {"copied": len(plan.copies), "skipped": len(plan.skipped_columns), "name_column": plan.name_column}
+            for signature, plan in _plans.items()
+        },
+    }
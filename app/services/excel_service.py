@@ -1,11 +1,24 @@
+import datetime
 import logging
+import re
 import unicodedata
+import numpy as np
 import pandas as pd
 from fastapi import HTTPException
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES, TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
 from app.core.config import settings
+from app.services.grade_engine import compute_class_grades
+from app.services.template_registry import get_registry
 from app.services.word_service import generate_word_document
 import os
 
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # Lecteur rapide facultatif : repli sur openpyxl
+    CalamineWorkbook = None
+
 # Configure logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -29,310 +42,193 @@ def normalize_name(name):
     name = name.strip()
     return name
 
-# Fonction pour traiter un fichier Excel
-def process_excel_file(file_path: str, output_dir: str) -> list:
+
+def _read_back(value):
+    """Conversion d'une valeur relue (OutputSheet.stored_rows) faite par pd.read_excel (moteur openpyxl)."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        # Un texte égal à un code d'erreur est enregistré comme une case en erreur
+        return np.nan if value in ERROR_CODES else value
+    if isinstance(value, float):
+        as_int = int(value)
+        return as_int if as_int == value else value
+    return value
+
+
+def _openpyxl_cell(cell):
+    # Mêmes conversions que le moteur openpyxl de pd.read_excel
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        as_int = int(cell.value)
+        return as_int if as_int == cell.value else float(cell.value)
+    return cell.value
+
+
+def read_rows_openpyxl(file_path):
+    workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
     try:
-        # Chargement des données depuis le fichier Excel
-        logger.debug("Chargement du fichier Excel.")
-        df_titles = pd.read_excel(file_path, header=None)
-        df_students = pd.read_excel(file_path, header=1)
-        
-        # Renommer les colonnes pour avoir des noms cohérents
-        df_students = df_students.rename(columns={
-            'DatedeNaissance': 'Date de Naissance',
-            'NomSite': 'Nom Site',
-            'CodeGroupe': 'Code Groupe',
-            'NomGroupe': 'Nom Groupe',
-            'EtenduGroupe': 'Étendu Groupe',
-            'ABSjustifiées': 'ABS justifiées',
-            'ABSinjustifiées': 'ABS injustifiées',
-        })
-        logger.debug(f"{len(df_students)} étudiants trouvés dans le fichier.")
-        
-        # Définir les configurations pour différents cas
-        cases = {
-            "M1_S1": {
-                "key": "M1_S1",
-                "titles_row": df_titles.iloc[0, 2:22].tolist(),
-                "template_word": settings.M1_S1_MAPI_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5, 7, 9, 10, 12, 13, 14, 15, 16, 17, 19, 20, 21],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3],
-                    'UE2': [4],
-                    'UE3': [5, 6],
-                    'UE4': [7, 11],
-                    'UE5': [13, 14, 15]
-                },
-                "hidden_ects": [8, 9, 10, 12]
-            },
-            "M1_S2": {
-                "key": "M1_S2",
-                "titles_row": df_titles.iloc[0, 2:22].tolist(),
-                "template_word": settings.M1_S2_MAPI_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5, 7, 8, 10, 11, 12, 13, 14, 15, 16, 18, 19, 20, 21],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3],
-                    'UE2': [4, 5],
-                    'UE3': [6, 7, 8, 12],
-                    'UE4': [13, 14, 15, 16],
-                },
-                "hidden_ects": [9, 10, 11]
-            },
-            "M2_S3_MAGI": {
-                "key": "M2_S3_MAGI",
-                "titles_row": df_titles.iloc[0, 2:19].tolist(),
-                "template_word": settings.M2_S3_MAGI_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 6, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18],
-                "ects_sum_indices": {
-                    'UE1': [1, 2],
-                    'UE2': [3],
-                    'UE3': [4, 5, 6, 7, 8, 9],
-                    'UE4': [10, 11, 12, 13],
-                },
-                "hidden_ects": [4, 8, 9]
-            },
-            "M2_S3_MEFIM": {
-                "key": "M2_S3_MEFIM",
-                "titles_row": df_titles.iloc[0, 2:19].tolist(),
-                "template_word": settings.M2_S3_MAGI_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 6, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18],
-                "ects_sum_indices": {
-                    'UE1': [1, 2],
-                    'UE2': [3],
-                    'UE3': [4, 5, 6, 7, 8, 9],
-                    'UE4': [10, 11, 12, 13],
-                },
-                "hidden_ects": [4, 8, 9]
-            },
-            "M2_S3_MAPI": {
-                "key": "M2_S3_MAPI",
-                "titles_row": df_titles.iloc[0, 2:20].tolist(),
-                "template_word": settings.M2_S3_MAPI_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 6, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18, 19],
-                "ects_sum_indices": {
-                    'UE1': [1, 2],
-                    'UE2': [3],
-                    'UE3': [4, 5, 6, 7, 8, 9],
-                    'UE4': [10, 11, 12, 13, 14],
-                },
-                "hidden_ects": [4, 8, 9]
-            },
-            "M2_S4": {
-                "key": "M2_S4",
-                "titles_row": df_titles.iloc[0, 2:17].tolist(),
-                "template_word": settings.M2_S4_MAPI_TEMPLATE_WORD,
-                "grade_column_indices": [3, 5, 6, 8, 9, 10, 11, 12, 14, 15, 16],
-                "ects_sum_indices": {
-                    'UE1': [1],
-                    'UE2': [2, 3],
-                    'UE3': [4, 5, 8],
-                    'UE4': [9, 10, 11],
-                },
-                "hidden_ects": [6, 7]
-            },
-            "BG_ALT_1":{
-                "key": "BG_ALT_1",
-                "titles_row": df_titles.iloc[0, 2:20].tolist(),
-                "template_word": settings.BG_ALT_1_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5, 7, 8, 10, 12, 14, 15, 16, 17, 18, 19],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3],
-                    'UE2': [4, 5],
-                    'UE3': [6],
-                    'UE4': [7, 8, 9, 10, 11, 12, 13, 14],
-                },
-                "hidden_ects": [9, 10, 11, 14]
-            },
-            "BG_ALT_2":{
-                "key": "BG_ALT_2",
-                "titles_row": df_titles.iloc[0, 2:21].tolist(),
-                "template_word": settings.BG_ALT_2_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5, 6, 8, 9, 10, 12, 14, 15, 16, 17, 18, 19, 20],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3, 4],
-                    'UE2': [5, 6, 7],
-                    'UE3': [8],
-                    'UE4': [9, 10, 11, 12, 13, 14, 15],
-                },
-                "hidden_ects": [11, 12, 13, 14, 15]
-            },
-            "BG_ALT_3":{
-                "key": "BG_ALT_3",
-                "titles_row": df_titles.iloc[0, 2:19].tolist(),
-                "template_word": settings.BG_ALT_3_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5, 6, 7, 9, 10, 12, 14, 15, 16, 17, 18],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3, 4, 5],
-                    'UE2': [6, 7],
-                    'UE3': [8],
-                    'UE4': [9, 10, 11, 12, 13],
-                },
-                "hidden_ects": [4, 11, 12, 13]
-            },
-            "BG_ALT_4":{
-                "key": "BG_ALT_4",
-                "titles_row": df_titles.iloc[0, 2:18].tolist(),
-                "template_word": settings.BG_ALT_4_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5, 7, 8, 9, 11, 13, 14, 15, 16, 17],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3],
-                    'UE2': [4, 5, 6, 7],
-                    'UE3': [8],
-                    'UE4': [9, 10, 11, 12, 13],
-                },
-                "hidden_ects": [11, 12, 13]
-            },
-            "BG_ALT_5":{
-                "key": "BG_ALT_5",
-                "titles_row": df_titles.iloc[0, 2:20].tolist(),
-                "template_word": settings.BG_ALT_5_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5, 7, 8, 9, 11, 13, 14, 15, 16, 17, 18, 19],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3],
-                    'UE2': [4, 5, 6],
-                    'UE3': [7],
-                    'UE4': [8, 9, 10, 11, 12, 13, 14],
-                },
-                "hidden_ects": [10, 11, 12, 14]
-            },
-            "BG_ALT_6":{
-                "key": "BG_ALT_6",
-                "titles_row": df_titles.iloc[0, 2:18].tolist(),
-                "template_word": settings.BG_ALT_6_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 6, 7, 9, 10, 12, 13, 14, 15, 16, 17],
-                "ects_sum_indices": {
-                    'UE1': [1, 2],
-                    'UE2': [3, 4],
-                    'UE3': [5, 6],
-                    'UE4': [7, 8, 9, 10, 11, 12],
-                },
-                "hidden_ects": [9, 12]
-            },
-            "BG_TP_1":{
-                "key": "BG_TP_1",
-                "titles_row": df_titles.iloc[0, 2:28].tolist(),
-                "template_word": settings.BG_TP_1_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5, 6, 7, 8, 9, 11, 12, 13, 14, 15, 17, 18, 20, 21, 22, 23, 24, 25, 26, 27],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3, 4, 5, 6, 7],
-                    'UE2': [8, 9, 10, 11, 12],
-                    'UE3': [13, 14],
-                    'UE4': [15, 16, 17, 18, 19, 20, 21, 22],
-                },
-                "hidden_ects": [16, 17, 18, 20, 21, 22]
-            },
-            "BG_TP_2":{
-                "key": "BG_TP_2",
-                "titles_row": df_titles.iloc[0, 2:5].tolist(),
-                "template_word": settings.BG_TP_2_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4],
-                "ects_sum_indices": {
-                    'UE1': [1, 2],
-                },
-                "hidden_ects": []
-            },
-            "BG_TP_3":{
-                "key": "BG_TP_3",
-                "titles_row": df_titles.iloc[0, 2:21].tolist(),
-                "template_word": settings.BG_TP_3_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18, 19, 20],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3, 4],
-                    'UE2': [5, 6, 7, 8, 9],
-                    'UE3': [10, 11],
-                    'UE4': [12, 13, 14, 15],
-                },
-                "hidden_ects": [13, 14, 15]
-            },
-            "BG_TP_4":{
-                "key": "BG_TP_4",
-                "titles_row": df_titles.iloc[0, 2:4].tolist(),
-                "template_word": settings.BG_TP_4_TEMPLATE_WORD,
-                "grade_column_indices": [3],
-                "ects_sum_indices": {
-                    'UE1': [1],
-                },
-                "hidden_ects": []
-            },
-            "BG_TP_5":{
-                "key": "BG_TP_5",
-                "titles_row": df_titles.iloc[0, 2:25].tolist(),
-                "template_word": settings.BG_TP_5_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5, 6, 7, 9, 11, 12, 13, 15, 17, 19, 20, 21, 22, 23, 24],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3, 4, 5],
-                    'UE2': [6, 7, 8, 9, 10],
-                    'UE3': [11, 12, 13],
-                    'UE4': [14, 15, 16, 17, 18, 19],
-                },
-                "hidden_ects": [15, 16, 18]
-            },
-            "BG_TP_6":{
-                "key": "BG_TP_6",
-                "titles_row": df_titles.iloc[0, 2:6].tolist(),
-                "template_word": settings.BG_TP_6_TEMPLATE_WORD,
-                "grade_column_indices": [3, 4, 5],
-                "ects_sum_indices": {
-                    'UE1': [1, 2, 3],
-                },
-                "hidden_ects": []
-            },
-            
-        }
-        
-        # Vérifier l'existence du fichier téléchargé
+        # Première feuille, comme pd.read_excel
+        worksheet = workbook.worksheets[0]
+        worksheet.reset_dimensions()
+        return [[_openpyxl_cell(cell) for cell in row] for row in worksheet.rows]
+    finally:
+        workbook.close()
+
+
+def _calamine_cell(value):
+    # Mêmes conversions que le moteur calamine de pd.read_excel
+    if isinstance(value, float):
+        as_int = int(value)
+        return as_int if as_int == value else value
+    if isinstance(value, datetime.date):
+        return pd.Timestamp(value)
+    if isinstance(value, datetime.timedelta):
+        return pd.Timedelta(value)
+    return value
+
+
+def read_rows_calamine(file_path):
+    workbook = CalamineWorkbook.from_path(file_path)
+    try:
+        rows = workbook.get_sheet_by_index(0).to_python(skip_empty_area=False)
+    finally:
+        workbook.close()
+    return [[_calamine_cell(value) for value in row] for row in rows]
+
+
+# Lecteurs de classeurs disponibles (EXCEL_READER_BACKEND) : valeurs de la première feuille, ligne par ligne
+EXCEL_READERS = {
+    "openpyxl": read_rows_openpyxl,
+    "calamine": read_rows_calamine,
+}
+
+
+def read_class_rows(file_path, backend=None):
+    backend = backend or settings.EXCEL_READER_BACKEND
+    if backend not in EXCEL_READERS:
+        raise ValueError(f"Unknown Excel reader backend: {backend}")
+    if backend == "calamine" and CalamineWorkbook is None:
+        logger.warning("python-calamine is not installed, reading the class workbook with openpyxl")
+        backend = "openpyxl"
+    return EXCEL_READERS[backend](file_path)
+
+
+# Colonnes d'identité lues par la génération des bulletins (en-têtes bruts et renommés)
+STUDENT_COLUMN_RENAMES = {
+    'DatedeNaissance': 'Date de Naissance',
+    'NomSite': 'Nom Site',
+    'CodeGroupe': 'Code Groupe',
+    'NomGroupe': 'Nom Groupe',
+    'EtenduGroupe': 'Étendu Groupe',
+    'ABSjustifiées': 'ABS justifiées',
+    'ABSinjustifiées': 'ABS injustifiées',
+}
+STUDENT_FIELDS = frozenset(['CodeApprenant', 'Nom', 'Retards', 'Appreciations', *STUDENT_COLUMN_RENAMES, *STUDENT_COLUMN_RENAMES.values()])
+
+
+class ClassTable:
+    """
+    Tableau d'une classe lu une seule fois : valeurs de la feuille converties comme le fait
+    pd.read_excel (lignes vides finales retirées, lignes complétées à la même largeur) et nom
+    du template (qui détermine le cas). Construit depuis la feuille fusionnée en mémoire,
+    ou depuis un fichier avec le lecteur choisi.
+    """
+
+    def __init__(self, source_name, rows):
+        self.source_name = source_name
+        data = []
+        last_row_with_data = -1
+        for row_number, converted_row in enumerate(rows):
+            converted_row = list(converted_row)
+            while converted_row and converted_row[-1] == "":
+                converted_row.pop()
+            if converted_row:
+                last_row_with_data = row_number
+            data.append(converted_row)
+        data = data[:last_row_with_data + 1]
+        self.width = max((len(row) for row in data), default=0)
+        self.data = [row + [""] * (self.width - len(row)) for row in data]
+
+    @classmethod
+    def from_file(cls, file_path, backend=None):
         if not os.path.exists(file_path):
             raise HTTPException(status_code=400, detail="File not found")
+        return cls(os.path.basename(file_path), read_class_rows(file_path, backend))
+
+    @classmethod
+    def from_output_sheet(cls, output_sheet, source_name):
+        """Même tableau que celui lu dans le classeur enregistré par output_sheet.save(), sans passer par le disque."""
+        return cls(source_name, ([_read_back(value) for value in row] for row in output_sheet.stored_rows()))
 
-        # Obtenir le nom du fichier à partir du chemin du fichier
-        filename = os.path.basename(file_path)
-
-        # Déterminer la clé du cas en fonction de la comparaison des noms de fichiers
-        if filename in [os.path.basename(settings.M1_S1_MAPI_TEMPLATE), os.path.basename(settings.M1_S1_MAGI_TEMPLATE), os.path.basename(settings.M1_S1_MEFIM_TEMPLATE), os.path.basename(settings.M1_S1_MAPI_TEMPLATE_NOT_EMPTY), os.path.basename(settings.M1_S1_MAGI_TEMPLATE_NOT_EMPTY), os.path.basename(settings.M1_S1_MEFIM_TEMPLATE_NOT_EMPTY)]:
-            case_key = "M1_S1"
-        elif filename in [os.path.basename(settings.M1_S2_MAPI_TEMPLATE), os.path.basename(settings.M1_S2_MAGI_TEMPLATE), os.path.basename(settings.M1_S2_MEFIM_TEMPLATE), os.path.basename(settings.M1_S2_MAPI_TEMPLATE_NOT_EMPTY), os.path.basename(settings.M1_S2_MAGI_TEMPLATE_NOT_EMPTY), os.path.basename(settings.M1_S2_MEFIM_TEMPLATE_NOT_EMPTY)]:
-            case_key = "M1_S2"
-        elif filename in [os.path.basename(settings.M2_S3_MAGI_TEMPLATE), os.path.basename(settings.M1_S2_MAGI_TEMPLATE_NOT_EMPTY)]:
-            case_key = "M2_S3_MAGI"
-        elif filename in [os.path.basename(settings.M2_S3_MAPI_TEMPLATE), os.path.basename(settings.M1_S2_MAPI_TEMPLATE_NOT_EMPTY)]:
-            case_key = "M2_S3_MAPI"
-        elif filename in [os.path.basename(settings.M2_S3_MEFIM_TEMPLATE), os.path.basename(settings.M1_S2_MEFIM_TEMPLATE_NOT_EMPTY)]:
-            case_key = "M2_S3_MEFIM"
-        elif filename in [os.path.basename(settings.M2_S4_MAPI_TEMPLATE), os.path.basename(settings.M2_S4_MAGI_TEMPLATE), os.path.basename(settings.M2_S4_MEFIM_TEMPLATE), os.path.basename(settings.M2_S4_MAPI_TEMPLATE_NOT_EMPTY), os.path.basename(settings.M2_S4_MAGI_TEMPLATE_NOT_EMPTY), os.path.basename(settings.M2_S4_MEFIM_TEMPLATE_NOT_EMPTY)]:
-            case_key = "M2_S4"
-        elif filename in [os.path.basename(settings.BG_ALT_1_TEMPLATE), os.path.basename(settings.BG_ALT_1_TEMPLATE), os.path.basename(settings.BG_ALT_1_TEMPLATE), os.path.basename(settings.BG_ALT_1_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_1_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_1_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_ALT_1"
-        elif filename in [os.path.basename(settings.BG_ALT_2_TEMPLATE), os.path.basename(settings.BG_ALT_2_TEMPLATE), os.path.basename(settings.BG_ALT_2_TEMPLATE), os.path.basename(settings.BG_ALT_2_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_2_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_2_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_ALT_2"
-        elif filename in [os.path.basename(settings.BG_ALT_3_TEMPLATE), os.path.basename(settings.BG_ALT_3_TEMPLATE), os.path.basename(settings.BG_ALT_3_TEMPLATE), os.path.basename(settings.BG_ALT_3_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_3_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_3_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_ALT_3"
-        elif filename in [os.path.basename(settings.BG_ALT_4_TEMPLATE), os.path.basename(settings.BG_ALT_4_TEMPLATE), os.path.basename(settings.BG_ALT_4_TEMPLATE), os.path.basename(settings.BG_ALT_4_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_4_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_4_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_ALT_4"
-        elif filename in [os.path.basename(settings.BG_ALT_5_TEMPLATE), os.path.basename(settings.BG_ALT_5_TEMPLATE), os.path.basename(settings.BG_ALT_5_TEMPLATE), os.path.basename(settings.BG_ALT_5_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_5_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_5_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_ALT_5"
-        elif filename in [os.path.basename(settings.BG_ALT_6_TEMPLATE), os.path.basename(settings.BG_ALT_6_TEMPLATE), os.path.basename(settings.BG_ALT_6_TEMPLATE), os.path.basename(settings.BG_ALT_6_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_6_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_ALT_6_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_ALT_6"
-        elif filename in [os.path.basename(settings.BG_TP_1_TEMPLATE), os.path.basename(settings.BG_TP_1_TEMPLATE), os.path.basename(settings.BG_TP_1_TEMPLATE), os.path.basename(settings.BG_TP_1_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_1_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_1_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_TP_1"
-        elif filename in [os.path.basename(settings.BG_TP_2_TEMPLATE), os.path.basename(settings.BG_TP_2_TEMPLATE), os.path.basename(settings.BG_TP_2_TEMPLATE), os.path.basename(settings.BG_TP_2_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_2_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_2_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_TP_2"
-        elif filename in [os.path.basename(settings.BG_TP_3_TEMPLATE), os.path.basename(settings.BG_TP_3_TEMPLATE), os.path.basename(settings.BG_TP_3_TEMPLATE), os.path.basename(settings.BG_TP_3_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_3_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_3_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_TP_3"
-        elif filename in [os.path.basename(settings.BG_TP_4_TEMPLATE), os.path.basename(settings.BG_TP_4_TEMPLATE), os.path.basename(settings.BG_TP_4_TEMPLATE), os.path.basename(settings.BG_TP_4_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_4_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_4_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_TP_4"
-        elif filename in [os.path.basename(settings.BG_TP_5_TEMPLATE), os.path.basename(settings.BG_TP_5_TEMPLATE), os.path.basename(settings.BG_TP_5_TEMPLATE), os.path.basename(settings.BG_TP_5_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_5_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_5_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_TP_5"
-        elif filename in [os.path.basename(settings.BG_TP_6_TEMPLATE), os.path.basename(settings.BG_TP_6_TEMPLATE), os.path.basename(settings.BG_TP_6_TEMPLATE), os.path.basename(settings.BG_TP_6_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_6_TEMPLATE_NOT_EMPTY), os.path.basename(settings.BG_TP_6_TEMPLATE_NOT_EMPTY)]:
-            case_key = "BG_TP_6"
+    @property
+    def titles_row(self):
+        """Première ligne (titres des matières), une case vide valant NaN."""
+        return [np.nan if value == "" else value for value in self.data[0]] if self.data else []
+
+    def students(self, fields=None, grade_columns=()):
+        """
+        Lignes apprenants (en-tête en ligne 2), toutes en texte : aucune inférence de type.
+        Si fields est donné, seules les colonnes de ces en-têtes et les positions grade_columns
+        sont chargées ; retourne le DataFrame et les positions des notes dans ce DataFrame.
+        """
+        grade_columns = list(grade_columns)
+        positions = None
+        if fields is not None and all(0 <= col < self.width for col in grade_columns):
+            header = self._parse(self.data[1:2], nrows=0).columns if len(self.data) > 1 else []
+            positions = sorted({col for col, name in enumerate(header) if name in fields} | set(grade_columns))
+            grade_columns = [positions.index(col) for col in grade_columns]
+        frame = self._parse(self.data[1:], usecols=positions, dtype=str)
+        return frame, grade_columns
+
+    @staticmethod
+    def _parse(rows, **kwargs):
+        # Analyseur de pd.read_excel ; il reçoit des copies, car il peut modifier les lignes
+        try:
+            return TextParser([list(row) for row in rows], header=0, skip_blank_lines=False, **kwargs).read()
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame()
+
+
+# Fonction pour traiter un fichier Excel
+def process_excel_file(source, output_dir: str, on_progress=None) -> list:
+    """
+    Génère les bulletins d'une classe. source est un ClassTable (passé en mémoire par la fusion)
+    ou le chemin du classeur fusionné ; on_progress(done, total) suit les lignes apprenants.
+    """
+    try:
+        # Chargement des données : en mémoire si la fusion les fournit, sinon depuis le fichier Excel
+        logger.debug("Chargement du tableau de la classe.")
+        class_table = source if isinstance(source, ClassTable) else ClassTable.from_file(source)
+        titles_row = class_table.titles_row
         
-        else:
+        # Mise en page du bulletin, d'après le template dont provient le tableau
+        layout = get_registry().layout_for_file(class_table.source_name)
+        if layout is None:
             raise HTTPException(status_code=400, detail="Unknown Excel template")
+        case_config = layout.case_config(titles_row)
 
-        case_config = cases[case_key]
+        # Seules les colonnes utiles au cas sont chargées (identité, notes, absences, appréciation),
+        # en texte ; les positions des notes sont celles du DataFrame réduit
+        df_students, grade_column_indices = class_table.students(STUDENT_FIELDS, case_config["grade_column_indices"])
+        case_config = {**case_config, "grade_column_indices": grade_column_indices}
+
+        # Renommer les colonnes pour avoir des noms cohérents
+        df_students = df_students.rename(columns=STUDENT_COLUMN_RENAMES)
+        logger.debug(f"{len(df_students)} étudiants trouvés dans le fichier.")
+
+        # Notes, états et ECTS de toute la classe en un calcul sur tableaux (None : calcul par apprenant)
+        class_grades = compute_class_grades(df_students, case_config)
 
         # Liste pour stocker les chemins des bulletins générés
         bulletin_paths = []
-        for index, student_data in df_students.iterrows():
+        total_students = len(df_students)
+        for done, (index, student_data) in enumerate(df_students.iterrows()):
+            if on_progress is not None and done:
+                on_progress(done, total_students)
             # S'assurer que tous les champs sont des chaînes pour éviter les problèmes avec normalize_string
             student_data = student_data.fillna('').astype(str)
             
@@ -354,10 +250,13 @@ def process_excel_file(file_path: str, output_dir: str) -> list:
             logging.debug(f"Index in student_data: {student_data.index}")
 
             # Générer le document Word pour l'étudiant
-            bulletin_path = generate_word_document(student_data, case_config, case_config["template_word"], output_dir)
+            grades = class_grades[done] if class_grades is not None else None
+            bulletin_path = generate_word_document(student_data, case_config, case_config["template_word"], output_dir, grades)
             bulletin_paths.append(bulletin_path)
             logger.debug(f"Bulletin généré pour {student_data.get('Nom', 'N/A')}: {bulletin_path}")
 
+        if on_progress is not None:
+            on_progress(total_students, total_students)
         return bulletin_paths
     except Exception as e:
         # Log en cas d'erreur lors du traitement du fichier Excel
@@ -383,21 +282,58 @@ def extract_appreciations_from_word(word_file_path):
                 appreciations[normalized_name] = appreciation.strip()
     return appreciations
 
-def update_excel_with_appreciations(template_wb, appreciations, columns_config):
-    template_ws = template_wb.active
+def appreciation_fallback_key(name):
+    """Clé de repli : sans accents, casse ni ponctuation, mots triés ("NOM Prénom" == "Prénom  NOM")."""
+    return ' '.join(sorted(re.findall(r'\w+', normalize_name(str(name)))))
+
+
+def index_appreciations(appreciations, fallback=True):
+    """
+    Indexe les appréciations une seule fois : nom normalisé -> appréciation et, si demandé,
+    clé de repli -> appréciation. Une clé de repli partagée par plusieurs noms distincts
+    est ambiguë et vaut None (aucune appréciation n'est devinée).
+    """
+    exact, loose = {}, {}
+    for key, appreciation in appreciations.items():
+        normalized_key = normalize_name(key)
+        # À nom normalisé égal, la première appréciation l'emporte, comme avec l'ancien parcours
+        if normalized_key in exact:
+            continue
+        exact[normalized_key] = appreciation
+        if fallback:
+            fallback_key = appreciation_fallback_key(key)
+            loose[fallback_key] = None if fallback_key in loose else appreciation
+    return exact, loose
+
+
+def update_excel_with_appreciations(output_sheet, appreciations, columns_config, fallback=True):
+    """
+    Renseigne la colonne d'appréciation de chaque apprenant par une recherche dans l'index
+    (nom exact normalisé, puis clé de repli si fallback). Retourne (feuille, non trouvés)
+    où non trouvés est une liste de {'row', 'name', 'reason'} ('not_found' ou 'ambiguous').
+    """
     appreciation_column_index = columns_config.get('appreciation_column_index_template', 31)  # Colonne par défaut AE
+    exact, loose = index_appreciations(appreciations, fallback)
+    unmatched = []
 
-    for row in range(2, template_ws.max_row + 1):
-        student_name = template_ws.cell(row=row, column=columns_config['name_column_index_template']).value
-        if student_name:
-            normalized_student_name = normalize_name(student_name)
-            
-            # Rechercher l'appréciation normalisée dans le dictionnaire
-            for key, appreciation in appreciations.items():
-                if normalize_name(key) == normalized_student_name:
-                    template_ws.cell(row=row, column=appreciation_column_index).value = appreciation
-                    break
-            else:
-                print(f"Appreciation non trouvée pour: {student_name}")
-
-    return template_wb
\ No newline at end of file
+    for row in range(2, output_sheet.max_row + 1):
+        student_name = output_sheet.value(row, columns_config['name_column_index_template'])
+        if not student_name:
+            continue
+
+        appreciation = exact.get(normalize_name(student_name))
+        reason = 'not_found'
+        if appreciation is None and fallback:
+            fallback_key = appreciation_fallback_key(student_name)
+            appreciation = loose.get(fallback_key)
+            if appreciation is None and fallback_key in loose:
+                reason = 'ambiguous'
+
+        if appreciation is None:
+            unmatched.append({'row': row, 'name': student_name, 'reason': reason})
+            continue
+        output_sheet.set(row, appreciation_column_index, appreciation)
+
+    if unmatched:
+        logger.warning(f"No appreciation found for {len(unmatched)} students: {[entry['name'] for entry in unmatched]}")
+    return output_sheet, unmatched
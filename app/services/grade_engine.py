@@ -0,0 +1,312 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from app.services.word_service import ects_data_for, extract_grades_and_coefficients
+
+# Configure the logger
+logger = logging.getLogger(__name__)
+
+# Règles de calcul d'un groupe de matières (fonctions de word_service qu'elles reproduisent)
+UE_NOTES = "ue_notes"  # process_ue_notes
+UE4 = "ue4"  # process_ue4
+EVALUATE_UE = "evaluate_ue"  # process_and_evaluate_ue
+UE4_EVALUATE_UE = "ue4_evaluate_ue"  # process_UE4_and_evaluate_ue
+
+# Groupes de matières de chaque mise en page, dans l'ordre de compute_student_grades :
+# (règle, UE, numéros des matières). Le premier groupe est ensuite réévalué sur les notes arrondies.
+UE_PLANS = {
+    "M1_S1": ((UE_NOTES, "UE1", (1, 2, 3)), (UE_NOTES, "UE2", (4,)), (UE_NOTES, "UE3", (5, 6)),
+              (UE4, "UE4", (7, 8, 9, 10, 11, 12)), (UE_NOTES, "UESPE", (13, 14, 15))),
+    "M1_S2": ((UE_NOTES, "UE1", (1, 2, 3)), (UE_NOTES, "UE2", (4, 5)), (UE_NOTES, "UE3", (6, 7, 8, 9, 10, 11, 12)),
+              (UE_NOTES, "UESPE", (13, 14, 15, 16))),
+    "M2_S3_MAGI": ((UE_NOTES, "UE1", (1, 2, 3)), (UE_NOTES, "UE2", (4,)), (UE_NOTES, "UE3", (5, 6, 7, 8, 9)),
+                   (UE_NOTES, "UESPE", (10, 11, 12, 13))),
+    "M2_S3_MEFIM": ((UE_NOTES, "UE1", (1, 2, 3)), (UE_NOTES, "UE2", (4,)), (UE_NOTES, "UE3", (5, 6, 7, 8, 9)),
+                    (UE_NOTES, "UESPE", (10, 11, 12, 13))),
+    "M2_S3_MAPI": ((UE_NOTES, "UE1", (1, 2, 3)), (UE_NOTES, "UE2", (4,)), (UE_NOTES, "UE3", (5, 6, 7, 8, 9)),
+                   (UE_NOTES, "UESPE", (10, 11, 12, 13, 14))),
+    "M2_S4": ((UE_NOTES, "UE1", (1,)), (UE_NOTES, "UE2", (2, 3)), (UE_NOTES, "UE3", (4, 5, 6, 7, 8)),
+              (UE_NOTES, "UESPE", (9, 10, 11))),
+    "BG_ALT_1": ((EVALUATE_UE, "UE1", (1, 2, 3)), (EVALUATE_UE, "UE2", (4, 5)), (EVALUATE_UE, "UE3", (6,)),
+                 (UE4_EVALUATE_UE, "UE4", (7, 8, 9, 10, 11, 12, 13, 14))),
+    "BG_ALT_2": ((EVALUATE_UE, "UE1", (1, 2, 3, 4)), (EVALUATE_UE, "UE2", (5, 6, 7)), (EVALUATE_UE, "UE3", (8,)),
+                 (UE4_EVALUATE_UE, "UE4", (9, 10, 11, 12, 13, 14, 15))),
+    "BG_ALT_3": ((EVALUATE_UE, "UE1", (1, 2, 3, 4, 5)), (EVALUATE_UE, "UE2", (6, 7, 8)), (EVALUATE_UE, "UE3", (9,)),
+                 (UE4_EVALUATE_UE, "UE4", (10, 11, 12, 13))),
+    "BG_ALT_4": ((EVALUATE_UE, "UE1", (1, 2, 3)), (EVALUATE_UE, "UE2", (4, 5, 6)),
+                 (EVALUATE_UE, "UE3", (7, 8, 9, 10, 11, 12))),
+    "BG_ALT_5": ((EVALUATE_UE, "UE1", (1, 2, 3)), (EVALUATE_UE, "UE2", (4, 5, 6)), (EVALUATE_UE, "UE3", (7, 8)),
+                 (UE4_EVALUATE_UE, "UE4", (9, 10, 11, 12, 13, 14))),
+    "BG_ALT_6": ((EVALUATE_UE, "UE1", (1, 2, 3)), (EVALUATE_UE, "UE2", (4, 5)), (EVALUATE_UE, "UE3", (6,)),
+                 (UE4_EVALUATE_UE, "UE4", (7, 8, 9, 10, 11, 12))),
+    "BG_TP_1": ((EVALUATE_UE, "UE1", (1, 2, 3, 4, 5, 6, 7)), (EVALUATE_UE, "UE2", (8, 9, 10, 11, 12)),
+                (EVALUATE_UE, "UE3", (13, 14)), (UE4_EVALUATE_UE, "UE4", (15, 16, 17, 18, 19, 20, 21, 22))),
+    "BG_TP_2": ((EVALUATE_UE, "UE1", (1, 2, 3)),),
+    "BG_TP_3": ((EVALUATE_UE, "UE1", (1, 2, 3, 4, 5)), (EVALUATE_UE, "UE2", (6, 7, 8, 9, 10)),
+                (EVALUATE_UE, "UE3", (11, 12, 13)), (UE4_EVALUATE_UE, "UE4", (14, 15))),
+    "BG_TP_4": ((EVALUATE_UE, "UE1", (1,)),),
+    "BG_TP_5": ((EVALUATE_UE, "UE1", (1, 2, 3, 4, 5)), (EVALUATE_UE, "UE2", (6, 7, 8, 9, 10)),
+                (EVALUATE_UE, "UE3", (11, 12, 13)), (UE4_EVALUATE_UE, "UE4", (14, 15, 16, 17, 18, 19))),
+    "BG_TP_6": ((EVALUATE_UE, "UE1", (1, 2, 3)),),
+}
+
+# Nature d'une case de note
+EMPTY, SPECIAL, NUMERIC, UNREADABLE = range(4)
+
+engine_metrics = {"classes": 0, "students": 0, "distinct_cells": 0, "fallbacks": 0}
+
+
+def grade_engine_stats():
+    return dict(engine_metrics)
+
+
+def _packed(values, mask):
+    # Valeurs retenues ramenées en tête de ligne, dans leur ordre (les listes de l'ancien calcul)
+    order = np.argsort(~mask, axis=1, kind="stable")
+    return np.take_along_axis(np.broadcast_to(values, mask.shape), order, axis=1)
+
+
+def _weighted_average(notes, weights, notes_mask, weights_mask):
+    """
+    calculate_weighted_average sur chaque ligne : la k-ième note retenue va avec le k-ième poids retenu
+    (les poids sont un sous-ensemble des notes), les poids nuls sont écartés et les sommes
+    se font dans le même ordre, d'où des résultats identiques au bit près.
+    """
+    notes = _packed(notes, notes_mask)
+    weights = _packed(weights, weights_mask)
+    paired = (np.arange(notes.shape[1]) < weights_mask.sum(axis=1)[:, None]) & (weights != 0)
+    total_grade = np.zeros(len(notes))
+    total_weight = np.zeros(len(notes))
+    for k in range(notes.shape[1]):
+        total_grade += np.where(paired[:, k], notes[:, k] * weights[:, k], 0.0)
+        total_weight += np.where(paired[:, k], weights[:, k], 0.0)
+    return np.divide(total_grade, total_weight, out=np.zeros(len(notes)), where=total_weight != 0)
+
+
+def _format(values):
+    return np.array([f"{value:.2f}" for value in values.tolist()], dtype=object)
+
+
+def _rounded_up(values):
+    # math.ceil(x * 100) / 100
+    return np.ceil(values * 100) / 100
+
+
+def _component_states(notes, valid, strict):
+    # R sous 8 ; entre 8 et 10 : C, ou R si l'UE compte une autre note sous 10 (strict)
+    between = valid & (notes >= 8) & (notes < 10)
+    return np.where(valid & (notes < 8), "R", np.where(between, np.where(strict[:, None], "R", "C"), "")).astype(object)
+
+
+class ClassGrades:
+    """
+    Notes d'une classe, chaque texte de case distinct analysé une seule fois : ses composantes
+    (note, coefficient) sont rangées en matrices (textes distincts × composantes), puis leurs
+    moyennes ramenées en matrices (apprenants × matières), avec la nature de chaque case.
+    """
+
+    def __init__(self, cells):
+        codes, texts = pd.factorize(cells.ravel())
+        kinds = np.full(len(texts), EMPTY, dtype=np.int8)
+        labels = np.full(len(texts), "", dtype=object)
+        components = [()] * len(texts)
+        for code, text in enumerate(texts):
+            text = text.strip()
+            if not text or text == 'Note':
+                continue
+            grades_coefficients, special_case = extract_grades_and_coefficients(text)
+            if special_case:
+                kinds[code], labels[code] = SPECIAL, special_case
+            elif grades_coefficients:
+                kinds[code], components[code] = NUMERIC, grades_coefficients
+            else:
+                kinds[code] = UNREADABLE
+
+        width = max(1, max((len(pairs) for pairs in components), default=0))
+        grades = np.zeros((len(texts), width))
+        coefficients = np.zeros((len(texts), width))
+        for code, pairs in enumerate(components):
+            for k, (grade, coefficient) in enumerate(pairs):
+                grades[code, k], coefficients[code, k] = grade, coefficient
+        present = np.arange(width) < np.array([len(pairs) for pairs in components])[:, None]
+        self.finite = bool(np.isfinite(grades).all() and np.isfinite(coefficients).all())
+        averages = _weighted_average(grades, coefficients, present, present)
+        notes = _format(averages)
+
+        shape = cells.shape
+        self.distinct = len(texts)
+        self.kinds = kinds[codes].reshape(shape)
+        self.labels = labels[codes].reshape(shape)
+        self.averages = averages[codes].reshape(shape)
+        self.notes = notes[codes].reshape(shape)
+        # Note affichée relue : les règles de l'UE1 et les sommes d'UE repartent de l'arrondi au centième
+        self.rounded = notes.astype(float)[codes].reshape(shape)
+
+
+def _plan_is_computable(plan, ects_sum_indices, subjects):
+    # Configurations où le calcul par apprenant échoue (IndexError, KeyError) : il est laissé tel quel
+    numbers = [number for _, _, numbers in plan for number in numbers]
+    if len(numbers) != len(set(numbers)):
+        return False
+    if any(number > subjects for rule, _, numbers in plan if rule != UE4_EVALUATE_UE for number in numbers):
+        return False
+    filled = {number for rule, _, numbers in plan if rule == UE4_EVALUATE_UE for number in numbers}
+    return all(index <= subjects or index in filled for indices in ects_sum_indices.values() for index in indices)
+
+
+def compute_class_grades(students, case_config, ects_data=None):
+    """
+    Notes, états et ECTS de tous les apprenants d'une classe, calculés sur des tableaux :
+    mêmes placeholders que compute_student_grades suivi du retrait des ECTS masqués, un dict par ligne
+    de students. Retourne None si la mise en page n'est pas prise en charge ou que le calcul par
+    apprenant échouerait : generate_word_document refait alors le calcul de référence.
+    """
+    key = case_config["key"]
+    plan = UE_PLANS.get(key)
+    grade_column_indices = case_config["grade_column_indices"]
+    subjects = len(grade_column_indices)
+    hidden = set(case_config["hidden_ects"])
+    ects_sum_indices = case_config["ects_sum_indices"]
+    if ects_data is None:
+        ects_data = ects_data_for(case_config)
+    if plan is None or not _plan_is_computable(plan, ects_sum_indices, subjects):
+        return _fallback(key, "layout")
+    try:
+        # ECTS lus par les règles d'UE (placeholders de generate_placeholders) et par le calcul final
+        declared = [ects_data.get(f"ECTS{i}", 0) if i <= 16 and i not in hidden else "" for i in range(1, subjects + 1)]
+        eligible = np.array([bool(value) for value in declared], dtype=bool)
+        weights = np.array([float(value) if value else 0.0 for value in declared])
+        credits = np.array([int(ects_data.get(f"ECTS{i}", 1)) for i in range(1, subjects + 1)], dtype=np.int64)
+    except (TypeError, ValueError):
+        return _fallback(key, "ECTS configuration")
+
+    cells = students.iloc[:, list(grade_column_indices)].fillna('').astype(str).to_numpy(dtype=object)
+    grades = ClassGrades(cells)
+    if not grades.finite:
+        return _fallback(key, "non-finite grade")
+    count = len(cells)
+    columns = {}
+
+    # Règles des groupes de matières, sur les moyennes non arrondies des cases retenues
+    valid = (grades.kinds == NUMERIC) & eligible
+    states = np.full((count, subjects), None, dtype=object)
+    ue_states = {}
+    for rule, ue_name, numbers in plan:
+        cols = [number - 1 for number in numbers if number <= subjects]
+        notes, kept = grades.averages[:, cols], valid[:, cols]
+        credited = kept if rule in (UE_NOTES, EVALUATE_UE) else kept & ~(notes < 8)
+        average = _weighted_average(notes, weights[cols], kept, credited)
+        below_8 = (kept & (notes < 8)).sum(axis=1)
+        between_8_10 = (kept & (notes >= 8) & (notes < 10)).sum(axis=1)
+        all_above_10 = (~kept | (notes >= 10)).all(axis=1)
+
+        columns[f"moy{ue_name}"] = np.where(credited.any(axis=1), _format(average), "")
+        if rule == UE_NOTES:
+            ue_states[ue_name] = np.where(all_above_10 | (average >= 10), "VA", "NV")
+            states[:, cols] = np.where(kept & (notes < 8), "R", "")
+        elif rule == EVALUATE_UE:
+            validated = all_above_10 | ((below_8 == 0) & (between_8_10 <= 1))
+            ue_states[ue_name] = np.where(kept.any(axis=1), np.where(validated, "VA", "NV"), "")
+            states[:, cols] = _component_states(notes, kept, (below_8 > 0) | (between_8_10 > 1))
+        else:
+            ue_states[ue_name] = np.where(credited.any(axis=1) & (average >= 10), "VA", "NV")
+            states[:, cols] = _component_states(notes, kept, np.zeros(count, dtype=bool))
+            for number in numbers:
+                if number > subjects:
+                    columns[f"note{number}"] = columns[f"etat{number}"] = columns[f"ECTS{number}"] = np.full(count, "", dtype=object)
+
+    # Premier groupe réévalué sur les notes affichées
+    cols = [number - 1 for number in plan[0][2]]
+    notes, kept = grades.rounded[:, cols], valid[:, cols]
+    below_8 = (kept & (notes < 8)).sum(axis=1)
+    between_8_10 = (kept & (notes >= 8) & (notes < 10)).sum(axis=1)
+    all_above_10 = (~kept | (notes >= 10)).all(axis=1)
+    validated = all_above_10 | ((between_8_10 == 1) & (below_8 == 0))
+    ue_states["UE1"] = np.where(kept.any(axis=1), np.where(validated, "VA", "NV"), "")
+    states[:, cols] = _component_states(notes, kept, (below_8 > 0) | (between_8_10 > 1))
+
+    stated = {number for _, _, numbers in plan for number in numbers}
+
+    # Note et ECTS de chaque matière, d'après la case seule
+    numeric = grades.kinds >= NUMERIC
+    special = grades.kinds == SPECIAL
+    hidden_columns = np.array([i in hidden for i in range(1, subjects + 1)], dtype=bool)
+    subject_notes = np.where(special, grades.labels, np.where(numeric & (grades.averages != 0), grades.notes, ""))
+    subject_ects = np.where(numeric & (grades.averages > 8) & ~hidden_columns, credits, 0)
+    blank_ects = ~numeric | ~(grades.averages > 0)
+
+    # Moyennes d'UE pondérées par les ECTS, avant la mise à 0 des ECTS des rattrapages
+    ue_averages = {}
+    for ue, indices in ects_sum_indices.items():
+        ue_sum = np.zeros(count)
+        ue_ects = np.zeros(count, dtype=np.int64)
+        used = np.zeros(count, dtype=np.int64)
+        for index in indices:
+            if index > subjects:
+                continue
+            col = index - 1
+            counted = ~special[:, col] & ~blank_ects[:, col] & (subject_ects[:, col] != 0)
+            ue_sum += np.where(counted, grades.rounded[:, col] * subject_ects[:, col], 0.0)
+            ue_ects += np.where(counted, subject_ects[:, col], 0)
+            used += counted
+        if not np.isfinite(ue_sum).all():
+            return _fallback(key, "non-finite UE average")
+        average = np.where(ue_ects > 0, _rounded_up(np.divide(ue_sum, ue_ects, out=np.zeros(count), where=ue_ects > 0)), 0.0)
+        columns[f"moy{ue}"] = np.where((average != 0) & (used > 0), _format(average), "")
+        ue_averages[ue] = np.where(columns[f"moy{ue}"] != "", average, 0.0)
+
+    # Matière en rattrapage : 0 ECTS
+    retake = states == "R"
+    subject_ects = np.where(retake, 0, subject_ects)
+    blank_ects &= ~retake
+    total_ects = np.zeros(count, dtype=np.int64)
+    for ue, indices in ects_sum_indices.items():
+        cols = [index - 1 for index in indices if index <= subjects]
+        ue_ects = np.where(blank_ects[:, cols], 0, subject_ects[:, cols]).sum(axis=1)
+        columns[f"ECTS{ue}"] = ue_ects
+        total_ects += ue_ects
+    columns["moyenneECTS"] = total_ects
+
+    for ue_name, state in ue_states.items():
+        columns[f"etat{ue_name}"] = state
+    final_states = [columns[f"etat{ue}"] for ue in ects_sum_indices if f"etat{ue}" in columns]
+    not_validated = np.zeros(count, dtype=bool)
+    failed = np.zeros(count, dtype=bool)
+    for state in final_states:
+        not_validated |= (state != "") & (state != "VA")
+        failed |= state == "NV"
+    columns["totaletat"] = np.where(~not_validated, "VA", np.where(failed, "NV", ""))
+
+    # Moyenne générale, pondérée par les ECTS des UE
+    total_ue_notes = np.zeros(count)
+    total_ue_ects = np.zeros(count, dtype=np.int64)
+    for ue in ects_sum_indices:
+        ue_ects = columns[f"ECTS{ue}"]
+        total_ue_notes += np.where((columns[f"moy{ue}"] != "") & (ue_ects != 0), ue_averages[ue] * ue_ects, 0.0)
+        total_ue_ects += ue_ects
+    moyenne = _rounded_up(np.divide(total_ue_notes, total_ue_ects, out=np.zeros(count), where=total_ue_ects != 0))
+    columns["moyenne"] = np.where(total_ue_ects != 0, _format(moyenne), 0)
+
+    for col in range(subjects):
+        number = col + 1
+        columns[f"note{number}"] = subject_notes[:, col]
+        if number not in hidden:
+            columns[f"ECTS{number}"] = np.where(blank_ects[:, col], "", subject_ects[:, col].astype(object))
+        if number in stated:
+            columns[f"etat{number}"] = states[:, col]
+    for number in hidden:
+        columns.pop(f"ECTS{number}", None)
+
+    engine_metrics["classes"] += 1
+    engine_metrics["students"] += count
+    engine_metrics["distinct_cells"] += grades.distinct
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in zip(*(np.asarray(columns[key], dtype=object).tolist() for key in keys))]
+
+
+def _fallback(key, reason):
+    engine_metrics["fallbacks"] += 1
+    logger.info("Class grade engine skipped for %s (%s): grades are computed per student", key, reason)
+    return None
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import threading
+import time
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from app.core.config import settings
+
+# Configure the logger
+logger = logging.getLogger(__name__)
+
+# Dernier état connu par session : remplacé en entier à chaque mise à jour (jamais modifié en place)
+_states = {}
+# Étape en cours par session : bornes de progression, volume et début de l'étape
+_stages = {}
+# Événements des connexions abonnées, par session : levés à chaque mise à jour, consommés au rythme du client.
+# Modifiés par la boucle mais lus aussi depuis les threads de travail (advance) : accès sous _subscribers_lock
+_subscribers = {}
+_subscribers_lock = threading.Lock()
+progress_metrics = {"updates": 0, "sent": 0, "send_errors": 0}
+
+_loop = None
+_pending_sessions = set()
+_pending_lock = threading.Lock()
+
+
+def _remember_loop():
+    global _loop
+    try:
+        _loop = asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def _session_subscribers(session_id):
+    # Copie sous verrou : l'ensemble peut changer pendant le parcours (connexion ou déconnexion sur la boucle)
+    with _subscribers_lock:
+        return tuple(_subscribers.get(session_id, ()))
+
+
+def _notify(session_id):
+    for event in _session_subscribers(session_id):
+        event.set()
+
+
+def _flush_pending():
+    with _pending_lock:
+        sessions = list(_pending_sessions)
+        _pending_sessions.clear()
+    for session_id in sessions:
+        _notify(session_id)
+
+
+def _publish(session_id, **changes):
+    now = time.monotonic()
+    state = _states.get(session_id) or {"session_id": session_id, "progress": 0, "stage": None, "message": None,
+                                        "done": None, "total": None, "eta_seconds": None, "started_at": now}
+    state = {**state, **changes}
+    state["elapsed_seconds"] = round(now - state["started_at"], 1)
+    _states[session_id] = state
+    progress_metrics["updates"] += 1
+
+    subscribers = _session_subscribers(session_id)
+    if not subscribers:
+        return
+    if _remember_loop():
+        _notify(session_id)
+    elif _loop is not None:
+        # Appel depuis un thread de travail (génération des bulletins) : la boucle n'est réveillée
+        # que si une connexion n'a pas déjà une mise à jour en attente (au plus une fois par envoi)
+        if all(event.is_set() for event in subscribers):
+            return
+        with _pending_lock:
+            schedule = not _pending_sessions
+            _pending_sessions.add(session_id)
+        if schedule:
+            _loop.call_soon_threadsafe(_flush_pending)
+
+
+def _prune(now):
+    expired = [session_id for session_id, state in _states.items()
+               if now - state["started_at"] > settings.PROGRESS_STATE_TTL and session_id not in _subscribers]
+    for session_id in expired:
+        _states.pop(session_id, None)
+        _stages.pop(session_id, None)
+
+
+def report(session_id, progress, stage=None, message=None):
+    """Met à jour la progression (en %) d'une session ; ne bloque jamais, l'envoi aux clients est différé."""
+    _remember_loop()
+    if session_id not in _states:
+        _prune(time.monotonic())
+    changes = {"progress": progress, "done": None, "total": None, "eta_seconds": None}
+    if stage is not None:
+        # Nouvelle étape : le message de l'étape précédente ne s'applique plus
+        changes["stage"], changes["message"] = stage, message
+        _stages.pop(session_id, None)
+    elif message is not None:
+        changes["message"] = message
+    _publish(session_id, **changes)
+
+
+def start_stage(session_id, stage, start, end, total=None, message=None):
+    """
+    Démarre une étape couvrant la plage [start, end] % de la progression.
+    Si total est fourni, advance() y place la progression au prorata et estime la fin de l'étape.
+    """
+    report(session_id, start, stage=stage, message=message)
+    _stages[session_id] = {"start": start, "end": end, "total": total, "started_at": time.monotonic()}
+    if total:
+        _publish(session_id, done=0, total=total)
+
+
+def advance(session_id, done, total=None):
+    """
+    Avancement de l'étape en cours (done éléments sur total). Appelable pour chaque apprenant,
+    y compris depuis un thread : le coût est celui d'une mise à jour de dictionnaire.
+    """
+    stage = _stages.get(session_id)
+    if stage is None:
+        return
+    total = total or stage["total"]
+    if not total:
+        return
+    fraction = min(1.0, done / total)
+    elapsed = time.monotonic() - stage["started_at"]
+    # Débit mesuré sur l'étape (apprenants par seconde) : reste à faire / débit
+    eta = round((total - done) * elapsed / done, 1) if done and elapsed > 0 else None
+    _publish(session_id, progress=round(stage["start"] + (stage["end"] - stage["start"]) * fraction, 1),
+             done=done, total=total, eta_seconds=eta)
+
+
+def finish(session_id, message=None, failed=False):
+    _stages.pop(session_id, None)
+    _publish(session_id, progress=100 if not failed else _states.get(session_id, {}).get("progress", 0),
+             stage="failed" if failed else "done", message=message, eta_seconds=0 if not failed else None)
+
+
+def _message(state):
+    message = {key: value for key, value in state.items() if key != "started_at"}
+    message["progress"] = round(state["progress"])
+    message["message"] = state["message"] or f"Processing progress: {message['progress']}%"
+    return message
+
+
+def get_state(session_id):
+    state = _states.get(session_id)
+    return _message(state) if state is not None else None
+
+
+async def _send_updates(websocket: WebSocket, session_id, event):
+    """Envoie le dernier état au plus PROGRESS_MAX_UPDATES_PER_SECOND fois par seconde ; les états intermédiaires sont fusionnés."""
+    interval = 1 / settings.PROGRESS_MAX_UPDATES_PER_SECOND
+    last_sent = None
+    while True:
+        await event.wait()
+        event.clear()
+        state = _states.get(session_id)
+        if state is not None and state is not last_sent:
+            await websocket.send_json(_message(state))
+            progress_metrics["sent"] += 1
+            last_sent = state
+            if state["stage"] in ("done", "failed"):
+                return
+        await asyncio.sleep(interval)
+
+
+async def subscribe(websocket: WebSocket, session_id):
+    """
+    Relaie la progression d'une session à une connexion WebSocket déjà acceptée, jusqu'à sa fermeture.
+    Chaque connexion a sa propre tâche d'envoi : un client lent ne retarde que ses propres mises à jour.
+    """
+    _remember_loop()
+    event = asyncio.Event()
+    with _subscribers_lock:
+        _subscribers.setdefault(session_id, set()).add(event)
+    if session_id in _states:
+        event.set()
+    sender = asyncio.create_task(_send_updates(websocket, session_id, event))
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket connection closed for session {session_id}")
+    finally:
+        sender.cancel()
+        try:
+            await sender
+        except (asyncio.CancelledError, WebSocketDisconnect):
+            pass
+        except Exception as e:
+            progress_metrics["send_errors"] += 1
+            logger.warning(f"Progress updates stopped for session {session_id}: {e}")
+        with _subscribers_lock:
+            subscribers = _subscribers.get(session_id)
+            if subscribers is not None:
+                subscribers.discard(event)
+                if not subscribers:
+                    _subscribers.pop(session_id, None)
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.core.config import settings
+from app.services.api_service import send_request
+
+# Configure the logger
+logger = logging.getLogger(__name__)
+
+# Statuts pour lesquels une nouvelle tentative a un sens
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# État du disjoncteur par hôte : 'closed' (normal), 'open' (requêtes refusées), 'half_open' (un essai autorisé)
+_circuits = {}
+# Compteurs exposés via /ypareo/metrics, par hôte
+retry_metrics = {}
+
+
+class CircuitOpenError(Exception):
+    """Levée lorsque le disjoncteur d'un hôte est ouvert : la requête n'est pas envoyée."""
+
+
+def _host(url):
+    return urlsplit(str(url)).netloc
+
+
+def _metrics(host):
+    return retry_metrics.setdefault(host, {
+        "requests": 0,
+        "retries": 0,
+        "retry_wait_seconds": 0.0,
+        "server_errors": 0,
+        "transport_errors": 0,
+        "circuit_opened": 0,
+        "short_circuited": 0,
+        "open_seconds": 0.0,
+    })
+
+
+def _circuit(host):
+    return _circuits.setdefault(host, {"state": "closed", "failures": 0, "opened_at": None, "trial_in_flight": False})
+
+
+def _before_request(host):
+    circuit = _circuit(host)
+    if circuit["state"] == "open":
+        if time.monotonic() - circuit["opened_at"] < settings.YPAREO_CIRCUIT_RESET_TIMEOUT:
+            _metrics(host)["short_circuited"] += 1
+            raise CircuitOpenError(f"Circuit open for {host}: too many server errors")
+        circuit["state"] = "half_open"
+    if circuit["state"] == "half_open":
+        if circuit["trial_in_flight"]:
+            _metrics(host)["short_circuited"] += 1
+            raise CircuitOpenError(f"Circuit half-open for {host}: trial request in progress")
+        circuit["trial_in_flight"] = True
+
+
+def _record_success(host):
+    circuit = _circuit(host)
+    if circuit["opened_at"] is not None:
+        _metrics(host)["open_seconds"] += time.monotonic() - circuit["opened_at"]
+        logger.info(f"Circuit closed for {host}")
+    circuit.update(state="closed", failures=0, opened_at=None, trial_in_flight=False)
+
+
+def _record_failure(host):
+    circuit = _circuit(host)
+    circuit["failures"] += 1
+    circuit["trial_in_flight"] = False
+    if circuit["state"] == "half_open" or circuit["failures"] >= settings.YPAREO_CIRCUIT_FAILURE_THRESHOLD:
+        if circuit["opened_at"] is not None:
+            _metrics(host)["open_seconds"] += time.monotonic() - circuit["opened_at"]
+        else:
+            _metrics(host)["circuit_opened"] += 1
+            logger.warning(f"Circuit opened for {host} after {circuit['failures']} consecutive failures")
+        circuit.update(state="open", opened_at=time.monotonic())
+
+
+def retry_after_seconds(response):
+    """Délai demandé par l'en-tête Retry-After (secondes ou date HTTP), ou None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt):
+    """Backoff exponentiel avec gigue complète : uniforme entre 0 et base * 2^attempt (plafonné)."""
+    return random.uniform(0, min(settings.YPAREO_RETRY_MAX_DELAY, settings.YPAREO_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+async def send_with_retry(method, url, retries=None, **kwargs):
+    """
+    Envoie une requête via le client partagé avec nouvelles tentatives non bloquantes.
+
+    Les erreurs réseau et les statuts de RETRYABLE_STATUSES sont retentés avec un
+    backoff exponentiel à gigue, ou après le délai Retry-After s'il est fourni.
+    Les erreurs serveur répétées ouvrent le disjoncteur de l'hôte : les requêtes
+    suivantes lèvent CircuitOpenError sans être envoyées jusqu'à YPAREO_CIRCUIT_RESET_TIMEOUT.
+    La dernière réponse est retournée telle quelle ; la dernière erreur réseau est relevée.
+    La requête est toujours envoyée au moins une fois, même avec retries=0.
+    """
+    host = _host(url)
+    metrics = _metrics(host)
+    # Au moins un envoi : retries=0 (ou un réglage à 0) signifie « sans nouvelle tentative »
+    attempts = max(1, retries if retries is not None else settings.YPAREO_RETRY_ATTEMPTS)
+
+    for attempt in range(attempts):
+        _before_request(host)
+        metrics["requests"] += 1
+        last_attempt = attempt == attempts - 1
+        try:
+            response = await send_request(method, url, **kwargs)
+        except asyncio.CancelledError:
+            _circuit(host)["trial_in_flight"] = False
+            raise
+        except httpx.TransportError as e:
+            metrics["transport_errors"] += 1
+            _record_failure(host)
+            if last_attempt:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"{method} {url} failed ({e!r}), retrying in {delay:.1f}s")
+        else:
+            if response.status_code >= 500:
+                metrics["server_errors"] += 1
+                _record_failure(host)
+            else:
+                _record_success(host)
+            if response.status_code not in RETRYABLE_STATUSES or last_attempt:
+                return response
+            retry_after = retry_after_seconds(response)
+            delay = min(retry_after, settings.YPAREO_RETRY_MAX_DELAY) if retry_after is not None else backoff_delay(attempt)
+            logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+
+        metrics["retries"] += 1
+        metrics["retry_wait_seconds"] += delay
+        await asyncio.sleep(delay)
+
+
+def resilience_stats():
+    now = time.monotonic()
+    stats = {}
+    for host, metrics in retry_metrics.items():
+        circuit = _circuit(host)
+        open_seconds = metrics["open_seconds"]
+        if circuit["opened_at"] is not None:
+            open_seconds += now - circuit["opened_at"]
+        stats[host] = {**metrics, "open_seconds": round(open_seconds, 1), "retry_wait_seconds": round(metrics["retry_wait_seconds"], 1),
+                       "circuit_state": circuit["state"], "consecutive_failures": circuit["failures"]}
+    return stats
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import pickle
+import time
+import zlib
+
+from app.core.config import settings
+from app.services.api_service import dataset_for_url
+
+# Configure the logger
+logger = logging.getLogger(__name__)
+
+# À incrémenter dès que la forme des données sauvegardées change : les anciens fichiers sont alors ignorés
+SNAPSHOT_VERSION = 1
+
+# Instantané en mémoire : clé -> {'fetched_at': horodatage, 'data': (api_data, groupes_dict, frequentes_dict, periodes_dict)}
+_entries = {}
+# Chargement du fichier (lancé au démarrage) et rafraîchissements en cours, par clé
+_load_task = None
+_refresh_tasks = {}
+# Incrémenté à chaque invalidation : chargements et rafraîchissements lancés avant sont ignorés
+_generation = 0
+
+
+def _read_snapshot_file():
+    path = settings.YPAREO_SNAPSHOT_PATH
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'rb') as f:
+            payload = pickle.loads(zlib.decompress(f.read()))
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable Yparéo snapshot {path}: {e}")
+        return {}
+    if not isinstance(payload, dict) or payload.get('version') != SNAPSHOT_VERSION:
+        logger.info(f"Ignoring Yparéo snapshot {path}: version {payload.get('version') if isinstance(payload, dict) else None} != {SNAPSHOT_VERSION}")
+        return {}
+    return payload['entries']
+
+
+def _write_snapshot_file(entries):
+    path = settings.YPAREO_SNAPSHOT_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    blob = zlib.compress(pickle.dumps({'version': SNAPSHOT_VERSION, 'entries': entries}, protocol=pickle.HIGHEST_PROTOCOL))
+    # Écriture atomique : un autre worker ne lit jamais un fichier à moitié écrit
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(blob)
+    os.replace(tmp_path, path)
+    logger.info(f"Yparéo snapshot written to {path} ({len(blob)} bytes, {len(entries)} entries)")
+
+
+async def _load():
+    generation = _generation
+    entries = await asyncio.to_thread(_read_snapshot_file)
+    if generation != _generation:
+        logger.info("Yparéo snapshot file ignored: invalidated while loading")
+        return
+    # Les données récupérées pendant le chargement sont plus récentes que celles du fichier
+    for key, entry in entries.items():
+        _entries.setdefault(key, entry)
+    logger.info(f"Yparéo snapshot loaded: {len(entries)} entries")
+
+
+def start_loading():
+    """Lance le chargement de l'instantané en arrière-plan (appelé au démarrage de l'application)."""
+    global _load_task
+    if settings.YPAREO_SNAPSHOT_ENABLED and _load_task is None:
+        _load_task = asyncio.create_task(_load())
+    return _load_task
+
+
+async def _ensure_loaded():
+    start_loading()
+    if _load_task is not None:
+        try:
+            await asyncio.shield(_load_task)
+        except Exception as e:
+            logger.warning(f"Yparéo snapshot load failed: {e}")
+
+
+async def _save(key, data, generation=None):
+    if generation is not None and generation != _generation:
+        logger.debug(f"Discarding refreshed snapshot entry {key}: invalidated meanwhile")
+        return
+    _entries[key] = {'fetched_at': time.time(), 'data': data}
+    try:
+        await asyncio.to_thread(_write_snapshot_file, dict(_entries))
+    except OSError as e:
+        logger.warning(f"Could not write Yparéo snapshot: {e}")
+
+
+async def _refresh(key, loader, generation):
+    try:
+        await _save(key, await loader(), generation)
+        logger.debug(f"Yparéo snapshot entry refreshed: {key}")
+    except Exception as e:
+        # L'entrée existante reste servie jusqu'au prochain essai
+        logger.warning(f"Yparéo snapshot refresh failed for {key}: {e}")
+    finally:
+        _refresh_tasks.pop(key, None)
+
+
+async def get_or_load(key, loader):
+    """
+    Retourne les données de référence pour la clé depuis l'instantané, ou les
+    récupère via loader() si elles n'y sont pas. Une entrée plus ancienne que
+    YPAREO_SNAPSHOT_MAX_AGE est servie pendant qu'elle est rafraîchie en arrière-plan.
+    """
+    if not settings.YPAREO_SNAPSHOT_ENABLED:
+        return await loader()
+
+    await _ensure_loaded()
+    entry = _entries.get(key)
+    if entry is None:
+        generation = _generation
+        data = await loader()
+        await _save(key, data, generation)
+        return data
+
+    if time.time() - entry['fetched_at'] > settings.YPAREO_SNAPSHOT_MAX_AGE and key not in _refresh_tasks:
+        _refresh_tasks[key] = asyncio.create_task(_refresh(key, loader, _generation))
+    return entry['data']
+
+
+def _rewrite_snapshot_file(entries):
+    if entries:
+        _write_snapshot_file(entries)
+    elif os.path.exists(settings.YPAREO_SNAPSHOT_PATH):
+        os.remove(settings.YPAREO_SNAPSHOT_PATH)
+        logger.info(f"Yparéo snapshot {settings.YPAREO_SNAPSHOT_PATH} removed")
+
+
+async def invalidate(dataset=None):
+    """
+    Retire de l'instantané (en mémoire et sur disque) les entrées construites à partir du jeu de
+    données, ou toutes. Sans cela, les jobs continueraient d'être servis par l'instantané après
+    l'invalidation du cache. Retourne les clés retirées.
+    """
+    global _generation
+    _generation += 1
+    keys = [key for key in _entries
+            if dataset is None or any(dataset_for_url(part) == dataset for part in key.split("|"))]
+    for key in keys:
+        _entries.pop(key, None)
+    if settings.YPAREO_SNAPSHOT_ENABLED:
+        try:
+            await asyncio.to_thread(_rewrite_snapshot_file, dict(_entries))
+        except OSError as e:
+            logger.warning(f"Could not rewrite Yparéo snapshot: {e}")
+    logger.info(f"Invalidated {len(keys)} Yparéo snapshot entries (dataset={dataset or 'all'})")
+    return keys
+
+
+def snapshot_stats():
+    now = time.time()
+    return {
+        key: {
+            "fetched_at": entry['fetched_at'],
+            "age_seconds": round(now - entry['fetched_at'], 1),
+            "refreshing": key in _refresh_tasks,
+        }
+        for key, entry in _entries.items()
+    }
@@ -0,0 +1,59 @@
+import hashlib
+import logging
+import os
+
+from app.utils.sheet_utils import ParsedTemplate
+
+# Configure the logger
+logger = logging.getLogger(__name__)
+
+# Templates analysés, par chemin : partagés par tous les jobs du processus
+_templates = {}
+template_metrics = {"hits": 0, "misses": 0, "reloads": 0}
+
+
+class _Entry:
+    def __init__(self, template, mtime_ns, size, digest):
+        self.template = template
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = digest
+
+
+def get_template(path):
+    """
+    Retourne le template analysé pour ce fichier, en ne le relisant que s'il a changé.
+
+    Un changement de date de modification ou de taille relit le fichier ; il n'est
+    analysé à nouveau que si son contenu (empreinte SHA-256) diffère.
+    """
+    stat = os.stat(path)
+    entry = _templates.get(path)
+    if entry is not None and (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+        template_metrics["hits"] += 1
+        return entry.template
+
+    with open(path, 'rb') as f:
+        image = f.read()
+    digest = hashlib.sha256(image).hexdigest()
+    if entry is not None and entry.digest == digest:
+        # Fichier touché mais inchangé : l'analyse existante reste valable
+        entry.mtime_ns, entry.size = stat.st_mtime_ns, stat.st_size
+        template_metrics["hits"] += 1
+        return entry.template
+
+    template_metrics["reloads" if entry is not None else "misses"] += 1
+    logger.debug(f"Parsing template {path} ({'changed on disk' if entry is not None else 'first use'})")
+    template = ParsedTemplate(image)
+    _templates[path] = _Entry(template, stat.st_mtime_ns, stat.st_size, digest)
+    return template
+
+
+def template_cache_stats():
+    return {
+        "metrics": template_metrics,
+        "templates": {
+            path: {"sha256": entry.digest, "bytes": entry.size, "rows": len(entry.template.rows)}
+            for path, entry in _templates.items()
+        },
+    }
@@ -0,0 +1,1087 @@
+import logging
+import os
+from collections import Counter
+
+from app.core.config import settings
+from app.utils.sheet_utils import normalize_title
+from app.utils.title_matching import TitleAutomaton
+
+# Configure the logger
+logger = logging.getLogger(__name__)
+
+
+def _columns(date_naissance, code_apprenant=1):
+    """Colonnes du template Excel d'une classe : les informations Yparéo se suivent à partir de la date de naissance."""
+    fields = ('date_naissance', 'nom_site', 'code_groupe', 'nom_groupe', 'etendu_groupe',
+              'duree_justifie', 'duree_non_justifie', 'duree_retard', 'appreciation')
+    columns = {
+        'name_column_index_uploaded': 2,
+        'name_column_index_template': 2,
+        'code_apprenant_column_index_template': code_apprenant,
+    }
+    for offset, field in enumerate(fields):
+        columns[f'{field}_column_index_template'] = date_naissance + offset
+    return columns
+
+
+# Mises en page des bulletins, par ordre de priorité : les chemins sont des noms d'attributs de settings.
+# titles : plage (début, fin) des titres de matières dans la ligne d'en-tête du tableau de la classe ;
+# excel_templates : classeurs fusionnés reconnus (par nom de fichier) comme relevant de cette mise en page
+BULLETIN_LAYOUTS = (
+    {
+        "key": "M1_S1",
+        "titles": (2, 22),
+        "template_word": "M1_S1_MAPI_TEMPLATE_WORD",
+        "excel_templates": ["M1_S1_MAPI_TEMPLATE", "M1_S1_MAGI_TEMPLATE", "M1_S1_MEFIM_TEMPLATE", "M1_S1_MAPI_TEMPLATE_NOT_EMPTY", "M1_S1_MAGI_TEMPLATE_NOT_EMPTY", "M1_S1_MEFIM_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5, 7, 9, 10, 12, 13, 14, 15, 16, 17, 19, 20, 21],
+        "ects_sum_indices": {'UE1': [1, 2, 3], 'UE2': [4], 'UE3': [5, 6], 'UE4': [7, 11], 'UE5': [13, 14, 15]},
+        "hidden_ects": [8, 9, 10, 12],
+    },
+    {
+        "key": "M1_S2",
+        "titles": (2, 22),
+        "template_word": "M1_S2_MAPI_TEMPLATE_WORD",
+        "excel_templates": ["M1_S2_MAPI_TEMPLATE", "M1_S2_MAGI_TEMPLATE", "M1_S2_MEFIM_TEMPLATE", "M1_S2_MAPI_TEMPLATE_NOT_EMPTY", "M1_S2_MAGI_TEMPLATE_NOT_EMPTY", "M1_S2_MEFIM_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5, 7, 8, 10, 11, 12, 13, 14, 15, 16, 18, 19, 20, 21],
+        "ects_sum_indices": {'UE1': [1, 2, 3], 'UE2': [4, 5], 'UE3': [6, 7, 8, 12], 'UE4': [13, 14, 15, 16]},
+        "hidden_ects": [9, 10, 11],
+    },
+    {
+        "key": "M2_S3_MAGI",
+        "titles": (2, 19),
+        "template_word": "M2_S3_MAGI_TEMPLATE_WORD",
+        "excel_templates": ["M2_S3_MAGI_TEMPLATE"],
+        "grade_column_indices": [3, 4, 6, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18],
+        "ects_sum_indices": {'UE1': [1, 2], 'UE2': [3], 'UE3': [4, 5, 6, 7, 8, 9], 'UE4': [10, 11, 12, 13]},
+        "hidden_ects": [4, 8, 9],
+    },
+    {
+        "key": "M2_S3_MEFIM",
+        "titles": (2, 19),
+        "template_word": "M2_S3_MAGI_TEMPLATE_WORD",
+        "excel_templates": ["M2_S3_MEFIM_TEMPLATE"],
+        "grade_column_indices": [3, 4, 6, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18],
+        "ects_sum_indices": {'UE1': [1, 2], 'UE2': [3], 'UE3': [4, 5, 6, 7, 8, 9], 'UE4': [10, 11, 12, 13]},
+        "hidden_ects": [4, 8, 9],
+    },
+    {
+        "key": "M2_S3_MAPI",
+        "titles": (2, 20),
+        "template_word": "M2_S3_MAPI_TEMPLATE_WORD",
+        "excel_templates": ["M2_S3_MAPI_TEMPLATE"],
+        "grade_column_indices": [3, 4, 6, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18, 19],
+        "ects_sum_indices": {'UE1': [1, 2], 'UE2': [3], 'UE3': [4, 5, 6, 7, 8, 9], 'UE4': [10, 11, 12, 13, 14]},
+        "hidden_ects": [4, 8, 9],
+    },
+    {
+        "key": "M2_S4",
+        "titles": (2, 17),
+        "template_word": "M2_S4_MAPI_TEMPLATE_WORD",
+        "excel_templates": ["M2_S4_MAPI_TEMPLATE", "M2_S4_MAGI_TEMPLATE", "M2_S4_MEFIM_TEMPLATE", "M2_S4_MAPI_TEMPLATE_NOT_EMPTY", "M2_S4_MAGI_TEMPLATE_NOT_EMPTY", "M2_S4_MEFIM_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 5, 6, 8, 9, 10, 11, 12, 14, 15, 16],
+        "ects_sum_indices": {'UE1': [1], 'UE2': [2, 3], 'UE3': [4, 5, 8], 'UE4': [9, 10, 11]},
+        "hidden_ects": [6, 7],
+    },
+    {
+        "key": "BG_ALT_1",
+        "titles": (2, 20),
+        "template_word": "BG_ALT_1_TEMPLATE_WORD",
+        "excel_templates": ["BG_ALT_1_TEMPLATE", "BG_ALT_1_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5, 7, 8, 10, 12, 14, 15, 16, 17, 18, 19],
+        "ects_sum_indices": {'UE1': [1, 2, 3], 'UE2': [4, 5], 'UE3': [6], 'UE4': [7, 8, 9, 10, 11, 12, 13, 14]},
+        "hidden_ects": [9, 10, 11, 14],
+    },
+    {
+        "key": "BG_ALT_2",
+        "titles": (2, 21),
+        "template_word": "BG_ALT_2_TEMPLATE_WORD",
+        "excel_templates": ["BG_ALT_2_TEMPLATE", "BG_ALT_2_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5, 6, 8, 9, 10, 12, 14, 15, 16, 17, 18, 19, 20],
+        "ects_sum_indices": {'UE1': [1, 2, 3, 4], 'UE2': [5, 6, 7], 'UE3': [8], 'UE4': [9, 10, 11, 12, 13, 14, 15]},
+        "hidden_ects": [11, 12, 13, 14, 15],
+    },
+    {
+        "key": "BG_ALT_3",
+        "titles": (2, 19),
+        "template_word": "BG_ALT_3_TEMPLATE_WORD",
+        "excel_templates": ["BG_ALT_3_TEMPLATE", "BG_ALT_3_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5, 6, 7, 9, 10, 12, 14, 15, 16, 17, 18],
+        "ects_sum_indices": {'UE1': [1, 2, 3, 4, 5], 'UE2': [6, 7], 'UE3': [8], 'UE4': [9, 10, 11, 12, 13]},
+        "hidden_ects": [4, 11, 12, 13],
+    },
+    {
+        "key": "BG_ALT_4",
+        "titles": (2, 18),
+        "template_word": "BG_ALT_4_TEMPLATE_WORD",
+        "excel_templates": ["BG_ALT_4_TEMPLATE", "BG_ALT_4_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5, 7, 8, 9, 11, 13, 14, 15, 16, 17],
+        "ects_sum_indices": {'UE1': [1, 2, 3], 'UE2': [4, 5, 6, 7], 'UE3': [8], 'UE4': [9, 10, 11, 12, 13]},
+        "hidden_ects": [11, 12, 13],
+    },
+    {
+        "key": "BG_ALT_5",
+        "titles": (2, 20),
+        "template_word": "BG_ALT_5_TEMPLATE_WORD",
+        "excel_templates": ["BG_ALT_5_TEMPLATE", "BG_ALT_5_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5, 7, 8, 9, 11, 13, 14, 15, 16, 17, 18, 19],
+        "ects_sum_indices": {'UE1': [1, 2, 3], 'UE2': [4, 5, 6], 'UE3': [7], 'UE4': [8, 9, 10, 11, 12, 13, 14]},
+        "hidden_ects": [10, 11, 12, 14],
+    },
+    {
+        "key": "BG_ALT_6",
+        "titles": (2, 18),
+        "template_word": "BG_ALT_6_TEMPLATE_WORD",
+        "excel_templates": ["BG_ALT_6_TEMPLATE", "BG_ALT_6_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 6, 7, 9, 10, 12, 13, 14, 15, 16, 17],
+        "ects_sum_indices": {'UE1': [1, 2], 'UE2': [3, 4], 'UE3': [5, 6], 'UE4': [7, 8, 9, 10, 11, 12]},
+        "hidden_ects": [9, 12],
+    },
+    {
+        "key": "BG_TP_1",
+        "titles": (2, 28),
+        "template_word": "BG_TP_1_TEMPLATE_WORD",
+        "excel_templates": ["BG_TP_1_TEMPLATE", "BG_TP_1_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5, 6, 7, 8, 9, 11, 12, 13, 14, 15, 17, 18, 20, 21, 22, 23, 24, 25, 26, 27],
+        "ects_sum_indices": {'UE1': [1, 2, 3, 4, 5, 6, 7], 'UE2': [8, 9, 10, 11, 12], 'UE3': [13, 14], 'UE4': [15, 16, 17, 18, 19, 20, 21, 22]},
+        "hidden_ects": [16, 17, 18, 20, 21, 22],
+    },
+    {
+        "key": "BG_TP_2",
+        "titles": (2, 5),
+        "template_word": "BG_TP_2_TEMPLATE_WORD",
+        "excel_templates": ["BG_TP_2_TEMPLATE", "BG_TP_2_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4],
+        "ects_sum_indices": {'UE1': [1, 2]},
+        "hidden_ects": [],
+    },
+    {
+        "key": "BG_TP_3",
+        "titles": (2, 21),
+        "template_word": "BG_TP_3_TEMPLATE_WORD",
+        "excel_templates": ["BG_TP_3_TEMPLATE", "BG_TP_3_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18, 19, 20],
+        "ects_sum_indices": {'UE1': [1, 2, 3, 4], 'UE2': [5, 6, 7, 8, 9], 'UE3': [10, 11], 'UE4': [12, 13, 14, 15]},
+        "hidden_ects": [13, 14, 15],
+    },
+    {
+        "key": "BG_TP_4",
+        "titles": (2, 4),
+        "template_word": "BG_TP_4_TEMPLATE_WORD",
+        "excel_templates": ["BG_TP_4_TEMPLATE", "BG_TP_4_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3],
+        "ects_sum_indices": {'UE1': [1]},
+        "hidden_ects": [],
+    },
+    {
+        "key": "BG_TP_5",
+        "titles": (2, 25),
+        "template_word": "BG_TP_5_TEMPLATE_WORD",
+        "excel_templates": ["BG_TP_5_TEMPLATE", "BG_TP_5_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5, 6, 7, 9, 11, 12, 13, 15, 17, 19, 20, 21, 22, 23, 24],
+        "ects_sum_indices": {'UE1': [1, 2, 3, 4, 5], 'UE2': [6, 7, 8, 9, 10], 'UE3': [11, 12, 13], 'UE4': [14, 15, 16, 17, 18, 19]},
+        "hidden_ects": [15, 16, 18],
+    },
+    {
+        "key": "BG_TP_6",
+        "titles": (2, 6),
+        "template_word": "BG_TP_6_TEMPLATE_WORD",
+        "excel_templates": ["BG_TP_6_TEMPLATE", "BG_TP_6_TEMPLATE_NOT_EMPTY"],
+        "grade_column_indices": [3, 4, 5],
+        "ects_sum_indices": {'UE1': [1, 2, 3]},
+        "hidden_ects": [],
+    },
+)
+
+# Classes : template Excel de fusion, colonnes Yparéo, groupes concernés (liste de settings) et en-tête
+# de l'export de notes (titres lus en ligne 4) qui désigne la classe. Une classe peut préciser ses
+# propres "apprenants_url" / "groupes_url" ; à défaut, les URLs Yparéo de la période courante sont utilisées
+CLASS_TEMPLATES = (
+    {
+        "name": "MAPI",
+        "class_id": "ID_MAPI_001",
+        "template": "M1_S1_MAPI_TEMPLATE",
+        "columns": _columns(23),
+        "groups": "RELEVANT_GROUPS",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Stratégie et Solutions Immobilières',
+            'Finance Immobilière',
+            'Économie Immobilière I',
+            'UE 2 – Droit',
+            'Droit des Affaires et des Contrats',
+            'UE 3 – Aménagement & Urbanisme',
+            'Ville et Développements Urbains',
+            "Politique de l'Habitat",
+            'UE 4 – Compétences Professionnalisantes',
+            'Real Estate English',
+            "Rencontres de l'Immobilier",
+            'ESPI Career Services',
+            'ESPI Inside',
+            'Immersion Professionnelle',
+            'Projet Voltaire',
+            'UE SPE – MAPI',
+            'Étude Foncière',
+            "Montage d'une Opération de Promotion Immobilière",
+            'Acquisition et Dissociation du Foncier',
+        ],
+    },
+    {
+        "name": "MAGI",
+        "class_id": "ID_MAGI_001",
+        "template": "M1_S1_MAGI_TEMPLATE",
+        "columns": _columns(23),
+        "groups": "RELEVANT_GROUPS",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Stratégie et Solutions Immobilières',
+            'Finance Immobilière',
+            'Économie Immobilière I',
+            'UE 2 – Droit',
+            'Droit des Affaires et des Contrats',
+            'UE 3 – Aménagement & Urbanisme',
+            'Ville et Développements Urbains',
+            "Politique de l'Habitat",
+            'UE 4 – Compétences Professionnalisantes',
+            'Real Estate English',
+            "Rencontres de l'Immobilier",
+            'ESPI Career Services',
+            'ESPI Inside',
+            'Immersion Professionnelle',
+            'Projet Voltaire',
+            'UE SPE – MAGI',
+            'Baux Commerciaux et Gestion Locative',
+            'Actifs Tertiaires en Copropriété',
+            'Techniques du Bâtiment',
+        ],
+    },
+    {
+        "name": "MEFIM",
+        "class_id": "ID_MEFIM_001",
+        "template": "M1_S1_MEFIM_TEMPLATE",
+        "columns": _columns(23),
+        "groups": "RELEVANT_GROUPS",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Stratégie et Solutions Immobilières',
+            'Finance Immobilière',
+            'Économie Immobilière I',
+            'UE 2 – Droit',
+            'Droit des Affaires et des Contrats',
+            'UE 3 – Aménagement & Urbanisme',
+            'Ville et Développements Urbains',
+            "Politique de l'Habitat",
+            'UE 4 – Compétences Professionnalisantes',
+            'Real Estate English',
+            "Rencontres de l'Immobilier",
+            'ESPI Career Services',
+            'ESPI Inside',
+            'Immersion Professionnelle',
+            'Projet Voltaire',
+            'UE SPE – MEFIM',
+            "Les Fondamentaux de l'Evaluation",
+            'Analyse et Financement Immobilier',
+            'Modélisation Financière',
+        ],
+    },
+    {
+        "name": "MAPI_S2",
+        "class_id": "ID_MAPI_S2_001",
+        "template": "M1_S2_MAPI_TEMPLATE",
+        "columns": _columns(23),
+        "groups": "RELEVANT_GROUPS",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            "Marketing de l'Immobilier",
+            'Investissement et Financiarisation',
+            'Fiscalité',
+            'UE 2 – Droit',
+            "Droit de l'Urbanisme et de la Construction",
+            "Déontologie en France et à l'International",
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            'Atelier Méthodologie de la Recherche',
+            'Techniques de Négociation',
+            "Rencontres de l'Immobilier",
+            'ESPI Inside',
+            'Projet Voltaire',
+            'UE SPE – MAPI',
+            'Droit de la Promotion Immobilière',
+            "Montage d'une Opération de Logement",
+            'Financement des Opérations de Promotion Immobilière',
+            'Logement Social et Accession Sociale',
+        ],
+    },
+    {
+        "name": "MAGI_S2",
+        "class_id": "ID_MAGI_S2_001",
+        "template": "M1_S2_MAGI_TEMPLATE",
+        "columns": _columns(23),
+        "groups": "RELEVANT_GROUPS",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            "Marketing de l'Immobilier",
+            'Investissement et Financiarisation',
+            'Fiscalité',
+            'UE 2 – Droit',
+            "Droit de l'Urbanisme et de la Construction",
+            "Déontologie en France et à l'International",
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            'Atelier Méthodologie de la Recherche',
+            'Techniques de Négociation',
+            "Rencontres de l'Immobilier",
+            'ESPI Inside',
+            'Projet Voltaire',
+            'UE SPE – MAGI',
+            "Budget d'Exploitation et de Travaux",
+            'Développement et Stratégie Commerciale',
+            'Technique et Conformité des Immeubles',
+            "Gestion de l'Immobilier - Logistique et Data Center",
+        ],
+    },
+    {
+        "name": "MEFIM_S2",
+        "class_id": "ID_MEFIM_S2_001",
+        "template": "M1_S2_MEFIM_TEMPLATE",
+        "columns": _columns(23),
+        "groups": "RELEVANT_GROUPS",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            "Marketing de l'Immobilier",
+            'Investissement et Financiarisation',
+            'Fiscalité',
+            'UE 2 – Droit',
+            "Droit de l'Urbanisme et de la Construction",
+            "Déontologie en France et à l'International",
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            'Atelier Méthodologie de la Recherche',
+            'Techniques de Négociation',
+            "Rencontres de l'Immobilier",
+            'ESPI Inside',
+            'Projet Voltaire',
+            'UE SPE – MEFIM',
+            "Marché d'Actifs Immobiliers",
+            'Baux Commerciaux',
+            'Évaluation des Actifs Résidentiels',
+            'Audit et Gestion des Immeubles',
+        ],
+    },
+    {
+        "name": "MAPI_S3",
+        "class_id": "ID_MAPI_S3_001",
+        "template": "M2_S3_MAPI_TEMPLATE",
+        "columns": _columns(21),
+        "groups": "RELEVANT_GROUPS_M2",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'PropTech et Innovation',
+            'Économie Immobilière II',
+            'UE 3 – Aménagement & Urbanisme',
+            'Stratégies et Aménagement des Territoires I',
+            'UE 4 – Compétences Professionnalisantes',
+            'Communication Digitale, Ecrite et Orale',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            'Méthodologie de la Recherche',
+            "Rencontres de l'Immobilier",
+            'ESPI Inside',
+            'UE SPE – MAPI',
+            'Acquisition et Dissociation du Foncier',
+            'Montage des Opérations Tertiaires',
+            'Aménagement et Commande Publique',
+            'Techniques du Bâtiment',
+            'Réhabilitation et Pathologies du Bâtiment',
+        ],
+    },
+    {
+        "name": "MAGI_S3",
+        "class_id": "ID_MAGI_S3_001",
+        "template": "M2_S3_MAGI_TEMPLATE",
+        "columns": _columns(20),
+        "groups": "RELEVANT_GROUPS_M2",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'PropTech et Innovation',
+            'Économie Immobilière II',
+            'UE 3 – Aménagement & Urbanisme',
+            'Stratégies et Aménagement des Territoires I',
+            'UE 4 – Compétences Professionnalisantes',
+            'Communication Digitale, Ecrite et Orale',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            'Méthodologie de la Recherche',
+            "Rencontres de l'Immobilier",
+            'ESPI Inside',
+            'UE SPE – MAGI',
+            'Rénovation Energétique des Actifs Tertiaires',
+            'Arbitrage, Optimisation et Valorisation des Actifs Tertiaires',
+            'Maintenance et Facility Management',
+            'Réhabilitation et Pathologies du Bâtiment',
+        ],
+    },
+    {
+        "name": "MEFIM_S3",
+        "class_id": "ID_MEFIM_S3_001",
+        "template": "M2_S3_MEFIM_TEMPLATE",
+        "columns": _columns(20),
+        "groups": "RELEVANT_GROUPS_M2",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'PropTech et Innovation',
+            'Économie Immobilière II',
+            'UE 3 – Aménagement & Urbanisme',
+            'Stratégies et Aménagement des Territoires I',
+            'UE 4 – Compétences Professionnalisantes',
+            'Communication Digitale, Ecrite et Orale',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            'Méthodologie de la Recherche',
+            "Rencontres de l'Immobilier",
+            'ESPI Inside',
+            'UE SPE – MEFIM',
+            'Droit des Suretés et de la Transmission',
+            'Due Diligence',
+            "Évaluation d'Actifs Tertiaires et Industriels",
+            'Gestion de Patrimoine',
+        ],
+    },
+    {
+        "name": "MAPI_S4",
+        "class_id": "ID_MAPI_S4_001",
+        "template": "M2_S4_MAPI_TEMPLATE",
+        "columns": _columns(18),
+        "groups": "RELEVANT_GROUPS_M2",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            "Économie de l'Environnement",
+            'UE 3 – Aménagement & Urbanisme',
+            'Normalisation, Labellisation',
+            'Stratégies et Aménagement des Territoires II',
+            'UE 4 – Compétences Professionnalisantes',
+            'Real Estate English',
+            'Mémoire de Recherche',
+            "Rencontres de l'Immobilier",
+            'ESPI Career Services',
+            'Immersion Professionnelle',
+            'UE SPE – MAPI',
+            'Business Game Aménagement et Promotion Immobilière',
+            'Fiscalité et Promotion Immobilière',
+            "Contentieux de l'Urbanisme",
+        ],
+    },
+    {
+        "name": "MAGI_S4",
+        "class_id": "ID_MAGI_S4_001",
+        "template": "M2_S4_MAGI_TEMPLATE",
+        "columns": _columns(18),
+        "groups": "RELEVANT_GROUPS_M2",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            "Économie de l'Environnement",
+            'UE 3 – Aménagement & Urbanisme',
+            'Normalisation, Labellisation',
+            'Stratégies et Aménagement des Territoires II',
+            'UE 4 – Compétences Professionnalisantes',
+            'Real Estate English',
+            'Mémoire de Recherche',
+            "Rencontres de l'Immobilier",
+            'ESPI Career Services',
+            'Immersion Professionnelle',
+            'UE SPE – MAGI',
+            'Business Game Property Management',
+            'Gestion des Centres Commerciaux',
+            'Gestion de Contentieux et Recouvrement',
+        ],
+    },
+    {
+        "name": "MEFIM_S4",
+        "class_id": "ID_MEFIM_S4_001",
+        "template": "M2_S4_MEFIM_TEMPLATE",
+        "columns": _columns(18),
+        "groups": "RELEVANT_GROUPS_M2",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            "Économie de l'Environnement",
+            'UE 3 – Aménagement & Urbanisme',
+            'Normalisation, Labellisation',
+            'Stratégies et Aménagement des Territoires II',
+            'UE 4 – Compétences Professionnalisantes',
+            'Real Estate English',
+            'Mémoire de Recherche',
+            "Rencontres de l'Immobilier",
+            'ESPI Career Services',
+            'Immersion Professionnelle',
+            'UE SPE – MEFIM',
+            "Business Game Arbitrage et Stratégies d'Investissement",
+            'Fiscalité du Patrimoine',
+            'Fintech et Blockchain',
+        ],
+    },
+    {
+        "name": "BG_ALT_S1",
+        "class_id": "ID_BG_ALT_S1_001",
+        "template": "BG_ALT_1_TEMPLATE",
+        "columns": _columns(21),
+        "groups": "RELEVANT_GROUPS_ALT",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Économie Générale',
+            "Outils d'Analyse Economique",
+            'Organisations, Stratégies et Innovations I',
+            'UE 2 – Droit',
+            'Introduction au Droit',
+            'Droit des Contrats',
+            'UE 3 – Aménagement & Urbanisme',
+            "Introduction aux Méthodes d'Analyse et de Représentation Spatiale",
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            "Panorama de l'Immobilier",
+            'Expression Ecrite et Orale',
+            'Gestion du Travail',
+            'Déontologie et Ethique Professionnelle',
+            'ESPI Career Services',
+            'ESPI Inside',
+        ],
+    },
+    {
+        "name": "BG_ALT_S2",
+        "class_id": "ID_BG_ALT_S2_001",
+        "template": "BG_ALT_2_TEMPLATE",
+        "columns": _columns(22),
+        "groups": "RELEVANT_GROUPS_ALT",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Microéconomie I',
+            'Introduction à la Finance',
+            'Marketing & Prospection',
+            'Mathématiques Financières',
+            'UE 2 – Droit',
+            'Droit des Biens',
+            'Droit de la Copropriété I',
+            "Droit des Baux d'Habitation",
+            'UE 3 – Aménagement & Urbanisme',
+            'Histoire Urbaine et Architecture',
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            "Panorama de l'Immobilier",
+            'Expression Ecrite et Orale',
+            'Gestion de Projet',
+            'ESPI Career Services',
+            'ESPI Inside',
+        ],
+    },
+    {
+        "name": "BG_ALT_S3",
+        "class_id": "ID_BG_ALT_S3_001",
+        "template": "BG_ALT_3_TEMPLATE",
+        "columns": _columns(20),
+        "groups": "RELEVANT_GROUPS_ALT_2",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Microéconomie II',
+            'Organisations, Stratégies et Innovations II',
+            'Pratique de Gestion Locative I',
+            "Enjeux de l'Immobilier et Solutions Digitales I",
+            'Transactions Résidentielles',
+            'UE 2 – Droit',
+            'Droit de la Vente Immobilière',
+            'Droit de la Copropriété II',
+            'UE 3 – Aménagement & Urbanisme',
+            'Technologie du Bâtiment',
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            "Panorama de l'Immobilier",
+            'Expression Ecrite et Orale',
+            'ESPI Inside',
+        ],
+    },
+    {
+        "name": "BG_ALT_S4",
+        "class_id": "ID_BG_ALT_S4_001",
+        "template": "BG_ALT_4_TEMPLATE",
+        "columns": _columns(19),
+        "groups": "RELEVANT_GROUPS_ALT_2",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Marketing Digital & Environnemental',
+            "Enjeux de l'Immobilier et Solutions Digitales II",
+            'Macroéconomie et Politiques Economiques',
+            'UE 2 – Droit',
+            'Droit du Numérique',
+            "Droit de l'Urbanisme",
+            'Fiscalité Générale',
+            'UE 3 – Aménagement & Urbanisme',
+            'Immobilier et Dynamiques Urbaines',
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            "Panorama de l'Immobilier",
+            'Expression Ecrite et Orale',
+            'ESPI Inside',
+        ],
+    },
+    {
+        "name": "BG_ALT_S5",
+        "class_id": "ID_BG_ALT_S5_001",
+        "template": "BG_ALT_5_TEMPLATE",
+        "columns": _columns(21),
+        "groups": "RELEVANT_GROUPS_ALT_3",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Économie Urbaine',
+            'Pratique de Gestion Locative II',
+            'Management de Projet Immobilier',
+            'UE 2 – Droit',
+            'Droit de la Transaction Immobilière',
+            "Droit de l'Environnement",
+            'Fiscalité Immobilière',
+            'UE 3 – Aménagement & Urbanisme',
+            'Habitat et Développement Durable',
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            "Panorama de l'Immobilier",
+            'Expression Ecrite et Orale',
+            'Atelier Urbain I',
+            'Méthodologie de la Recherche',
+            'ESPI Inside',
+        ],
+    },
+    {
+        "name": "BG_ALT_S6",
+        "class_id": "ID_BG_ALT_S6_001",
+        "template": "BG_ALT_6_TEMPLATE",
+        "columns": _columns(19),
+        "groups": "RELEVANT_GROUPS_ALT_3",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Finance Immobilière',
+            'Économie Immobilière',
+            'UE 2 – Droit',
+            'Gestion de la Copropriété',
+            'Droit des Sols et de la Construction',
+            'UE 3 – Aménagement & Urbanisme',
+            'Pathologie du Bâtiment et Suivi de Travaux',
+            'Expertise et Evaluation Immobilière',
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Atelier Urbain II',
+            "Panorama de l'Immobilier",
+            'Mémoire de Recherche',
+            'Real Estate English',
+            'ESPI Inside',
+        ],
+    },
+    {
+        "name": "BG_TP_1",
+        "class_id": "ID_BG_TP_1_001",
+        "template": "BG_TP_1_TEMPLATE",
+        "columns": _columns(29),
+        "groups": "RELEVANT_GROUPS_TP",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Économie Générale',
+            "Outils d'Analyse Economique",
+            'Organisations, Stratégies et Innovations I',
+            'Microéconomie I',
+            'Introduction à la Finance',
+            'Marketing & Prospection',
+            'Mathématiques Financières',
+            'UE 2 – Droit',
+            'Introduction au Droit',
+            'Droit des Contrats',
+            'Droit des Biens',
+            'Droit de la Copropriété I',
+            "Droit des Baux d'Habitation",
+            'UE 3 – Aménagement & Urbanisme',
+            "Introduction aux Méthodes d'Analyse et de Représentation Spatiale",
+            'Histoire Urbaine et Architecture',
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Real Estate English',
+            "Panorama de l'Immobilier",
+            'Expression Ecrite et Orale',
+            'Gestion du Travail',
+            'Déontologie et Ethique Professionnelle',
+            'ESPI Career Services',
+            'Gestion de Projet',
+            'ESPI Inside',
+        ],
+    },
+    {
+        "name": "BG_TP_2",
+        "class_id": "ID_BG_TP_2_001",
+        "template": "BG_TP_2_TEMPLATE",
+        "columns": _columns(6),
+        "groups": "RELEVANT_GROUPS_TP",
+        "header": [
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Real Estate English & TOEFL',
+        ],
+    },
+    {
+        "name": "BG_TP_3",
+        "class_id": "ID_BG_TP_3_001",
+        "template": "BG_TP_3_TEMPLATE",
+        "columns": _columns(22),
+        "groups": "RELEVANT_GROUPS_TP_2",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Microéconomie II',
+            'Organisations, Stratégies et Innovations II',
+            'Pratique de Gestion Locative I',
+            'Transactions Résidentielles',
+            'UE 2 – Droit',
+            'Droit de la Vente Immobilière',
+            'Droit de la Copropriété II',
+            "Droit de l'Urbanisme",
+            'Droit des Baux Commerciaux',
+            "Droit des Baux d'Habitation",
+            'Fiscalité Générale',
+            'UE 3 – Aménagement & Urbanisme',
+            'Technologie du Bâtiment',
+            'Histoire Urbaine et Architecture',
+            'Immobilier et Dynamiques Urbaines',
+            'UE 4 – Compétences Professionnalisantes',
+            'Real Estate English',
+            "Panorama de l'Immobilier",
+            'Expression Ecrite et Orale',
+            'ESPI Inside',
+        ],
+    },
+    {
+        "name": "BG_TP_4",
+        "class_id": "ID_BG_TP_4_001",
+        "template": "BG_TP_4_TEMPLATE",
+        "columns": _columns(5),
+        "groups": "RELEVANT_GROUPS_TP_2",
+        "header": [
+            'UE 4 – Compétences Professionnalisantes',
+            'Mobilité Internationale Études',
+        ],
+    },
+    {
+        "name": "BG_TP_5",
+        "class_id": "ID_BG_TP_5_001",
+        "template": "BG_TP_5_TEMPLATE",
+        "columns": _columns(26),
+        "groups": "RELEVANT_GROUPS_TP_3",
+        "header": [
+            'UE 1 – Economie & Gestion',
+            'Économie Urbaine',
+            'Pratique de Gestion Locative II',
+            'Management de Projet Immobilier',
+            'Finance Immobilière',
+            'UE 2 – Droit',
+            'Droit de la Transaction Immobilière',
+            "Droit de l'Environnement",
+            'Fiscalité Immobilière',
+            'Gestion de la Copropriété',
+            'Droit des Sols et de la Construction',
+            'UE 3 – Aménagement & Urbanisme',
+            'Habitat et Développement Durable',
+            'Pathologie du Bâtiment et Suivi de Travaux',
+            'Expertise et Evaluation Immobiliere',
+            'UE 4 – Compétences Professionnalisantes',
+            'Real Estate English',
+            "Panorama de l'Immobilier",
+            'Expression Ecrite et Orale',
+            'Méthodologie de la Recherche',
+            'ESPI Inside',
+            'Atelier Urbain',
+        ],
+    },
+    {
+        "name": "BG_TP_6",
+        "class_id": "ID_BG_TP_6_001",
+        "template": "BG_TP_6_TEMPLATE",
+        "columns": _columns(8, code_apprenant=7),
+        "groups": "RELEVANT_GROUPS_TP_3",
+        "header": [
+            'UE 4 – Compétences Professionnalisantes',
+            'Immersion Professionnelle',
+            'Mémoire de Recherche',
+            'Real Estate English',
+        ],
+    },
+)
+
+# Registre construit et validé une seule fois (au démarrage de l'application)
+_registry = None
+
+
+class BulletinLayout:
+    """Mise en page d'un bulletin : titres, colonnes de notes, regroupement des ECTS par UE et modèle Word."""
+
+    def __init__(self, key, titles, template_word, excel_files, grade_column_indices, ects_sum_indices, hidden_ects):
+        self.key = key
+        self.titles = titles
+        self.template_word = template_word
+        self.excel_files = excel_files
+        self.grade_column_indices = tuple(grade_column_indices)
+        self.ects_sum_indices = ects_sum_indices
+        self.hidden_ects = tuple(hidden_ects)
+
+    def case_config(self, titles_row):
+        """Configuration attendue par la génération des bulletins, pour la ligne de titres d'un tableau."""
+        start, end = self.titles
+        return {
+            "key": self.key,
+            "titles_row": titles_row[start:end],
+            "template_word": self.template_word,
+            "grade_column_indices": list(self.grade_column_indices),
+            "ects_sum_indices": self.ects_sum_indices,
+            "hidden_ects": self.hidden_ects,
+        }
+
+
+class ClassTemplate:
+    """Classe Yparéo : template Excel de fusion, colonnes, groupes et URLs de récupération des apprenants."""
+
+    def __init__(self, name, class_id, template_path, columns_config, group_setting, header, apprenants_url, groupes_url):
+        self.name = name
+        self.class_id = class_id
+        self.template_path = template_path
+        self.columns_config = columns_config
+        self.group_setting = group_setting
+        self.header = tuple(header)
+        # Signature de l'en-tête (titres normalisés, dans l'ordre) et titres attendus
+        self.signature = tuple(normalize_title(title) for title in header)
+        self.titles = frozenset(self.signature)
+        self.apprenants_url = apprenants_url
+        self.groupes_url = groupes_url
+
+    @property
+    def group_names(self):
+        return getattr(settings, self.group_setting)
+
+
+class ClassDetection:
+    """
+    Classe désignée par l'en-tête d'un export : status vaut 'exact' (signature identique),
+    'partial' (titres reconnus, sans signature exacte), 'ambiguous' ou 'not_found' ;
+    class_template est la classe retenue (None sauf pour 'exact' et 'partial'), score la
+    confiance (0 à 1) et candidates les meilleures classes, sous la forme [(score, nom), ...].
+    """
+
+    def __init__(self, status, class_template=None, score=0.0, candidates=()):
+        self.status = status
+        self.class_template = class_template
+        self.score = score
+        self.candidates = list(candidates)
+
+    def describe_candidates(self):
+        return ", ".join(f"{name} ({score:.2f})" for score, name in self.candidates) or "none"
+
+    def to_dict(self):
+        return {
+            "status": self.status,
+            "class_name": self.class_template.name if self.class_template is not None else None,
+            "score": self.score,
+            "candidates": [{"class_name": name, "score": score} for score, name in self.candidates],
+        }
+
+
+class TemplateRegistry:
+    """
+    Connaissances propres à chaque template, indexées pour des recherches en temps constant :
+    mise en page par nom de fichier Excel, classe par nom et classe par en-tête de l'export de notes
+    (signature exacte, ou titres reconnus par un automate construit une fois pour toutes les classes).
+    """
+
+    def __init__(self, layouts, classes):
+        self.layouts = {}
+        self._by_filename = {}
+        for layout in layouts:
+            if layout.key in self.layouts:
+                raise ValueError(f"Duplicate bulletin layout {layout.key}")
+            self.layouts[layout.key] = layout
+            for filename in layout.excel_files:
+                claimed = self._by_filename.setdefault(filename, layout)
+                if claimed is not layout:
+                    raise ValueError(f"Excel template {filename} is claimed by both {claimed.key} and {layout.key}")
+
+        self.classes = {}
+        # Signatures indexées par longueur : un export désigne la classe dont la signature est le début de ses titres
+        self._by_signature = {}
+        # Classes attendant chaque titre normalisé, et ordre de déclaration (départage des égalités)
+        self._title_classes = {}
+        self._order = {}
+        for class_template in classes:
+            if class_template.name in self.classes:
+                raise ValueError(f"Duplicate class {class_template.name}")
+            if not all(class_template.signature):
+                raise ValueError(f"Class {class_template.name} has an empty header title")
+            if os.path.basename(class_template.template_path) not in self._by_filename:
+                raise ValueError(f"Class {class_template.name}: no bulletin layout for {class_template.template_path}")
+            self._order[class_template.name] = len(self.classes)
+            self.classes[class_template.name] = class_template
+            self._by_signature.setdefault(len(class_template.signature), {})[class_template.signature] = class_template
+            for title in class_template.titles:
+                self._title_classes.setdefault(title, []).append(class_template.name)
+        self._signature_lengths = sorted(self._by_signature)
+        # Formes normalisées des titres déclarés : un en-tête conforme n'est pas renormalisé
+        self._normalized = {title: normalize_title(title)
+                            for class_template in self.classes.values() for title in class_template.header}
+        self._automaton = TitleAutomaton(self._title_classes)
+
+        # Une signature qui serait le début d'une autre rendrait la détection ambiguë
+        for class_template in self.classes.values():
+            other = self._match_signature(class_template.signature)
+            if other is not class_template:
+                raise ValueError(f"Header of class {other.name} is a prefix of the header of {class_template.name}")
+
+    def layout_for_file(self, filename):
+        """Mise en page d'un classeur fusionné, d'après son nom de fichier (None si inconnu)."""
+        return self._by_filename.get(filename)
+
+    def get_class(self, class_name):
+        return self.classes.get(class_name)
+
+    def _match_signature(self, normalized):
+        for length in self._signature_lengths:
+            if length > len(normalized):
+                break
+            class_template = self._by_signature[length].get(tuple(normalized[:length]))
+            if class_template is not None:
+                return class_template
+        return None
+
+    def detect_class(self, uploaded_values, min_score=0.9, margin=0.05):
+        """
+        Détecte la classe d'un export d'après les titres de sa ligne d'en-tête, en un seul parcours.
+
+        La signature normalisée est d'abord cherchée telle quelle (confiance 1). Les titres connus
+        présents dans l'en-tête sont en même temps reconnus par l'automate ; chaque classe est notée
+        par le F1 entre ses titres attendus et les titres reconnus, ce qui fournit les classes
+        suivantes et, à défaut de signature exacte, une détection partielle si la meilleure classe
+        atteint min_score avec au moins margin d'avance.
+        """
+        normalized = [self._normalized.get(value) or normalize_title(value) for value in uploaded_values]
+        exact = self._match_signature(normalized)
+
+        recognized = set()
+        for text in normalized:
+            # Titre exact : simple accès au dictionnaire ; sinon, recherche des titres contenus dans la case
+            if text in self._title_classes:
+                recognized.add(text)
+            else:
+                recognized.update(self._automaton.find(text))
+        shared = Counter()
+        for title in recognized:
+            shared.update(self._title_classes[title])
+        scored = sorted(
+            ((round(2 * count / (len(self.classes[name].titles) + len(recognized)), 3), name) for name, count in shared.items()),
+            key=lambda item: (-item[0], self._order[item[1]]),
+        )
+
+        if exact is not None:
+            runners_up = [candidate for candidate in scored if candidate[1] != exact.name][:2]
+            return ClassDetection('exact', exact, 1.0, [(1.0, exact.name)] + runners_up)
+        candidates = scored[:3]
+        if not scored or scored[0][0] < min_score:
+            return ClassDetection('not_found', score=scored[0][0] if scored else 0.0, candidates=candidates)
+        if len(scored) > 1 and scored[0][0] - scored[1][0] < margin:
+            return ClassDetection('ambiguous', score=scored[0][0], candidates=candidates)
+        return ClassDetection('partial', self.classes[scored[0][1]], scored[0][0], candidates)
+
+    def reference_urls(self, class_name=None):
+        """URLs des données de référence Yparéo (apprenants, groupes, fréquentations, périodes) pour une classe."""
+        defaults = _default_urls()
+        class_template = self.classes.get(class_name) if class_name else None
+        return [
+            (class_template and class_template.apprenants_url) or defaults["apprenants_url"],
+            (class_template and class_template.groupes_url) or defaults["groupes_url"],
+            f"{settings.YPAERO_BASE_URL}/r/v1/apprenants/frequentes?codesPeriode={settings.YPAREO_CODE_PERIODE}",
+            f"{settings.YPAERO_BASE_URL}/r/v1/periodes",
+        ]
+
+    def missing_files(self):
+        paths = {layout.template_word for layout in self.layouts.values()}
+        paths.update(class_template.template_path for class_template in self.classes.values())
+        return sorted(path for path in paths if not os.path.exists(path))
+
+
+def _default_urls():
+    return {
+        "apprenants_url": f"{settings.YPAERO_BASE_URL}/r/v1/formation-longue/apprenants?codesPeriode={settings.YPAREO_CODE_PERIODE}",
+        "groupes_url": f"{settings.YPAERO_BASE_URL}/r/v1/formation-longue/groupes?codesPeriode={settings.YPAREO_CODE_PERIODE}",
+    }
+
+
+def _setting(owner, name):
+    if not hasattr(settings, name):
+        raise ValueError(f"{owner}: unknown setting {name}")
+    return getattr(settings, name)
+
+
+def _check_indices(owner, indices, low, high):
+    if any(not isinstance(index, int) or not low <= index < high for index in indices):
+        raise ValueError(f"{owner}: column indices {list(indices)} out of range [{low}, {high})")
+
+
+def _build_layout(spec):
+    key = spec["key"]
+    start, end = spec["titles"]
+    if not 0 <= start < end:
+        raise ValueError(f"Bulletin layout {key}: invalid titles range {spec['titles']}")
+    grade_column_indices = spec["grade_column_indices"]
+    _check_indices(f"Bulletin layout {key}", grade_column_indices, start, end)
+    if list(grade_column_indices) != sorted(set(grade_column_indices)):
+        raise ValueError(f"Bulletin layout {key}: grade columns must be increasing")
+    excel_files = []
+    for name in spec["excel_templates"]:
+        filename = os.path.basename(_setting(f"Bulletin layout {key}", name))
+        if filename not in excel_files:
+            excel_files.append(filename)
+    return BulletinLayout(key, (start, end), _setting(f"Bulletin layout {key}", spec["template_word"]), excel_files,
+                          grade_column_indices, spec["ects_sum_indices"], spec["hidden_ects"])
+
+
+def _build_class(spec):
+    name = spec["name"]
+    columns_config = spec["columns"]
+    _check_indices(f"Class {name}", columns_config.values(), 1, 16384)
+    template_columns = [index for key, index in columns_config.items() if key.endswith('_template')]
+    if len(set(template_columns)) != len(template_columns):
+        raise ValueError(f"Class {name}: two fields share a template column")
+    _setting(f"Class {name}", spec["groups"])
+    return ClassTemplate(name, spec["class_id"], _setting(f"Class {name}", spec["template"]), columns_config,
+                         spec["groups"], spec["header"], spec.get("apprenants_url"), spec.get("groupes_url"))
+
+
+def load_registry():
+    """Construit et valide le registre (une erreur de déclaration empêche le démarrage) ; le remplace s'il existait."""
+    global _registry
+    registry = TemplateRegistry([_build_layout(spec) for spec in BULLETIN_LAYOUTS],
+                                [_build_class(spec) for spec in CLASS_TEMPLATES])
+    missing = registry.missing_files()
+    if missing:
+        logger.warning(f"Template files not found: {missing}")
+    logger.info(f"Template registry loaded: {len(registry.layouts)} bulletin layouts, {len(registry.classes)} classes")
+    _registry = registry
+    return registry
+
+
+def get_registry():
+    return _registry if _registry is not None else load_registry()
+
+
+def registry_stats():
+    registry = get_registry()
+    return {
+        "layouts": {key: {"excel_files": layout.excel_files, "template_word": layout.template_word}
+                    for key, layout in registry.layouts.items()},
+        "classes": {name: {"class_id": class_template.class_id, "template": class_template.template_path,
+                           "groups": class_template.group_setting, "header_length": len(class_template.header)}
+                    for name, class_template in registry.classes.items()},
+        "missing_files": registry.missing_files(),
+    }
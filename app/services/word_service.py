@@ -742,28 +742,19 @@ def set_hidden_text(paragraph):
         vanishing = OxmlElement('w:vanish')
         rPr.append(vanishing)
 
-def generate_word_document(student_data, case_config, template_path, output_dir):
-    ects_config = read_ects_config()
-    current_date = datetime.now().strftime("%d/%m/%Y")
-    group_name = student_data["Nom Groupe"]
-    is_relevant_group = group_name in settings.RELEVANT_GROUPS
-    logger.debug("Processing document for group: %s", group_name)
-
-    # Corriger la clé du cas si nécessaire
+def ects_data_for(case_config):
+    """ECTS de la maquette du cas, lus dans ECTS_JSON_PATH (clé du cas, avec des tirets)."""
     corrected_key = case_config["key"].replace("_", "-")
-
-    ects_data_key = corrected_key
-    if corrected_key == "M2_S3_MAGI_MEFIM":
-        if "MAGI" in student_data["Nom Groupe"]:
-            ects_data_key = "M2-S3-MAGI"
-        elif "MEFIM" in student_data["Nom Groupe"]:
-            ects_data_key = "M2-S3-MEFIM"
-
-    ects_data = ects_config.get(ects_data_key, [{}])[0]
+    ects_data = read_ects_config().get(corrected_key, [{}])[0]
     logger.debug(f"ECTS data for {corrected_key}: {ects_data}")
+    return ects_data
 
-    placeholders = generate_placeholders(case_config["titles_row"], case_config, student_data, current_date, ects_data)
 
+def compute_student_grades(placeholders, student_data, case_config, ects_data):
+    """
+    Notes, états et ECTS d'un apprenant, ajoutés à placeholders (rempli par generate_placeholders).
+    Calcul de référence, un apprenant à la fois ; compute_class_grades le reproduit pour toute la classe.
+    """
     # New logic for M1-S1
     if case_config["key"] == "M1_S1":
         process_ue_notes(placeholders, "UE1", [1, 2, 3], case_config["grade_column_indices"], student_data, case_config)
@@ -1570,7 +1561,24 @@ def generate_word_document(student_data, case_config, template_path, output_dir)
 
     # Calcul de la moyenne générale arrondie au centième près
     placeholders["moyenne"] = f"{math.ceil(total_ue_notes / total_ue_ects * 100) / 100:.2f}" if total_ue_ects else 0
-    
+
+
+def generate_word_document(student_data, case_config, template_path, output_dir, grades=None):
+    """
+    Bulletin d'un apprenant. grades : ses notes, états et ECTS déjà calculés pour toute
+    la classe (compute_class_grades) ; à défaut, ils sont calculés ici.
+    """
+    ects_data = ects_data_for(case_config)
+    current_date = datetime.now().strftime("%d/%m/%Y")
+    group_name = student_data["Nom Groupe"]
+    is_relevant_group = group_name in settings.RELEVANT_GROUPS
+    logger.debug("Processing document for group: %s", group_name)
+
+    placeholders = generate_placeholders(case_config["titles_row"], case_config, student_data, current_date, ects_data)
+    if grades is None:
+        compute_student_grades(placeholders, student_data, case_config, ects_data)
+    else:
+        placeholders.update(grades)
 
     # Supprimer les placeholders pour les ECTS masqués du document final
     for hidden_ects in case_config["hidden_ects"]:
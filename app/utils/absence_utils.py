@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from app.utils.date_utils import format_minutes_to_duration
+
+# Colonnes des totaux, dans l'ordre du tableau retourné par aggregate_absences
+ABSENCE_KINDS = ('justified', 'unjustified', 'delays')
+JUSTIFIED, UNJUSTIFIED, DELAYS = range(3)
+
+
+def absence_columns(absences_data):
+    """
+    Charge un payload d'absences Yparéo en colonnes typées : positions des apprenants
+    (avec la table des codes correspondants), durées, indicateurs justifiée et retard.
+    """
+    records = [absence for absence in absences_data.values() if isinstance(absence, dict)]
+    count = len(records)
+
+    # Une passe par colonne : plus rapide qu'une liste de tuples transposée
+    positions, learner_codes = pd.factorize(
+        np.array([str(absence.get('codeApprenant')) for absence in records], dtype=object))
+    try:
+        durations = np.fromiter((absence.get('duree', 0) for absence in records), dtype=np.int64, count=count)
+    except (TypeError, ValueError):
+        # Durées reçues en texte : conversion explicite, comme l'ancienne boucle
+        durations = np.array([int(absence.get('duree', 0)) for absence in records], dtype=np.int64)
+    justified = np.fromiter((bool(absence.get('isJustifie')) for absence in records), dtype=bool, count=count)
+    late = np.fromiter((bool(absence.get('isRetard')) for absence in records), dtype=bool, count=count)
+    return positions, list(learner_codes), durations, justified, late
+
+
+def aggregate_absences(absences_data):
+    """
+    Agrège les absences par apprenant en un seul group-by.
+
+    Retourne (codes apprenants, totaux) où totaux est un tableau (n, 3) de minutes
+    dans l'ordre de ABSENCE_KINDS : une absence justifiée compte en 'justified',
+    sinon un retard en 'delays', sinon en 'unjustified'.
+    """
+    positions, learner_codes, durations, justified, late = absence_columns(absences_data)
+    kinds = np.where(justified, JUSTIFIED, np.where(late, DELAYS, UNJUSTIFIED))
+
+    # Une case par (apprenant, type) : bincount fait la somme en une passe
+    totals = np.bincount(positions * len(ABSENCE_KINDS) + kinds, weights=durations,
+                         minlength=len(learner_codes) * len(ABSENCE_KINDS))
+    return learner_codes, totals.astype(np.int64).reshape(-1, len(ABSENCE_KINDS))
+
+
+def format_absence_totals(learner_codes, totals):
+    """
+    Met en forme les totaux (minutes) comme dans les bulletins : {code: {'justified': '1h30', ...}}.
+    Chaque valeur distincte n'est formatée qu'une fois.
+    """
+    values, inverse = np.unique(totals, return_inverse=True)
+    labels = np.array([format_minutes_to_duration(int(value)) for value in values], dtype=object)
+    formatted = labels[inverse.reshape(totals.shape)]
+    return {
+        code: dict(zip(ABSENCE_KINDS, row))
+        for code, row in zip(learner_codes, formatted.tolist())
+    }
+
+
+def summarize_absences(absences_data):
+    """Totaux d'absences par apprenant, déjà formatés, à partir d'un payload Yparéo."""
+    return format_absence_totals(*aggregate_absences(absences_data))
@@ -0,0 +1,68 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%d/%m/%Y'
+NAT = np.datetime64('NaT', 'ns')
+
+
+def _parse_dates(values):
+    """
+    Convertit une liste de dates jj/mm/aaaa en Series datetime (NaT si absente ou invalide).
+    Les dates se répètent beaucoup : chaque valeur distincte n'est convertie qu'une fois.
+    """
+    # Seules les chaînes non vides sont des dates candidates (comme strptime, qui refuse le reste)
+    values = pd.Series([value if isinstance(value, str) and value else None for value in values], dtype=object)
+    positions, uniques = pd.factorize(values)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format=DATE_FORMAT, errors='coerce').to_numpy()
+    # Les valeurs absentes ont la position -1 : elles pointent sur le NaT ajouté en fin de tableau
+    return pd.Series(np.append(parsed, NAT)[positions])
+
+
+# Sélectionne, pour chaque apprenant, la fréquentation la plus récente qui chevauche la période
+def select_frequentations(frequentes_data, periode):
+    """
+    Retourne {codeApprenant (str): fréquentation} en ne gardant que les fréquentations
+    qui chevauchent la période, et pour chaque apprenant celle dont la date de début
+    est la plus tardive (la première rencontrée en cas d'égalité).
+
+    Les dates sont converties en une seule passe vectorisée ; les enregistrements
+    sans dates exploitables sont ignorés.
+    """
+    if not periode:
+        return {}
+
+    periode_debut_str = periode.get('dateDeb')
+    periode_fin_str = periode.get('dateFin')
+    if not periode_debut_str or not periode_fin_str:
+        logger.warning(f"Missing period dates in periode {periode.get('codePeriode')}")
+        return {}
+    try:
+        periode_debut = pd.to_datetime(periode_debut_str, format=DATE_FORMAT)
+        periode_fin = pd.to_datetime(periode_fin_str, format=DATE_FORMAT)
+    except (ValueError, TypeError) as e:
+        logger.error(f"Invalid period dates {periode_debut_str} - {periode_fin_str}: {str(e)}")
+        return {}
+
+    records = [frequentation for frequentation in frequentes_data.values() if isinstance(frequentation, dict)]
+    if not records:
+        return {}
+
+    codes = [str(frequentation.get('codeApprenant')) for frequentation in records]
+    debut = _parse_dates([frequentation.get('dateDeb') for frequentation in records])
+    fin = _parse_dates([frequentation.get('dateFin') for frequentation in records])
+
+    parsed = debut.notna() & fin.notna()
+    skipped = int((~parsed).sum())
+    if skipped:
+        logger.warning(f"Ignored {skipped} frequentations with missing or invalid dates")
+
+    overlapping = parsed & (debut <= periode_fin) & (fin >= periode_debut)
+    selected = pd.DataFrame({'code': codes, 'debut': debut})[overlapping]
+
+    # idxmax garde la première occurrence du maximum : même départage que l'ancienne boucle
+    latest = selected.groupby('code', sort=False)['debut'].idxmax()
+    return {code: records[index] for code, index in latest.items()}
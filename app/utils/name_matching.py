@@ -0,0 +1,194 @@
+import re
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+
+from app.utils.sheet_utils import normalize_title
+
+NGRAM = 3
+# Nombre minimal de n-grammes (les plus rares) toujours utilisés pour le blocage
+MIN_BLOCKING_NGRAMS = 3
+
+# Index de trigrammes déjà construits, par liste ordonnée de (nom, prénom) : chaque job reçoit une
+# copie des apprenants, mais tant que les noms sont les mêmes l'index est partagé
+_fuzzy_indexes = {}
+MAX_FUZZY_INDEXES = 8
+# Longueur minimale des prénoms comparés pour tolérer une faute de frappe : en dessous,
+# une lettre d'écart est plus souvent un autre prénom (« Léa » / « Léo ») qu'une faute
+TYPO_MIN_LENGTH = 6
+
+
+def name_tokens(name):
+    """Mots d'un nom, sans accents, casse ni ponctuation : "LE GALL Anaïs" -> ['le', 'gall', 'anais']."""
+    name = unicodedata.normalize('NFD', str(name)).encode('ascii', 'ignore').decode('ascii').lower()
+    return re.findall(r'[a-z0-9]+', name)
+
+
+def _ngrams(text):
+    padded = f" {text} "
+    return {padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)}
+
+
+def _ratio(a, b):
+    return SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def _edit_distance(a, b):
+    """Distance de Damerau-Levenshtein restreinte : insertion, suppression, substitution, inversion de deux lettres."""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[len(b)]
+
+
+class NameMatch:
+    """
+    Résultat d'une recherche : status vaut 'exact', 'fuzzy', 'suggested', 'ambiguous', 'conflict'
+    ou 'not_found' ; record est l'apprenant retenu (None sauf pour 'exact' et 'fuzzy') et candidates
+    les meilleurs candidats évalués, sous la forme [(score, apprenant), ...].
+
+    'fuzzy' n'est retenu que pour une simple variante d'écriture (même nom de famille, prénom à au plus
+    max_typo_edits fautes de frappe, score au moins auto_threshold) ; un candidat proche mais différent
+    (« MARTIN Léa » pour « MARTIN Léo ») est 'suggested' : signalé pour confirmation, jamais reporté.
+    """
+
+    def __init__(self, status, record=None, score=0.0, candidates=()):
+        self.status = status
+        self.record = record
+        self.score = score
+        self.candidates = list(candidates)
+
+
+class NameIndex:
+    """
+    Index des apprenants Yparéo par nom.
+
+    La recherche exacte (normalize_title(nom + prénom)) est un simple accès au dictionnaire.
+    À défaut, les candidats sont présélectionnés par les trigrammes qu'ils partagent avec le nom
+    cherché (index inversé), puis seuls ces quelques candidats sont comparés : le coût reste
+    proportionnel au nombre d'apprenants, pas à son carré. L'index de trigrammes n'est construit
+    qu'au premier nom non trouvé à l'identique.
+    """
+
+    def __init__(self, records, threshold=0.85, margin=0.05, max_candidates=20, auto_threshold=0.9, max_typo_edits=1):
+        self.threshold = threshold
+        self.auto_threshold = auto_threshold
+        self.max_typo_edits = max_typo_edits
+        self.margin = margin
+        self.max_candidates = max_candidates
+        self._records = [record for record in records if isinstance(record, dict)]
+        # Comme l'ancien dictionnaire : à nom égal, le dernier apprenant l'emporte
+        self._exact = {}
+        for record in self._records:
+            self._exact[normalize_title(self._full_name(record))] = record
+        self._forms = None
+        self._postings = None
+
+    @staticmethod
+    def _full_name(record):
+        return f"{record.get('nomApprenant') or ''}{record.get('prenomApprenant') or ''}"
+
+    def _build_fuzzy_index(self):
+        names = tuple((record.get('nomApprenant') or '', record.get('prenomApprenant') or '') for record in self._records)
+        cached = _fuzzy_indexes.get(names)
+        if cached is not None:
+            self._forms, self._postings = cached
+            return
+
+        forms, postings = [], {}
+        for position, (last_name, first_name) in enumerate(names):
+            last_name, first_name = name_tokens(last_name), name_tokens(first_name)
+            tokens = last_name + first_name
+            # Formes comparées : mots triés, et nom collé dans les deux ordres (noms composés, prénom en premier)
+            sorted_key = ' '.join(sorted(tokens))
+            forms.append((sorted_key, ''.join(tokens), ''.join(first_name + last_name)))
+            for gram in _ngrams(sorted_key):
+                postings.setdefault(gram, []).append(position)
+
+        if len(_fuzzy_indexes) >= MAX_FUZZY_INDEXES:
+            _fuzzy_indexes.pop(next(iter(_fuzzy_indexes)))
+        _fuzzy_indexes[names] = (forms, postings)
+        self._forms, self._postings = forms, postings
+
+    def _score(self, sorted_key, compact, position):
+        candidate_key, forward, reverse = self._forms[position]
+        return max(_ratio(sorted_key, candidate_key), _ratio(compact, forward), _ratio(compact, reverse))
+
+    def _is_spelling_variant(self, tokens, record):
+        # Tous les mots du nom de famille présents tels quels ; le reste ne diffère du prénom
+        # que par l'ordre des mots ou quelques fautes de frappe, sur un prénom assez long
+        last_name = name_tokens(record.get('nomApprenant') or '')
+        first_name = name_tokens(record.get('prenomApprenant') or '')
+        remaining = Counter(tokens)
+        remaining.subtract(last_name)
+        if not last_name or not first_name or any(count < 0 for count in remaining.values()):
+            return False
+        rest = []
+        for token in tokens:
+            if remaining[token] > 0:
+                rest.append(token)
+                remaining[token] -= 1
+        distance = min(_edit_distance(''.join(rest), ''.join(first_name)),
+                       _edit_distance(''.join(sorted(rest)), ''.join(sorted(first_name))))
+        if distance == 0:
+            return True
+        shortest = min(len(''.join(rest)), len(''.join(first_name)))
+        return distance <= self.max_typo_edits and shortest >= TYPO_MIN_LENGTH
+
+    def match(self, name):
+        record = self._exact.get(normalize_title(name))
+        if record is not None:
+            return NameMatch('exact', record, 1.0)
+
+        tokens = name_tokens(name)
+        if not tokens or not self._records:
+            return NameMatch('not_found')
+        if self._postings is None:
+            self._build_fuzzy_index()
+
+        sorted_key = ' '.join(sorted(tokens))
+        compact = ''.join(tokens)
+
+        # Blocage : les trigrammes les plus rares d'abord ; les plus fréquents (« ine », « ar »...)
+        # sont ignorés une fois les plus rares pris en compte, pour ne pas parcourir tout l'index
+        postings = sorted((self._postings[gram] for gram in _ngrams(sorted_key) if gram in self._postings), key=len)
+        max_posting = max(self.max_candidates * 10, len(self._records) // 20)
+        shared = Counter()
+        for rank, posting in enumerate(postings):
+            if rank >= MIN_BLOCKING_NGRAMS and len(posting) > max_posting:
+                break
+            shared.update(posting)
+
+        scored = sorted(
+            ((self._score(sorted_key, compact, position), position) for position, _ in shared.most_common(self.max_candidates)),
+            reverse=True,
+        )
+        candidates = [(round(score, 3), self._records[position]) for score, position in scored[:3]]
+        if not scored or scored[0][0] < self.threshold:
+            return NameMatch('not_found', score=scored[0][0] if scored else 0.0, candidates=candidates)
+
+        best_score, best_position = scored[0]
+        if len(scored) > 1 and best_score - scored[1][0] < self.margin:
+            return NameMatch('ambiguous', score=best_score, candidates=candidates)
+        record = self._records[best_position]
+        if best_score < self.auto_threshold or not self._is_spelling_variant(tokens, record):
+            return NameMatch('suggested', score=best_score, candidates=candidates)
+        return NameMatch('fuzzy', record, best_score, candidates)
+
+    def match_all(self, names):
+        """
+        Rapproche une liste de noms (les lignes d'un même export). Un apprenant retenu de façon
+        approchée mais déjà rapproché par une autre ligne (à l'identique, ou approchée elle aussi)
+        n'est attribué à aucune des deux : la ligne approchée passe en 'conflict'.
+        """
+        matches = [self.match(name) for name in names]
+        exact_claims = Counter(id(match.record) for match in matches if match.status == 'exact')
+        fuzzy_claims = Counter(id(match.record) for match in matches if match.status == 'fuzzy')
+        for match in matches:
+            if match.status == 'fuzzy' and (exact_claims[id(match.record)] or fuzzy_claims[id(match.record)] > 1):
+                match.status, match.record = 'conflict', None
+        return matches
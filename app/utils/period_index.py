@@ -0,0 +1,111 @@
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%d/%m/%Y'
+
+
+def _parse_date(value):
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value[:10], DATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+class PeriodIndex:
+    """
+    Index des périodes Yparéo, triées par date de début réelle (et non par chaîne jj/mm/aaaa).
+    Les recherches par date se font par dichotomie.
+    """
+
+    def __init__(self, periodes_dict):
+        entries = []
+        for periode in periodes_dict.values():
+            if not isinstance(periode, dict):
+                continue
+            start = _parse_date(periode.get('dateDeb'))
+            if start is None:
+                logger.warning(f"Missing or invalid 'dateDeb' in periode: {periode}")
+                continue
+            entries.append((start, _parse_date(periode.get('dateFin')), periode))
+
+        # Tri stable : à date de début égale, l'ordre de l'API est conservé
+        entries.sort(key=lambda entry: entry[0])
+        self._starts = [start for start, _, _ in entries]
+        self._ends = [end for _, end, _ in entries]
+        # Plus grande date de fin parmi les périodes commencées jusqu'à chaque position (sans fin : date.max) :
+        # les périodes peuvent se chevaucher, la recherche remonte tant qu'une période antérieure peut encore durer
+        self._max_ends = []
+        for end in self._ends:
+            self._max_ends.append(max(end or date.max, self._max_ends[-1] if self._max_ends else date.min))
+        self._periodes = [periode for _, _, periode in entries]
+        self._positions = {id(periode): position for position, periode in enumerate(self._periodes)}
+        self._by_code = {}
+        for periode in self._periodes:
+            self._by_code.setdefault(str(periode.get('codePeriode')), periode)
+
+    def __len__(self):
+        return len(self._periodes)
+
+    def by_code(self, code_periode):
+        return self._by_code.get(str(code_periode))
+
+    def latest_started(self, day):
+        """Dernière période commencée au plus tard à la date donnée (ou None)."""
+        position = bisect_right(self._starts, day) - 1
+        return self._periodes[position] if position >= 0 else None
+
+    def containing(self, day):
+        """
+        Période dont l'intervalle [dateDeb, dateFin] contient la date (ou None). Si plusieurs
+        périodes se chevauchent, la dernière commencée l'emporte.
+        """
+        position = bisect_right(self._starts, day) - 1
+        while position >= 0 and day <= self._max_ends[position]:
+            end = self._ends[position]
+            if end is None or day <= end:
+                return self._periodes[position]
+            position -= 1
+        return None
+
+    def current(self, today=None):
+        """
+        Période en cours : celle qui contient la date du jour, sinon la dernière
+        commencée, sinon (toutes les périodes sont à venir) la première.
+        """
+        if not self._periodes:
+            return None
+        today = today or date.today()
+        return self.containing(today) or self.latest_started(today) or self._periodes[0]
+
+    def previous(self, periode):
+        """Période qui précède celle donnée dans l'ordre des dates de début (ou None)."""
+        position = self._positions.get(id(periode))
+        if position is None:
+            return None
+        # Dernière période commençant strictement avant celle-ci
+        position = bisect_left(self._starts, self._starts[position]) - 1
+        return self._periodes[position] if position >= 0 else None
+
+
+# Index déjà construits, par table de périodes : les périodes en cache (ou dans l'instantané)
+# étant le même objet d'un job à l'autre, l'index n'est construit qu'une fois par version
+_indexes = {}
+MAX_INDEXES = 8
+
+
+def period_index_for(periodes_dict):
+    """Retourne l'index de la table de périodes, en le construisant à la première demande."""
+    entry = _indexes.get(id(periodes_dict))
+    # La table est gardée avec l'index : son id ne peut pas être réattribué tant qu'elle est en cache
+    if entry is not None and entry[0] is periodes_dict:
+        return entry[1]
+    if len(_indexes) >= MAX_INDEXES:
+        _indexes.pop(next(iter(_indexes)))
+    index = PeriodIndex(periodes_dict)
+    _indexes[id(periodes_dict)] = (periodes_dict, index)
+    return index
@@ -0,0 +1,239 @@
+import datetime
+import math
+import re
+from copy import copy
+from io import BytesIO
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles.numbers import is_date_format
+from openpyxl.utils import column_index_from_string
+from openpyxl.compat.numbers import NUMERIC_TYPES
+from openpyxl.utils.datetime import from_excel, to_excel
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+from openpyxl.worksheet.dimensions import ColumnDimension, RowDimension
+
+
+DATE_TYPES = (datetime.date, datetime.time, datetime.timedelta)
+
+
+def stored_value(value, date_format=True):
+    """
+    Valeur relue (data_only) d'une case enregistrée par openpyxl : nombres écrits avec 16 chiffres
+    significatifs (NaN et infinis omis), formules sans résultat, dates converties en nombre de jours
+    puis relues à la milliseconde, ou laissées en nombre si la case n'a pas de format de date.
+    """
+    if isinstance(value, str):
+        value = value[:32767]
+        return None if len(value) > 1 and value.startswith("=") else value
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, NUMERIC_TYPES):
+        return None if math.isnan(value) or math.isinf(value) else float("%.16g" % value)
+    if isinstance(value, DATE_TYPES):
+        serial = float("%.16g" % to_excel(value))
+        return from_excel(serial, timedelta=isinstance(value, datetime.timedelta)) if date_format else serial
+    return value
+
+
+# Fonction pour normaliser les titres en supprimant les caractères non alphanumériques et en les mettant en minuscules
+def normalize_title(title):
+    if not isinstance(title, str):
+        title = str(title)
+    return re.sub(r'\W+', '', title).lower()
+
+
+class SheetBuffer:
+    """
+    Valeurs d'une feuille Excel lues en une seule passe (iter_rows, values_only).
+    Les lignes et colonnes sont numérotées à partir de 1, comme dans openpyxl ;
+    une case hors de la feuille vaut None.
+    """
+
+    def __init__(self, worksheet):
+        if isinstance(worksheet, ReadOnlyWorksheet):
+            # Les dimensions déclarées par certains exports sont fausses : on lit ce que contient la feuille
+            worksheet.reset_dimensions()
+        self.rows = [tuple(row) for row in worksheet.iter_rows(values_only=True)]
+        self.max_row = len(self.rows)
+        self.max_column = max((len(row) for row in self.rows), default=0)
+
+    def row(self, row):
+        """Valeurs de la ligne, complétées par None jusqu'à max_column."""
+        values = self.rows[row - 1] if 1 <= row <= self.max_row else ()
+        return values + (None,) * (self.max_column - len(values))
+
+    def value(self, row, column):
+        if 1 <= row <= self.max_row:
+            values = self.rows[row - 1]
+            if 1 <= column <= len(values):
+                return values[column - 1]
+        return None
+
+    def cell_value(self, coordinate):
+        """Valeur d'une case désignée par sa référence (ex. 'C4')."""
+        letters = coordinate.rstrip('0123456789')
+        return self.value(int(coordinate[len(letters):]), column_index_from_string(letters))
+
+
+def read_sheet(path):
+    """Lit la feuille active d'un classeur en mode lecture seule, sans charger son modèle objet."""
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return SheetBuffer(workbook.active)
+    finally:
+        workbook.close()
+
+
+class ParsedTemplate:
+    """
+    Template Excel analysé une fois : cellules (avec leurs styles) et valeurs de la feuille
+    active, titres normalisés -> colonne par ligne d'en-tête, et mise en forme de la feuille
+    (largeurs de colonnes, hauteurs de lignes, cellules fusionnées, mises en forme conditionnelles).
+    Le contenu binaire du fichier n'est pas conservé : les feuilles produites repartent des
+    éléments analysés (OutputSheet).
+    """
+
+    def __init__(self, image):
+        workbook = load_workbook(BytesIO(image), read_only=True, data_only=True)
+        try:
+            worksheet = workbook.active
+            worksheet.reset_dimensions()
+            self.title = worksheet.title
+            # Les cellules en lecture seule restent lisibles (valeur et style) après fermeture
+            self.cells = tuple(tuple(row) for row in worksheet.iter_rows())
+        finally:
+            workbook.close()
+        self.rows = tuple(tuple(cell.value for cell in row) for row in self.cells)
+        self._title_columns = {}
+        self._read_layout(image)
+
+    def _read_layout(self, image):
+        # La lecture seule ne donne ni les dimensions ni les mises en forme conditionnelles :
+        # un chargement complet, une seule fois au remplissage du cache de templates
+        workbook = load_workbook(BytesIO(image))
+        try:
+            worksheet = workbook.active
+            self.column_dimensions = tuple(
+                (key, {"width": dimension.width, "customWidth": dimension.customWidth, "hidden": dimension.hidden,
+                       "bestFit": dimension.bestFit, "outlineLevel": dimension.outlineLevel,
+                       "min": dimension.min, "max": dimension.max})
+                for key, dimension in worksheet.column_dimensions.items()
+                if dimension.customWidth or dimension.hidden or dimension.outlineLevel
+            )
+            self.row_heights = tuple(
+                (index, dimension.height) for index, dimension in worksheet.row_dimensions.items()
+                if dimension.height is not None
+            )
+            self.merged_ranges = tuple(str(merged) for merged in worksheet.merged_cells.ranges)
+            self.conditional_formats = tuple(
+                (str(conditional.sqref), tuple(conditional.rules)) for conditional in worksheet.conditional_formatting
+            )
+        finally:
+            workbook.close()
+
+    def title_columns(self, header_row):
+        """{titre normalisé: colonne} pour la ligne d'en-tête donnée."""
+        if header_row not in self._title_columns:
+            values = self.rows[header_row - 1] if 1 <= header_row <= len(self.rows) else ()
+            self._title_columns[header_row] = {
+                normalize_title(value): col
+                for col, value in enumerate(values, start=1)
+                if value is not None
+            }
+        return self._title_columns[header_row]
+
+
+class OutputSheet:
+    """
+    Feuille produite à partir d'un template : les lignes du template (avec leurs styles)
+    puis les valeurs écrites en mémoire, enregistrées par un classeur en écriture seule.
+    Seules les valeurs sont copiées depuis le template analysé ; ses cellules sont partagées.
+    """
+
+    def __init__(self, template):
+        self.title = template.title
+        self._template = template
+        self._template_cells = template.cells
+        self.rows = [list(row) for row in template.rows]
+
+    @property
+    def max_row(self):
+        return len(self.rows)
+
+    @property
+    def max_column(self):
+        return max((len(row) for row in self.rows), default=0)
+
+    def value(self, row, column):
+        if 1 <= row <= len(self.rows):
+            values = self.rows[row - 1]
+            if 1 <= column <= len(values):
+                return values[column - 1]
+        return None
+
+    def set(self, row, column, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        values = self.rows[row - 1]
+        if len(values) < column:
+            values.extend([None] * (column - len(values)))
+        values[column - 1] = value
+
+    def stored_rows(self):
+        """
+        Valeurs telles que les relirait un lecteur du fichier écrit par save(), sans l'écrire.
+        Une date placée dans une case stylée du template prend le format de la case :
+        ce n'est plus qu'un nombre si ce format n'est pas un format de date.
+        """
+        rows = []
+        for index, values in enumerate(self.rows):
+            template_cells = self._template_cells[index] if index < len(self._template_cells) else ()
+            row = []
+            for column, value in enumerate(values):
+                date_format = True
+                if isinstance(value, DATE_TYPES) and column < len(template_cells):
+                    source = template_cells[column]
+                    date_format = not getattr(source, 'has_style', False) or is_date_format(source.number_format)
+                row.append(stored_value(value, date_format))
+            rows.append(row)
+        return rows
+
+    def _styled_row(self, worksheet, values, template_cells):
+        cells = []
+        for column, value in enumerate(values):
+            source = template_cells[column] if column < len(template_cells) else None
+            if not getattr(source, 'has_style', False):
+                cells.append(value)
+                continue
+            cell = WriteOnlyCell(worksheet, value=value)
+            cell.font, cell.fill, cell.border = copy(source.font), copy(source.fill), copy(source.border)
+            cell.alignment, cell.protection = copy(source.alignment), copy(source.protection)
+            cell.number_format = source.number_format
+            cells.append(cell)
+        return cells
+
+    def save(self, path):
+        """
+        Écrit la feuille en flux : les lignes sont sérialisées au fur et à mesure, avec la mise
+        en forme de la feuille du template (à fixer avant la première ligne pour les colonnes).
+        """
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet(self.title)
+        template = self._template
+        for key, attributes in template.column_dimensions:
+            worksheet.column_dimensions[key] = ColumnDimension(worksheet, index=key, **attributes)
+        for index, height in template.row_heights:
+            worksheet.row_dimensions[index] = RowDimension(worksheet, index=index, ht=height)
+        for merged in template.merged_ranges:
+            worksheet.merged_cells.add(merged)
+        for sqref, rules in template.conditional_formats:
+            for rule in rules:
+                # Copie : l'écriture renseigne dxfId selon les styles du classeur produit
+                worksheet.conditional_formatting.add(sqref, copy(rule))
+        for index, values in enumerate(self.rows):
+            if index < len(self._template_cells):
+                worksheet.append(self._styled_row(worksheet, values, self._template_cells[index]))
+            else:
+                worksheet.append(values)
+        workbook.save(path)
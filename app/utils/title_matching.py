@@ -0,0 +1,69 @@
+from app.utils.sheet_utils import normalize_title
+
+
+class TitleAutomaton:
+    """
+    Automate d'Aho-Corasick sur des titres de matières normalisés (normalize_title).
+
+    Tous les titres connus sont recherchés en un seul parcours de chaque case de l'en-tête,
+    quel que soit leur nombre ; un titre est reconnu même entouré d'autre texte
+    (coefficient, mention ajoutée par Yparéo...).
+    """
+
+    def __init__(self, titles):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for title in titles:
+            self._add(normalize_title(title))
+        self._link()
+
+    def _add(self, title):
+        if not title:
+            return
+        state = 0
+        for char in title:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = following
+        if title not in self._output[state]:
+            self._output[state] = self._output[state] + (title,)
+
+    def _link(self):
+        # Liens d'échec en largeur : chaque état hérite des titres reconnus par son plus long suffixe
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, following in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(char, 0)
+                self._output[following] = self._output[following] + self._output[self._fail[following]]
+                queue.append(following)
+
+    def find(self, text):
+        """
+        Titres présents dans text (déjà normalisé). Les occurrences qui se chevauchent sont départagées
+        par la position puis la longueur : « Microéconomie II » ne reconnaît pas aussi « Microéconomie I ».
+        """
+        matches = []
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for title in self._output[state]:
+                matches.append((end - len(title), -end, title))
+
+        found = []
+        covered = 0
+        for start, negative_end, title in sorted(matches):
+            if start >= covered:
+                found.append(title)
+                covered = -negative_end
+        return found
@@ -0,0 +1,80 @@
+"""
+Microbenchmark de l'agrégation des absences par apprenant.
+
+Compare l'ancienne boucle de process_file (listes de durées par apprenant puis
+sum_durations à l'écriture de chaque ligne) au moteur en colonnes de
+app/utils/absence_utils.py, après avoir vérifié que les totaux formatés sont identiques.
+La dernière colonne mesure un job suivant sur le même payload en cache (totaux partagés) :
+
+    python -m benchmarks.bench_absences
+"""
+import random
+import time
+
+from app.services import absence_store
+from app.utils.absence_utils import summarize_absences
+from app.utils.date_utils import sum_durations
+
+
+def legacy_summarize_absences(absences_data):
+    """Ancienne implémentation, conservée ici comme référence."""
+    absences_summary = {}
+    for absence in absences_data.values():
+        apprenant_id = str(absence.get('codeApprenant'))
+        if not apprenant_id:
+            continue
+        duration = int(absence.get('duree', 0))
+        if apprenant_id not in absences_summary:
+            absences_summary[apprenant_id] = {'justified': [], 'unjustified': [], 'delays': []}
+        if absence.get('isJustifie'):
+            absences_summary[apprenant_id]['justified'].append(duration)
+        elif absence.get('isRetard'):
+            absences_summary[apprenant_id]['delays'].append(duration)
+        else:
+            absences_summary[apprenant_id]['unjustified'].append(duration)
+
+    # Formatage fait ligne par ligne dans process_file
+    return {
+        apprenant_id: {kind: sum_durations(durations) or "00h00" for kind, durations in summary.items()}
+        for apprenant_id, summary in absences_summary.items()
+    }
+
+
+def make_absences(count, learners, seed=0):
+    rng = random.Random(seed)
+    return {
+        str(index): {
+            'codeAbsence': index,
+            'codeApprenant': 50000 + rng.randrange(learners),
+            'duree': rng.choice([15, 30, 45, 60, 90, 120, 210, 420]),
+            'isJustifie': rng.random() < 0.4,
+            'isRetard': rng.random() < 0.2,
+        }
+        for index in range(count)
+    }
+
+
+def best_of(function, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    for count, learners in ((20_000, 2_000), (200_000, 5_000), (1_000_000, 10_000)):
+        data = make_absences(count, learners)
+        legacy_time, expected = best_of(legacy_summarize_absences, data)
+        columnar_time, result = best_of(summarize_absences, data)
+        assert result == expected, "totals differ from the legacy loop"
+        absence_store.summarize_absences(data)
+        shared_time, _ = best_of(absence_store.summarize_absences, data)
+        print(f"{count:>9} absences / {learners:>6} learners: legacy {legacy_time * 1000:8.1f} ms | "
+              f"columnar {columnar_time * 1000:8.1f} ms | x{legacy_time / columnar_time:.1f} | "
+              f"shared {shared_time * 1e6:6.1f} µs")
+
+
+if __name__ == '__main__':
+    main()
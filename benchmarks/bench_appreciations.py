@@ -0,0 +1,88 @@
+"""
+Microbenchmark du rapprochement des appréciations (document Word) avec les apprenants.
+
+Compare l'ancienne double boucle de update_excel_with_appreciations (normalize_name
+des deux côtés pour chaque couple apprenant x appréciation) à l'index construit une
+fois, puis vérifie le repli insensible à l'ordre des mots (« Prénom NOM ») :
+
+    python -m benchmarks.bench_appreciations
+"""
+import io
+import logging
+import random
+import time
+
+from openpyxl import Workbook
+
+from app.services.excel_service import normalize_name, update_excel_with_appreciations
+from app.utils.sheet_utils import OutputSheet, ParsedTemplate
+
+NAME_COLUMN = 1
+APPRECIATION_COLUMN = 2
+COLUMNS_CONFIG = {'name_column_index_template': NAME_COLUMN, 'appreciation_column_index_template': APPRECIATION_COLUMN}
+FIRST_NAMES = ["Élodie", "Jérôme", "Anaïs", "François", "Léa", "Noé", "Chloé", "Hélène", "Loïc", "Zoé"]
+
+
+def legacy_update(output_sheet, appreciations, columns_config):
+    """Ancienne implémentation, conservée ici comme référence (sans les print)."""
+    for row in range(2, output_sheet.max_row + 1):
+        student_name = output_sheet.value(row, columns_config['name_column_index_template'])
+        if student_name:
+            normalized_student_name = normalize_name(student_name)
+            for key, appreciation in appreciations.items():
+                if normalize_name(key) == normalized_student_name:
+                    output_sheet.set(row, columns_config['appreciation_column_index_template'], appreciation)
+                    break
+    return output_sheet
+
+
+def make_case(students, seed=0):
+    rng = random.Random(seed)
+    workbook = Workbook()
+    workbook.active.append(["Nom", "Appréciation"])
+    image = io.BytesIO()
+    workbook.save(image)
+    template = ParsedTemplate(image.getvalue())
+
+    names = [f"NOM{index:05d} {rng.choice(FIRST_NAMES)}" for index in range(students)]
+    appreciations = {name.upper(): f"Appréciation {index}" for index, name in enumerate(names)}
+    rng.shuffle(names)
+    return template, names, appreciations
+
+
+def fill(template, names):
+    sheet = OutputSheet(template)
+    for row, name in enumerate(names, start=2):
+        sheet.set(row, NAME_COLUMN, name)
+    return sheet
+
+
+def best_of(function, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    logging.disable(logging.WARNING)
+    for students in (60, 500, 3000):
+        template, names, appreciations = make_case(students)
+        legacy_time, expected = best_of(lambda: legacy_update(fill(template, names), appreciations, COLUMNS_CONFIG))
+        indexed_time, (result, unmatched) = best_of(lambda: update_excel_with_appreciations(fill(template, names), appreciations, COLUMNS_CONFIG))
+        assert result.rows == expected.rows and not unmatched, "indexed matching differs from the legacy loop"
+        print(f"{students:>5} students: nested loop {legacy_time * 1000:9.1f} ms | index {indexed_time * 1000:6.1f} ms | "
+              f"x{legacy_time / indexed_time:.0f}")
+
+    # Noms saisis « Prénom NOM » dans le fichier de notes : retrouvés par la clé de repli uniquement
+    template, names, appreciations = make_case(500)
+    swapped = [" ".join(reversed(name.split())) for name in names]
+    _, (_, unmatched_legacy_keys) = best_of(lambda: update_excel_with_appreciations(fill(template, swapped), appreciations, COLUMNS_CONFIG, fallback=False), repeat=1)
+    _, (_, unmatched) = best_of(lambda: update_excel_with_appreciations(fill(template, swapped), appreciations, COLUMNS_CONFIG), repeat=1)
+    print(f"500 students written 'Prénom NOM': unmatched without fallback {len(unmatched_legacy_keys)}, with fallback {len(unmatched)}")
+
+
+if __name__ == '__main__':
+    main()
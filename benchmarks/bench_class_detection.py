@@ -0,0 +1,76 @@
+"""
+Microbenchmark de la détection de la classe d'un export de notes (titres de la ligne 4).
+
+Compare l'ancienne détection (jusqu'à 24 recherches successives de sous-chaînes sur tous les
+titres, puis comparaison de l'en-tête à chaque liste de titres, dans l'ordre) à
+TemplateRegistry.detect_class (signature hachée et automate sur tous les titres, en un parcours),
+pour l'en-tête de chaque classe déclarée. Affiche les classes où l'ancienne détection se trompait :
+
+    python -m benchmarks.bench_class_detection
+"""
+import time
+
+from app.services.template_registry import get_registry
+
+# Titres repères de l'ancienne détection, dans son ordre de priorité
+LEGACY_MARKERS = (
+    ("Baux Commerciaux et Gestion Locative", "MAGI"),
+    ("Rénovation Energétique des Actifs Tertiaires", "MAGI_S3"),
+    ("Business Game Property Management", "MAGI_S4"),
+    ("Budget d'Exploitation et de Travaux", "MAGI_S2"),
+    ("Les Fondamentaux de l'Evaluation", "MEFIM"),
+    ("Marché d'Actifs Immobiliers", "MEFIM_S2"),
+    ("Droit des Suretés et de la Transmission", "MEFIM_S3"),
+    ("Business Game Arbitrage et Stratégies d'Investissement", "MEFIM_S4"),
+    ("Étude Foncière", "MAPI"),
+    ("Droit de la Promotion Immobilière", "MAPI_S2"),
+    ("Acquisition et Dissociation du Foncier", "MAPI_S3"),
+    ("Business Game Aménagement et Promotion Immobilière", "MAPI_S4"),
+    ("Économie Générale", "BG_ALT_S1"),
+    ("Microéconomie I", "BG_ALT_S2"),
+    ("Microéconomie II", "BG_ALT_S3"),
+    ("Marketing Digital & Environnemental", "BG_ALT_S4"),
+    ("Économie Urbaine", "BG_ALT_S5"),
+    ("Finance Immobilière", "BG_ALT_S6"),
+    ("Organisations, Stratégies et Innovations I", "BG_TP_1"),
+    ("Real Estate English & TOEFL", "BG_TP_2"),
+    ("Pratique de Gestion Locative I", "BG_TP_3"),
+    ("Mobilité Internationale Études", "BG_TP_4"),
+    ("Management de Projet Immobilier", "BG_TP_5"),
+    ("Mémoire de Recherche", "BG_TP_6"),
+)
+REPEAT = 2000
+
+
+def legacy_detect(uploaded_values, headers):
+    class_name = next((name for marker, name in LEGACY_MARKERS
+                       if any(marker in value for value in uploaded_values)), None)
+    template = next((name for name, values in headers if uploaded_values[:len(values)] == values), None)
+    return class_name, template
+
+
+def per_call(function, *args):
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        result = function(*args)
+    return (time.perf_counter() - started) / REPEAT, result
+
+
+def main():
+    registry = get_registry()
+    headers = [(name, list(class_template.header)) for name, class_template in registry.classes.items()]
+    legacy_total = registry_total = 0.0
+    for name, header in headers:
+        uploaded_values = header + ["Total"]
+        legacy_time, (class_name, template) = per_call(legacy_detect, uploaded_values, headers)
+        registry_time, detection = per_call(registry.detect_class, uploaded_values)
+        legacy_total += legacy_time
+        registry_total += registry_time
+        note = "" if class_name == name else f"  (legacy class: {class_name})"
+        print(f"{name:10s} legacy {legacy_time * 1e6:6.1f} us | registry {registry_time * 1e6:6.1f} us | "
+              f"{detection.status} {detection.describe_candidates()}{note}")
+    print(f"mean: legacy {legacy_total / len(headers) * 1e6:.1f} us | registry {registry_total / len(headers) * 1e6:.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Microbenchmark du passage du tableau de la classe de la fusion Excel à la génération des bulletins.
+
+Compare l'aller-retour par le disque (OutputSheet.save puis lecture du classeur,
+ClassTable.from_file) au tableau construit en mémoire (ClassTable.from_output_sheet),
+sur le template M1-S1-MAPI rempli de 60, 500 et 5 000 apprenants, et vérifie que les
+titres et les DataFrames apprenants obtenus sont identiques :
+
+    python -m benchmarks.bench_class_table
+"""
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from app.core.config import settings
+from app.services.excel_service import ClassTable
+from app.services.template_cache import get_template
+from app.utils.sheet_utils import OutputSheet
+
+SIZES = (60, 500, 5000)
+
+
+def make_output_sheet(students):
+    random.seed(students)
+    sheet = OutputSheet(get_template(settings.M1_S1_MAPI_TEMPLATE))
+    for index in range(students):
+        row = 4 + index
+        sheet.set(row, 1, 10000 + index)
+        sheet.set(row, 2, f"NOM{index:05d} Prenom{index:05d}")
+        for col in range(3, 23):
+            sheet.set(row, col, random.choice([round(random.random() * 20, 2), None, 12, 'ABS']))
+        for col, value in zip(range(23, 31), ('01/02/2001', 'Paris', 7, 'G', 'Groupe', '2h', '0h', '1h')):
+            sheet.set(row, col, value)
+        sheet.set(row, 31, "Bon semestre")
+    return sheet
+
+
+def through_disk(sheet, path):
+    sheet.save(path)
+    return ClassTable.from_file(path, backend="openpyxl")
+
+
+def best_of(function, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, os.path.basename(settings.M1_S1_MAPI_TEMPLATE))
+        for students in SIZES:
+            sheet = make_output_sheet(students)
+            disk_time, expected = best_of(through_disk, sheet, path)
+            memory_time, table = best_of(ClassTable.from_output_sheet, sheet, os.path.basename(path))
+            pd.testing.assert_series_equal(pd.Series(table.titles_row), pd.Series(expected.titles_row))
+            pd.testing.assert_frame_equal(table.students()[0], expected.students()[0])
+            print(f"{students:5d} students: save + read {disk_time * 1000:8.1f} ms | "
+                  f"in memory {memory_time * 1000:7.1f} ms | x{disk_time / memory_time:.0f}")
+
+
+if __name__ == '__main__':
+    main()
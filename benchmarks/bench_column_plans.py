@@ -0,0 +1,69 @@
+"""
+Microbenchmark de la correspondance des colonnes export -> template de process_file.
+
+Compare l'ancienne jointure imbriquée (titres de l'export x titres du template,
+recalculée à chaque job) à un plan compilé retrouvé par signature d'en-têtes,
+en mémoire puis sur disque (cas d'un autre worker) :
+
+    python -m benchmarks.bench_column_plans
+"""
+import tempfile
+import time
+
+from app.core.config import settings
+from app.services import column_plans
+from app.utils.sheet_utils import normalize_title
+
+NAME_COLUMN = 1
+
+
+def legacy_matching(uploaded_header, template_titles):
+    uploaded_titles = {
+        normalize_title(value): col
+        for col, value in enumerate(uploaded_header, start=1)
+        if value is not None
+    }
+    return {
+        uploaded_title: (uploaded_titles[uploaded_title], template_titles[template_title])
+        for uploaded_title in uploaded_titles
+        for template_title in template_titles
+        if uploaded_title == template_title
+    }
+
+
+def best_of(function, *args, repeat=200):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    settings.COLUMN_PLANS_DIR = tempfile.mkdtemp()
+    for columns in (30, 80, 160):
+        uploaded_header = ["Nom"] + [f"Module {col} (coef. 2)" for col in range(2, columns + 1)]
+        template_titles = {normalize_title(f"Module {col} (coef. 2)"): col + 16 for col in range(2, columns + 1, 2)}
+        template_titles[normalize_title("Nom")] = 1
+
+        legacy_time, expected = best_of(legacy_matching, uploaded_header, template_titles)
+        column_plans._plans.clear()
+        started = time.perf_counter()
+        column_plans.get_plan(uploaded_header, template_titles, NAME_COLUMN)
+        compile_time = time.perf_counter() - started
+        hit_time, plan = best_of(column_plans.get_plan, uploaded_header, template_titles, NAME_COLUMN)
+        assert list(plan.copies) == list(expected.values()), "plan differs from the nested join"
+
+        def disk_hit():
+            column_plans._plans.clear()
+            return column_plans.get_plan(uploaded_header, template_titles, NAME_COLUMN)
+
+        disk_time, _ = best_of(disk_hit)
+        print(f"{columns:>4} columns: nested join {legacy_time * 1e6:8.1f} µs | compile + persist {compile_time * 1e6:8.1f} µs | "
+              f"other worker (disk) {disk_time * 1e6:7.1f} µs | in-memory plan {hit_time * 1e6:6.1f} µs")
+    print(f"plan metrics: {column_plans.plan_metrics}")
+
+
+if __name__ == '__main__':
+    main()
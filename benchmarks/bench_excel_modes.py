@@ -0,0 +1,107 @@
+"""
+Pic mémoire (RSS) et durée de la fusion Excel selon le mode d'ouverture openpyxl.
+
+- legacy : import et template chargés en entier (load_workbook(..., data_only=True)),
+  cellules écrites dans le modèle objet puis template_wb.save ;
+- streaming : import lu en lecture seule (read_sheet), lignes écrites dans une
+  OutputSheet puis enregistrées par un classeur en écriture seule.
+
+Chaque mesure tourne dans un processus neuf pour que le pic RSS lui soit propre :
+
+    python -m benchmarks.bench_excel_modes
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from openpyxl import Workbook, load_workbook
+
+from app.services.template_cache import get_template
+from app.utils.sheet_utils import OutputSheet, read_sheet
+
+HEADER_ROW = 4
+SIZES = ((60, 80), (1000, 80), (5000, 80))
+
+
+def make_files(directory, students, columns):
+    upload_path = os.path.join(directory, f"upload-{students}.xlsx")
+    template_path = os.path.join(directory, f"template-{columns}.xlsx")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for _ in range(HEADER_ROW - 1):
+        ws.append([])
+    ws.append(["Nom"] + [f"Module {col}" for col in range(2, columns + 1)])
+    for index in range(students):
+        ws.append([f"NOM{index:05d} Prenom{index:05d}"] + [round((index * col) % 200 / 10, 1) for col in range(2, columns + 1)])
+    wb.save(upload_path)
+
+    wb = Workbook()
+    ws = wb.active
+    for col in range(1, columns + 1):
+        ws.cell(row=1, column=col).value = "Nom" if col == 1 else f"Module {col}"
+    wb.save(template_path)
+    return upload_path, template_path
+
+
+def legacy_merge(upload_path, template_path, output_path):
+    uploaded_ws = load_workbook(upload_path, data_only=True).active
+    template_wb = load_workbook(template_path, data_only=True)
+    template_ws = template_wb.active
+    max_column = uploaded_ws.max_column
+    for row in range(HEADER_ROW + 1, uploaded_ws.max_row + 1):
+        for col in range(1, max_column + 1):
+            template_ws.cell(row=row - HEADER_ROW + 1, column=col).value = uploaded_ws.cell(row=row, column=col).value
+    template_wb.save(output_path)
+
+
+def streaming_merge(upload_path, template_path, output_path):
+    uploaded_sheet = read_sheet(upload_path)
+    output_sheet = OutputSheet(get_template(template_path))
+    for row in range(HEADER_ROW + 1, uploaded_sheet.max_row + 1):
+        for col, value in enumerate(uploaded_sheet.row(row), start=1):
+            output_sheet.set(row - HEADER_ROW + 1, col, value)
+    output_sheet.save(output_path)
+
+
+def run_child(mode, upload_path, template_path, output_path):
+    """Exécuté dans le sous-processus : imprime 'durée_s pic_rss_ko base_rss_ko'."""
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    {"legacy": legacy_merge, "streaming": streaming_merge}[mode](upload_path, template_path, output_path)
+    elapsed = time.perf_counter() - started
+    print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, base_rss)
+
+
+def measure(mode, upload_path, template_path, output_path):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_excel_modes", mode, upload_path, template_path, output_path],
+        check=True, capture_output=True, text=True,
+    ).stdout.split()
+    elapsed, peak, base = float(output[0]), int(output[1]), int(output[2])
+    return elapsed, peak / 1024, (peak - base) / 1024
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        for students, columns in SIZES:
+            upload_path, template_path = make_files(directory, students, columns)
+            results = {}
+            for mode in ("legacy", "streaming"):
+                output_path = os.path.join(directory, f"{mode}-{students}.xlsx")
+                results[mode] = measure(mode, upload_path, template_path, output_path)
+            expected = [row for row in load_workbook(os.path.join(directory, f"legacy-{students}.xlsx"), read_only=True).active.iter_rows(values_only=True)]
+            actual = [row for row in load_workbook(os.path.join(directory, f"streaming-{students}.xlsx"), read_only=True).active.iter_rows(values_only=True)]
+            assert actual == expected, "streaming output differs from the legacy output"
+            for mode, (elapsed, peak, delta) in results.items():
+                print(f"{students:>6} students x {columns} columns | {mode:<9} | {elapsed * 1000:8.1f} ms | "
+                      f"peak RSS {peak:6.1f} MiB (+{delta:5.1f} MiB for the merge)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 5:
+        run_child(*sys.argv[1:])
+    else:
+        main()
@@ -0,0 +1,96 @@
+"""
+Microbenchmark de la lecture du classeur d'une classe par process_excel_file.
+
+Pour chacun des templates du dépôt (excel/*/*.xlsx et template/*/*.xlsx), rempli de
+500 apprenants, compare l'ancien chargement (deux pd.read_excel, titres puis apprenants,
+toutes colonnes en types inférés) à la lecture unique de ClassTable avec chaque lecteur
+disponible (openpyxl, calamine si python-calamine est installé), DataFrame apprenants
+réduit aux colonnes du cas et typé en texte. Vérifie que les lecteurs donnent le même tableau :
+
+    python -m benchmarks.bench_excel_reader
+"""
+import glob
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from app.core.config import settings
+from app.services.excel_service import STUDENT_FIELDS, ClassTable, CalamineWorkbook, EXCEL_READERS
+from app.services.template_cache import get_template
+from app.utils.sheet_utils import OutputSheet
+
+STUDENTS = 500
+
+
+def make_class_workbook(template_path, path):
+    random.seed(STUDENTS)
+    template = get_template(template_path)
+    sheet = OutputSheet(template)
+    header = template.rows[1] if len(template.rows) > 1 else ()
+    grade_columns = [col for col, value in enumerate(header, start=1) if value == 'Note']
+    for index in range(STUDENTS):
+        row = 4 + index
+        sheet.set(row, 1, 10000 + index)
+        sheet.set(row, 2, f"NOM{index:05d} Prenom{index:05d}")
+        for col in grade_columns:
+            sheet.set(row, col, random.choice([round(random.random() * 20, 2), None, 12, 'ABS', '12,5 (2) - 14 (1)']))
+        for col, value in enumerate(header, start=1):
+            if value in STUDENT_FIELDS and value not in ('CodeApprenant', 'Nom'):
+                sheet.set(row, col, f"{value} {index % 7}")
+    sheet.save(path)
+    # Colonnes de notes du cas (positions 0-based dans le DataFrame apprenants)
+    return [col - 1 for col in grade_columns]
+
+
+def legacy_load(path):
+    return pd.read_excel(path, header=None), pd.read_excel(path, header=1)
+
+
+def single_parse(path, backend, grade_columns):
+    table = ClassTable.from_file(path, backend=backend)
+    return table.titles_row, table.students(STUDENT_FIELDS, grade_columns)
+
+
+def best_of(function, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    template_paths = sorted(glob.glob(os.path.join(settings.BASE_DIR, "excel", "*", "*.xlsx"))
+                            + glob.glob(os.path.join(settings.BASE_DIR, "template", "*", "*.xlsx")))
+    backends = [name for name in EXCEL_READERS if name != "calamine" or CalamineWorkbook is not None]
+    totals = {"legacy": 0.0, **{backend: 0.0 for backend in backends}}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for index, template_path in enumerate(template_paths):
+            path = os.path.join(directory, f"{index:02d}-{os.path.basename(template_path)}")
+            grade_columns = make_class_workbook(template_path, path)
+
+            legacy_time, _ = best_of(legacy_load, path)
+            totals["legacy"] += legacy_time
+            timings, results = [], []
+            for backend in backends:
+                backend_time, result = best_of(single_parse, path, backend, grade_columns)
+                totals[backend] += backend_time
+                timings.append(f"{backend} {backend_time * 1000:6.1f} ms")
+                results.append(result)
+            for titles, (students, grades) in results[1:]:
+                pd.testing.assert_series_equal(pd.Series(titles), pd.Series(results[0][0]))
+                pd.testing.assert_frame_equal(students, results[0][1][0])
+            print(f"{os.path.relpath(template_path, settings.BASE_DIR):32s} read_excel x2 {legacy_time * 1000:6.1f} ms | "
+                  + " | ".join(timings))
+
+    print(f"{len(template_paths)} layouts x {STUDENTS} students, total: "
+          + " | ".join(f"{name} {seconds:.2f} s" for name, seconds in totals.items()))
+
+
+if __name__ == '__main__':
+    main()
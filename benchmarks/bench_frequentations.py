@@ -0,0 +1,102 @@
+"""
+Benchmark de la sélection des fréquentations (fetch_api_data_for_template).
+
+Compare l'ancienne boucle (strptime par enregistrement) à select_frequentations
+sur 10k et 100k fréquentations synthétiques, après avoir vérifié que les deux
+produisent le même résultat :
+
+    python -m benchmarks.bench_frequentations
+"""
+import logging
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from app.utils.frequentation_utils import select_frequentations
+
+PERIODE = {'codePeriode': 2, 'dateDeb': '01/09/2023', 'dateFin': '31/08/2024'}
+
+
+def legacy_select_frequentations(frequentes_data, periode):
+    """Ancienne implémentation, conservée ici comme référence."""
+    frequentes_dict = {}
+    for frequentation in frequentes_data.values():
+        code_apprenant = str(frequentation.get('codeApprenant'))
+        date_debut_frequentation = frequentation.get('dateDeb')
+        date_fin_frequentation = frequentation.get('dateFin')
+        if not all([code_apprenant, date_debut_frequentation, date_fin_frequentation]):
+            continue
+        if periode:
+            try:
+                if not isinstance(date_debut_frequentation, str) or not isinstance(date_fin_frequentation, str):
+                    continue
+                periode_debut_str = periode.get('dateDeb')
+                periode_fin_str = periode.get('dateFin')
+                if not periode_debut_str or not periode_fin_str:
+                    continue
+                date_debut = datetime.strptime(date_debut_frequentation, '%d/%m/%Y')
+                date_fin = datetime.strptime(date_fin_frequentation, '%d/%m/%Y')
+                periode_debut = datetime.strptime(periode_debut_str, '%d/%m/%Y')
+                periode_fin = datetime.strptime(periode_fin_str, '%d/%m/%Y')
+                if date_debut <= periode_fin and date_fin >= periode_debut:
+                    if code_apprenant in frequentes_dict:
+                        existing_date_debut_str = frequentes_dict[code_apprenant].get('dateDeb')
+                        if existing_date_debut_str:
+                            existing_date_debut = datetime.strptime(existing_date_debut_str, '%d/%m/%Y')
+                            if date_debut > existing_date_debut:
+                                frequentes_dict[code_apprenant] = frequentation
+                    else:
+                        frequentes_dict[code_apprenant] = frequentation
+            except ValueError:
+                continue
+    return frequentes_dict
+
+
+def make_frequentations(count, seed=0):
+    rng = random.Random(seed)
+    learners = max(1, count // 3)
+    origin = date(2021, 9, 1)
+    data = {}
+    for index in range(count):
+        debut = origin + timedelta(days=rng.randrange(1400))
+        fin = debut + timedelta(days=rng.randrange(30, 400))
+        frequentation = {
+            'codeFrequente': index,
+            'codeApprenant': 10000 + rng.randrange(learners),
+            'codeGroupe': rng.randrange(100),
+            'dateDeb': debut.strftime('%d/%m/%Y'),
+            'dateFin': fin.strftime('%d/%m/%Y'),
+        }
+        # Quelques enregistrements incomplets ou mal formés, comme dans les vraies données
+        roll = rng.random()
+        if roll < 0.01:
+            frequentation['dateFin'] = None
+        elif roll < 0.02:
+            frequentation['dateDeb'] = '2023-09-01'
+        data[str(index)] = frequentation
+    return data
+
+
+def best_of(function, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    logging.disable(logging.WARNING)
+    for count in (10_000, 100_000):
+        data = make_frequentations(count)
+        legacy_time, expected = best_of(legacy_select_frequentations, data, PERIODE)
+        vectorized_time, result = best_of(select_frequentations, data, PERIODE)
+        assert list(result.items()) == list(expected.items()), "results differ from the legacy loop"
+        print(f"{count:>7} frequentations: legacy {legacy_time * 1000:8.1f} ms | "
+              f"vectorized {vectorized_time * 1000:8.1f} ms | x{legacy_time / vectorized_time:.1f} "
+              f"({len(result)} learners selected)")
+
+
+if __name__ == '__main__':
+    main()
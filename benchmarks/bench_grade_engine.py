@@ -0,0 +1,90 @@
+"""
+Microbenchmark du calcul des notes, états et ECTS d'une classe (sans le rendu des bulletins).
+
+Compare le calcul par apprenant (compute_student_grades sur chaque ligne) au calcul de toute
+la classe sur tableaux (compute_class_grades), pour les mises en page M1_S1 et BG_ALT_1
+remplies de 50, 500 et 5 000 apprenants, et vérifie que les placeholders obtenus sont identiques :
+
+    python -m benchmarks.bench_grade_engine
+"""
+import logging
+import random
+import time
+
+import pandas as pd
+
+from app.services.grade_engine import compute_class_grades
+from app.services.template_registry import BULLETIN_LAYOUTS
+from app.services.word_service import compute_student_grades, ects_data_for, generate_placeholders
+
+SIZES = (50, 500, 5000)
+LAYOUTS = ("M1_S1", "BG_ALT_1")
+FIELDS = ("Nom", "Étendu Groupe", "Date de Naissance", "Code Groupe", "Nom Groupe", "Nom Site",
+          "ABS justifiées", "ABS injustifiées", "Retards", "Appreciations", "CodeApprenant")
+
+
+def random_grade():
+    kind = random.random()
+    if kind < 0.1:
+        return None
+    if kind < 0.15:
+        return random.choice(["Validé ( - ASE)", "Non Validé ( - ASE)", "12 (CCHM)", "ABS"])
+    if kind < 0.6:
+        return f"{random.uniform(4, 20):.2f}".replace(".", ",")
+    return " - ".join(f"{random.uniform(4, 20):.1f} ({random.choice([1, 2, 0.5])})" for _ in range(random.randint(2, 4)))
+
+
+def make_class(layout, students):
+    random.seed(students)
+    subjects = len(layout["grade_column_indices"])
+    rows = [[f"NOM{index:05d} Prenom", "Groupe", "01/02/2001", "7", "Groupe", "Paris", "2h", "0h", "1h", "", str(10000 + index)]
+            + [random_grade() for _ in range(subjects)] for index in range(students)]
+    frame = pd.DataFrame(rows, columns=list(FIELDS) + [f"Note {number}" for number in range(1, subjects + 1)])
+    case_config = {**layout, "titles_row": [""] * 40,
+                   "grade_column_indices": list(range(len(FIELDS), len(FIELDS) + subjects))}
+    return frame, case_config
+
+
+def per_student(rows, case_config, ects_data):
+    results = []
+    for student_data, placeholders in rows:
+        placeholders = dict(placeholders)
+        compute_student_grades(placeholders, student_data, case_config, ects_data)
+        for hidden_ects in case_config["hidden_ects"]:
+            placeholders.pop(f"ECTS{hidden_ects}", None)
+        results.append(placeholders)
+    return results
+
+
+def best_of(function, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    logging.disable(logging.WARNING)
+    layouts = {layout["key"]: layout for layout in BULLETIN_LAYOUTS}
+    for key in LAYOUTS:
+        for students in SIZES:
+            frame, case_config = make_class(layouts[key], students)
+            ects_data = ects_data_for(case_config)
+            # Lignes et placeholders d'identité préparés hors chronométrage, comme dans generate_word_document
+            rows = []
+            for _, student_data in frame.iterrows():
+                student_data = student_data.fillna('').astype(str)
+                rows.append((student_data, generate_placeholders(case_config["titles_row"], case_config, student_data, "", ects_data)))
+
+            legacy_time, expected = best_of(per_student, rows, case_config, ects_data, repeat=1 if students > 500 else 3)
+            engine_time, grades = best_of(compute_class_grades, frame, case_config, ects_data)
+            for (_, placeholders), reference, computed in zip(rows, expected, grades):
+                assert {**placeholders, **computed} == reference
+            print(f"{key:8s} {students:5d} students: per student {legacy_time * 1000:8.1f} ms | "
+                  f"class engine {engine_time * 1000:7.1f} ms | x{legacy_time / engine_time:.0f}")
+
+
+if __name__ == '__main__':
+    main()
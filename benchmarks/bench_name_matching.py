@@ -0,0 +1,98 @@
+"""
+Microbenchmark du rapprochement des noms de l'export avec les apprenants Yparéo.
+
+Pour 2 000 à 50 000 apprenants synthétiques, cherche 60 noms : exacts, avec une faute
+de frappe, dans l'ordre « Prénom NOM » ou inconnus. Compare le nombre de noms retrouvés
+par l'ancien dictionnaire exact et par NameIndex, mesure la construction de l'index et le
+coût par nom, et vérifie sur 2 000 apprenants que le blocage par trigrammes retient le
+même apprenant qu'une comparaison exhaustive :
+
+    python -m benchmarks.bench_name_matching
+"""
+import random
+import string
+import time
+
+from app.utils.name_matching import NameIndex
+from app.utils.sheet_utils import normalize_title
+
+LAST_NAMES = ["MARTIN", "BERNARD", "THOMAS", "PETIT", "ROBERT", "RICHARD", "DURAND", "DUBOIS", "MOREAU", "LAURENT",
+              "SIMON", "MICHEL", "LEFEBVRE", "LEROY", "ROUX", "DAVID", "BERTRAND", "MOREL", "FOURNIER", "GIRARD",
+              "LE GALL", "DE LA FONTAINE", "N'DIAYE", "SAINT-JUST", "OUEDRAOGO", "NGUYEN", "DA SILVA", "BENOIT"]
+FIRST_NAMES = ["Léa", "Hugo", "Chloé", "Lucas", "Manon", "Nathan", "Inès", "Louis", "Jade", "Gabriel",
+               "Anaïs", "Noé", "Zoé", "Jérôme", "Hélène", "François", "Élodie", "Loïc", "Maëlys", "Théo"]
+
+
+def make_learners(count, rng):
+    learners = []
+    for index in range(count):
+        # Un suffixe aléatoire rend les noms uniques, comme des patronymes rares
+        suffix = ''.join(rng.choice(string.ascii_uppercase) for _ in range(4))
+        learners.append({'codeApprenant': index, 'nomApprenant': f"{rng.choice(LAST_NAMES)} {suffix}", 'prenomApprenant': rng.choice(FIRST_NAMES)})
+    return learners
+
+
+def typo(text, rng):
+    position = rng.randrange(1, len(text) - 1)
+    return text[:position] + text[position + 1] + text[position] + text[position + 2:]
+
+
+def make_queries(learners, rng):
+    queries = []
+    for kind, count in (("exact", 20), ("typo", 15), ("swapped", 15), ("unknown", 10)):
+        for learner in rng.sample(learners, count):
+            name = f"{learner['nomApprenant']} {learner['prenomApprenant']}"
+            if kind == "typo":
+                name = typo(name, rng)
+            elif kind == "swapped":
+                name = f"{learner['prenomApprenant']} {learner['nomApprenant']}"
+            elif kind == "unknown":
+                name, learner = f"INCONNU{rng.randrange(10 ** 6)} Personne", None
+            queries.append((kind, name, learner))
+    return queries
+
+
+def main():
+    rng = random.Random(0)
+    for count in (2_000, 20_000, 50_000):
+        learners = make_learners(count, rng)
+        queries = make_queries(learners, rng)
+
+        legacy = {normalize_title(learner['nomApprenant'] + learner['prenomApprenant']): learner for learner in learners}
+        legacy_found = sum(1 for _, name, expected in queries if expected is not None and legacy.get(normalize_title(name)) is expected)
+
+        started = time.perf_counter()
+        index = NameIndex(learners)
+        build_time = time.perf_counter() - started
+        # Le premier nom non trouvé à l'identique construit l'index de trigrammes
+        started = time.perf_counter()
+        index.match("Xyz Inconnu")
+        fuzzy_build_time = time.perf_counter() - started
+        started = time.perf_counter()
+        matches = index.match_all([name for _, name, _ in queries])
+        match_time = time.perf_counter() - started
+
+        # Job suivant sur les mêmes apprenants (copiés) : l'index de trigrammes est réutilisé
+        started = time.perf_counter()
+        NameIndex([dict(learner) for learner in learners]).match("Xyz Inconnu")
+        next_job_time = time.perf_counter() - started
+
+        found = sum(1 for (_, _, expected), match in zip(queries, matches) if expected is not None and match.record is expected)
+        wrong = sum(1 for (_, _, expected), match in zip(queries, matches) if match.record is not None and match.record is not expected)
+        expected_count = sum(1 for _, _, expected in queries if expected is not None)
+        print(f"{count:>6} learners: found exact-only {legacy_found}/{expected_count}, with NameIndex {found}/{expected_count} "
+              f"({wrong} wrong) | exact index {build_time * 1000:6.1f} ms | trigram index {fuzzy_build_time * 1000:6.1f} ms | "
+              f"60 names {match_time * 1000:6.1f} ms | next job, first miss {next_job_time * 1000:6.1f} ms")
+
+        if count == 2_000:
+            # Comparaison exhaustive : tous les apprenants sont candidats
+            exhaustive = NameIndex(learners, max_candidates=count)
+            started = time.perf_counter()
+            reference = exhaustive.match_all([name for _, name, _ in queries])
+            exhaustive_time = time.perf_counter() - started
+            assert [match.record for match in matches] == [match.record for match in reference], "blocking changed a match"
+            print(f"{count:>6} learners: exhaustive scoring {exhaustive_time * 1000:7.1f} ms for the same matches")
+
+
+if __name__ == '__main__':
+    main()
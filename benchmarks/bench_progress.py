@@ -0,0 +1,95 @@
+"""
+Microbenchmark du suivi de progression.
+
+Mesure le coût d'un appel à progress_service.advance par apprenant (sans connexion,
+puis avec un client abonné), et le nombre de messages réellement envoyés lorsqu'une
+génération de bulletins tourne dans un thread (comme process_excel_file) pendant
+qu'un client rapide et un client lent (200 ms par envoi) suivent la session.
+Le pipeline ne doit jamais attendre les clients :
+
+    python -m benchmarks.bench_progress
+"""
+import asyncio
+import time
+
+from starlette.websockets import WebSocketDisconnect
+
+from app.core.config import settings
+from app.services import progress_service
+
+
+class FakeWebSocket:
+    def __init__(self, send_delay=0.0):
+        self.send_delay = send_delay
+        self.messages = []
+        self.closed = asyncio.Event()
+
+    async def send_json(self, message):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.messages.append(message)
+
+    async def receive_text(self):
+        await self.closed.wait()
+        raise WebSocketDisconnect()
+
+
+def per_call(session_id, total):
+    progress_service.start_stage(session_id, "bulletins", 50, 60, total=total)
+    started = time.perf_counter()
+    for done in range(1, total + 1):
+        progress_service.advance(session_id, done)
+    return (time.perf_counter() - started) / total
+
+
+def generate(session_id, total, seconds, report=True):
+    """Génération simulée : total apprenants répartis sur seconds secondes, progression à chaque apprenant."""
+    pause = seconds / total
+    for done in range(1, total + 1):
+        time.sleep(pause)
+        if report:
+            progress_service.advance(session_id, done, total)
+
+
+async def run(total, seconds):
+    session_id = "bench-subscribed"
+    fast, slow = FakeWebSocket(), FakeWebSocket(send_delay=0.2)
+    listeners = [asyncio.create_task(progress_service.subscribe(ws, session_id)) for ws in (fast, slow)]
+    await asyncio.sleep(0)
+
+    subscribed_cost = per_call(session_id, total)
+
+    progress_service.start_stage(session_id, "bulletins", 50, 60, total=total)
+    started = time.perf_counter()
+    await asyncio.to_thread(generate, session_id, total, seconds)
+    pipeline_time = time.perf_counter() - started
+    progress_service.finish(session_id, message="done")
+    # Laisse au client lent le temps de recevoir l'état final
+    await asyncio.sleep(1.0)
+
+    for ws in (fast, slow):
+        ws.closed.set()
+    await asyncio.gather(*listeners)
+    return subscribed_cost, pipeline_time, fast.messages, slow.messages
+
+
+def main():
+    total, seconds = 5000, 2.0
+    started = time.perf_counter()
+    generate(None, total, seconds, report=False)
+    baseline_time = time.perf_counter() - started
+    idle_cost = per_call("bench-idle", total)
+    subscribed_cost, pipeline_time, fast, slow = asyncio.run(run(total, seconds))
+
+    print(f"advance() per learner: {idle_cost * 1e6:5.2f} us without client | {subscribed_cost * 1e6:5.2f} us with 2 clients")
+    print(f"{total} learners over {seconds:.1f} s (pipeline took {pipeline_time:.2f} s, "
+          f"{baseline_time:.2f} s without progress), "
+          f"limit {settings.PROGRESS_MAX_UPDATES_PER_SECOND:g} msg/s:")
+    for label, messages in (("fast client", fast), ("slow client (200 ms/send)", slow)):
+        last = messages[-1]
+        print(f"  {label:26s} {len(messages):3d} messages, last: {last['stage']} {last['progress']}%")
+    print(f"metrics: {progress_service.progress_metrics}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Microbenchmark de la lecture du fichier de notes importé par process_file.
+
+Compare l'ancien accès case par case (uploaded_ws.cell pour la recherche de
+« Moyenne du groupe », le nom puis chaque colonne reprise dans le template) à la
+lecture en une passe de SheetBuffer, sur un export de 60 apprenants et 80 colonnes,
+puis mesure process_file de bout en bout :
+
+    python -m benchmarks.bench_sheet_read
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from openpyxl import Workbook
+
+from app.api.endpoints.uploads import normalize_title, process_file
+from app.core.config import settings
+from app.utils.sheet_utils import SheetBuffer
+
+HEADER_ROW = 4
+NAME_COLUMN = 1
+EXCLUDE_PHRASE = 'moyennedugroupe'
+
+
+def make_export(students=60, columns=80):
+    wb = Workbook()
+    ws = wb.active
+    ws.cell(row=1, column=1).value = "Relevé de notes"
+    ws.cell(row=HEADER_ROW, column=NAME_COLUMN).value = "Nom"
+    for col in range(2, columns + 1):
+        ws.cell(row=HEADER_ROW, column=col).value = f"Module {col}"
+    for index in range(students):
+        row = HEADER_ROW + 1 + index
+        ws.cell(row=row, column=NAME_COLUMN).value = f"NOM{index:05d} Prenom{index:05d}"
+        for col in range(2, columns + 1):
+            ws.cell(row=row, column=col).value = round((index * col) % 200 / 10, 1)
+    ws.cell(row=HEADER_ROW + students + 1, column=NAME_COLUMN).value = "Moyenne du groupe"
+    return wb
+
+
+def make_template(path, columns=80):
+    wb = Workbook()
+    ws = wb.active
+    ws.cell(row=1, column=1).value = "Nom"
+    for col in range(2, columns + 1):
+        ws.cell(row=1, column=col + 16).value = f"Module {col}"
+    wb.save(path)
+
+
+def legacy_read(uploaded_wb, matching_columns):
+    """Ancien parcours de process_file, limité aux lectures du fichier importé."""
+    uploaded_ws = uploaded_wb.active
+    rows = []
+    for row in range(HEADER_ROW + 1, uploaded_ws.max_row + 1):
+        if any(EXCLUDE_PHRASE in normalize_title(uploaded_ws.cell(row=row, column=col).value or '')
+               for col in range(1, uploaded_ws.max_column + 1)):
+            continue
+        name = uploaded_ws.cell(row=row, column=NAME_COLUMN).value
+        if not name:
+            continue
+        rows.append((name, [uploaded_ws.cell(row=row, column=col).value for col in matching_columns]))
+    return rows
+
+
+def buffered_read(uploaded_wb, matching_columns):
+    """Même parcours sur les valeurs lues en une passe."""
+    sheet = SheetBuffer(uploaded_wb.active)
+    rows = []
+    for row in range(HEADER_ROW + 1, sheet.max_row + 1):
+        values = sheet.row(row)
+        if any(isinstance(value, str) and EXCLUDE_PHRASE in normalize_title(value) for value in values):
+            continue
+        name = values[NAME_COLUMN - 1]
+        if not name:
+            continue
+        rows.append((name, [values[col - 1] for col in matching_columns]))
+    return rows
+
+
+def best_of(function, *args, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    students, columns = 60, 80
+    uploaded_wb = make_export(students, columns)
+    matching_columns = list(range(2, columns + 1))
+
+    legacy_time, expected = best_of(legacy_read, uploaded_wb, matching_columns)
+    buffered_time, result = best_of(buffered_read, uploaded_wb, matching_columns)
+    assert result == expected, "buffered read differs from cell-by-cell read"
+    print(f"{students} students x {columns} columns: cell-by-cell {legacy_time * 1000:7.2f} ms | "
+          f"single pass {buffered_time * 1000:7.2f} ms | x{legacy_time / buffered_time:.1f}")
+
+    columns_config = {
+        'name_column_index_uploaded': NAME_COLUMN, 'name_column_index_template': 1,
+        'code_apprenant_column_index_template': 2, 'date_naissance_column_index_template': 3,
+        'nom_site_column_index_template': 4, 'code_groupe_column_index_template': 5,
+        'nom_groupe_column_index_template': 6, 'etendu_groupe_column_index_template': 7,
+        'duree_justifie_column_index_template': 8, 'duree_non_justifie_column_index_template': 9,
+        'duree_retard_column_index_template': 10,
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        template_path = os.path.join(directory, "template.xlsx")
+        make_template(template_path, columns)
+        # process_file enregistre le plan de colonnes compilé : pas dans le dossier de documents réel
+        settings.COLUMN_PLANS_DIR = os.path.join(directory, "column_plans")
+
+        def run_job():
+            return asyncio.run(process_file(uploaded_wb, template_path, columns_config, None, None, None, {}, {},
+                                            groupes_dict={}, absences_data={}))
+
+        job_time, _ = best_of(run_job)
+    print(f"process_file end to end (template from the cache): {job_time * 1000:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
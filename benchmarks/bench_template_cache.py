@@ -0,0 +1,68 @@
+"""
+Microbenchmark de la préparation du template Excel d'un job.
+
+Compare l'analyse complète à chaque job (openpyxl.load_workbook(template, data_only=True)
+puis lecture de la ligne d'en-tête) au cache de templates : get_template (contrôle de la
+date de modification) et copie des valeurs dans une OutputSheet. Tourne sur les
+templates du dépôt (excel/*/*.xlsx) :
+
+    python -m benchmarks.bench_template_cache
+"""
+import glob
+import os
+import time
+
+import openpyxl
+
+from app.core.config import settings
+from app.services.template_cache import get_template, template_metrics
+from app.utils.sheet_utils import OutputSheet, normalize_title
+
+
+def legacy_prepare(path):
+    template_wb = openpyxl.load_workbook(path, data_only=True)
+    template_ws = template_wb.active
+    return {
+        normalize_title(template_ws.cell(row=1, column=col).value): col
+        for col in range(1, template_ws.max_column + 1)
+        if template_ws.cell(row=1, column=col).value is not None
+    }
+
+
+def cached_prepare(path):
+    template = get_template(path)
+    OutputSheet(template)
+    return template.title_columns(1)
+
+
+def best_of(function, paths, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = [function(path) for path in paths]
+        timings.append(time.perf_counter() - started)
+    return min(timings), results
+
+
+def main():
+    paths = sorted(glob.glob(os.path.join(settings.BASE_DIR, "excel", "*", "*.xlsx")))
+    if not paths:
+        raise SystemExit(f"No template found under {settings.BASE_DIR}/excel")
+
+    legacy_time, expected = best_of(legacy_prepare, paths)
+    started = time.perf_counter()
+    for path in paths:
+        get_template(path)
+    first_time = time.perf_counter() - started
+    cached_time, results = best_of(cached_prepare, paths)
+    assert results == expected, "cached header map differs from a full parse"
+
+    per_job = len(paths)
+    print(f"{len(paths)} templates, per job: full parse {legacy_time / per_job * 1000:7.2f} ms | "
+          f"first cached parse {first_time / per_job * 1000:7.2f} ms | "
+          f"cache hit + copy {cached_time / per_job * 1000:7.3f} ms | x{legacy_time / cached_time:.0f}")
+    print(f"cache metrics: {template_metrics}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import datetime
+import os
+import random
+
+import pandas as pd
+import pytest
+
+from app.core.config import settings
+from app.services.excel_service import ClassTable
+from app.services.template_cache import get_template
+from app.utils.sheet_utils import OutputSheet
+
+# Valeurs dont la relecture n'est pas l'identité : nombres à 17 chiffres significatifs, entiers
+# au-delà de 2**53, NaN et infinis, codes d'erreur, formules, booléens, dates et durées
+TRICKY_VALUES = [
+    0.1 + 0.2, 1 / 3, 2 / 3 * 20, 12.345678901234567, 2 ** 53 + 1, 10 ** 20, 1e-7, -0.0, 12, 12.0,
+    float("nan"), float("inf"), "#N/A", "#DIV/0!", "#VALUE!", "=SUM(A1:A2)", "=", True, False,
+    "ABS", " 12 ", "", None, datetime.datetime(2001, 2, 1, 13, 45, 30, 123456), datetime.date(2024, 2, 29),
+    datetime.time(8, 30), datetime.timedelta(hours=2, minutes=15),
+]
+
+
+def make_output_sheet(students, seed):
+    # Les lignes 1 à 32 du template sont stylées au format « General » : une date y devient un nombre ;
+    # au-delà, les cases n'ont pas de style et la date est relue comme une date
+    rng = random.Random(seed)
+    sheet = OutputSheet(get_template(settings.M1_S1_MAPI_TEMPLATE))
+    for index in range(students):
+        row = 4 + index
+        sheet.set(row, 1, 10000 + index)
+        sheet.set(row, 2, f"NOM{index:05d} Prenom{index:05d}")
+        for col in range(3, 32):
+            sheet.set(row, col, rng.choice(TRICKY_VALUES + [round(rng.random() * 20, 2)]))
+    return sheet
+
+
+@pytest.mark.parametrize("students, seed", [(10, 0), (60, 1)])
+def test_in_memory_table_matches_saved_workbook(tmp_path, students, seed):
+    sheet = make_output_sheet(students, seed)
+    path = os.path.join(tmp_path, os.path.basename(settings.M1_S1_MAPI_TEMPLATE))
+    sheet.save(path)
+
+    table = ClassTable.from_output_sheet(sheet, os.path.basename(path))
+    expected = ClassTable.from_file(path, backend="openpyxl")
+    pd.testing.assert_series_equal(pd.Series(table.titles_row), pd.Series(expected.titles_row))
+    pd.testing.assert_frame_equal(table.students()[0], expected.students()[0])
+
+    # Et comme pd.read_excel, que le tableau en mémoire remplace
+    pd.testing.assert_series_equal(pd.Series(table.titles_row, dtype=object),
+                                   pd.read_excel(path, header=None).iloc[0].astype(object), check_names=False)
+    pd.testing.assert_frame_equal(table.students()[0], pd.read_excel(path, header=1, dtype=str))
@@ -0,0 +1,43 @@
+from app.utils.name_matching import NameIndex
+
+
+def learner(code, last_name, first_name):
+    return {"codeApprenant": code, "nomApprenant": last_name, "prenomApprenant": first_name}
+
+
+LEARNERS = [
+    learner(1, "MARTIN", "Léo"),
+    learner(2, "DURAND", "Paul"),
+    learner(3, "LE GALL", "Anaïs"),
+    learner(4, "BERNARD", "Christophe"),
+    learner(5, "PETIT", "Jean-Pierre"),
+]
+
+
+def test_exact_match():
+    match = NameIndex(LEARNERS).match("MARTIN Léo")
+    assert match.status == "exact"
+    assert match.record["codeApprenant"] == 1
+
+
+def test_near_homonym_first_names_are_not_filled():
+    index = NameIndex(LEARNERS)
+    for name, code in (("MARTIN Léa", 1), ("DURAND Pauline", 2)):
+        match = index.match(name)
+        assert match.status == "suggested"
+        assert match.record is None
+        assert match.candidates[0][1]["codeApprenant"] == code
+
+
+def test_spelling_variants_are_filled():
+    index = NameIndex(LEARNERS)
+    for name, code in (("Anais LE GALL", 3), ("BERNARD Christohpe", 4), ("Jean Pierre PETIT", 5)):
+        match = index.match(name)
+        assert match.status == "fuzzy", name
+        assert match.record["codeApprenant"] == code
+
+
+def test_different_surname_is_not_filled():
+    match = NameIndex(LEARNERS).match("BERNARDI Christophe")
+    assert match.status in ("suggested", "not_found")
+    assert match.record is None
@@ -0,0 +1,43 @@
+from datetime import date
+
+from app.utils.period_index import PeriodIndex
+
+
+def periode(code, start, end):
+    return {"codePeriode": code, "nomPeriode": f"P{code}", "dateDeb": start, "dateFin": end}
+
+
+# Année scolaire et ses deux semestres, plus un module court qui chevauche le second semestre
+PERIODES = {
+    "1": periode(1, "01/09/2023", "31/08/2024"),
+    "2": periode(2, "01/09/2023", "31/01/2024"),
+    "3": periode(3, "01/02/2024", "30/06/2024"),
+    "4": periode(4, "01/03/2024", "15/03/2024"),
+}
+
+
+def code(found):
+    return found["codePeriode"] if found is not None else None
+
+
+def test_containing_scans_back_through_overlapping_periods():
+    index = PeriodIndex(PERIODES)
+    assert code(index.containing(date(2024, 3, 10))) == 4
+    # Le module court est terminé : le semestre commencé avant lui est toujours en cours
+    assert code(index.containing(date(2024, 4, 10))) == 3
+    # Les deux semestres sont terminés : seule l'année scolaire contient la date
+    assert code(index.containing(date(2024, 7, 14))) == 1
+    assert index.containing(date(2024, 9, 1)) is None
+    assert index.containing(date(2023, 8, 31)) is None
+
+
+def test_current_prefers_a_running_period_over_an_ended_one():
+    index = PeriodIndex(PERIODES)
+    assert code(index.current(date(2024, 7, 14))) == 1
+    # Aucune période en cours : la dernière commencée
+    assert code(index.current(date(2024, 9, 1))) == 4
+
+
+def test_period_without_end_date_stays_open():
+    index = PeriodIndex({"1": periode(1, "01/09/2023", None), "2": periode(2, "01/10/2023", "31/10/2023")})
+    assert code(index.containing(date(2024, 5, 1))) == 1